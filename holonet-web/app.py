@@ -39,11 +39,13 @@ from logging.handlers import RotatingFileHandler
 import os
 import os.path
 
-from flask import Flask, redirect, render_template, request, \
+from flask import Flask, jsonify, redirect, render_template, request, \
     send_from_directory, url_for
 from flask_webpack import Webpack
 
-from holonet import mailboxes, queue_manager, system_manager
+from holonet import compression, mailbox_store, mailboxes, message, \
+    port_discovery, queue_manager, rockblock_stats, signal_scheduler, \
+    system_manager
 from holonet.utils import printable_phone_number
 
 
@@ -79,6 +81,20 @@ if not is_gunicorn:
         os.path.abspath(os.path.join(dev_root, 'mailboxes'))
     system_manager.system_manager_root = \
         os.path.abspath(os.path.join(dev_root, 'system_manager'))
+    port_discovery.cache_file = \
+        os.path.abspath(os.path.join(dev_root, 'rockblock_port.json'))
+    signal_scheduler.history_file = \
+        os.path.abspath(os.path.join(dev_root, 'signal_history.json'))
+
+mailboxes.storage_backend = app.config.get(
+    'HOLONET_MAILBOX_BACKEND', mailbox_store.BACKEND_DIRECTORY)
+queue_manager.pack_outbox = app.config.get('HOLONET_PACK_OUTBOX', False)
+queue_manager.fragment_outbox = \
+    app.config.get('HOLONET_FRAGMENT_OUTBOX', False)
+queue_manager.outbox_codec = \
+    app.config.get('HOLONET_OUTBOX_CODEC', compression.CODEC_NONE)
+queue_manager.max_send_attempts = app.config.get(
+    'HOLONET_MAX_SEND_ATTEMPTS', queue_manager.max_send_attempts)
 
 if is_flask_subprocess or is_gunicorn:
     queue_manager.start(app.config.get('ROCKBLOCK_DEVICE'))
@@ -87,6 +103,25 @@ if is_gunicorn:
     system_manager.safety_catch = False
 
 
+# Choices for how long to keep trying to send a message, in seconds.
+TTL_CHOICES = (
+    (None, 'Until sent'),
+    (3600, '1 hour'),
+    (6 * 3600, '6 hours'),
+    (24 * 3600, '1 day'),
+    (3 * 24 * 3600, '3 days'),
+)
+
+
+@app.context_processor
+def send_options():
+    return {
+        'default_priority': message.PRIORITY_NORMAL,
+        'priorities': sorted(message.PRIORITY_LABELS.items(), reverse=True),
+        'ttl_choices': TTL_CHOICES,
+    }
+
+
 @app.route('/')
 def index():
     # Note that this is an async request to refresh the signal strength.  If
@@ -97,19 +132,20 @@ def index():
     queue_manager.request_signal_strength()
 
     outbox = mailboxes.read_outbox()
+    dead_letter = mailboxes.read_dead_letter()
     local_user = _get_local_user()
-    recipients = mailboxes.list_recipients(local_user)
-    recipients_printable = _printable_phone_number_dict(recipients)
-    pending = queue_manager.message_pending_senders.keys()
+    threads = mailboxes.list_threads(local_user)
+    status = queue_manager.get_status()
+    pending = sorted(status.pending_senders)
     pending_printable = _printable_phone_number_dict(pending)
-    signal = queue_manager.last_known_signal_strength
+    signal = status.signal_strength
 
     return render_template('index.html',
                            outbox=outbox,
+                           dead_letter=dead_letter,
                            pending=pending,
                            pending_printable=pending_printable,
-                           recipients=recipients,
-                           recipients_printable=recipients_printable,
+                           threads=threads,
                            signal=signal)
 
 
@@ -133,6 +169,9 @@ def network_configure():
 def send_message():
     body = request.form.get('body')
     recipient = request.form.get('recipient')
+    priority = _form_choice('priority', message.PRIORITY_LABELS,
+                            message.PRIORITY_NORMAL)
+    ttl = _form_choice('ttl', [secs for (secs, _) in TTL_CHOICES], None)
 
     resp = _response_return_to_previous()
 
@@ -141,12 +180,28 @@ def send_message():
 
     local_user = _get_local_user()
 
-    mailboxes.queue_message_send(local_user, recipient, body)
+    mailboxes.queue_message_send(local_user, recipient, body,
+                                 priority=priority, ttl=ttl)
     queue_manager.check_outbox()
 
     return resp
 
 
+def _form_int(name, default):
+    try:
+        return int(request.form.get(name))
+    except (TypeError, ValueError):
+        return default
+
+
+def _form_choice(name, choices, default):
+    value = _form_int(name, default)
+    if value not in choices:
+        app.logger.warning('Ignoring bad value for %s: %s', name, value)
+        return default
+    return value
+
+
 @app.route('/send_receive', methods=['POST'])
 def send_receive():
     queue_manager.check_outbox()
@@ -155,6 +210,11 @@ def send_receive():
     return _response_return_to_previous()
 
 
+@app.route('/rockblock_stats')
+def rockblock_stats_json():
+    return jsonify(rockblock_stats.snapshot())
+
+
 @app.route('/system')
 def system():
     # Note that this is an async request to refresh the signal strength,
@@ -186,12 +246,19 @@ def test():
 
 @app.route('/thread/<recipient>')
 def thread(recipient):
-    queue_manager.clear_message_pending(recipient)
     local_user = _get_local_user()
-    messages = mailboxes.get_thread(local_user, recipient)
+    queue_manager.clear_message_pending(recipient, local_user)
+    before = request.args.get('before')
+    try:
+        (messages, older) = mailboxes.get_thread_page(local_user, recipient,
+                                                      before=before)
+    except ValueError:
+        return redirect(url_for('thread', recipient=recipient))
     recipient_printable = printable_phone_number(recipient)
     return render_template('thread.html',
                            messages=messages,
+                           older=older,
+                           newer=before is not None,
                            recipient=recipient,
                            recipient_printable=recipient_printable)
 
@@ -205,8 +272,8 @@ def thread_delete_by_get(recipient):
     return _thread_delete(recipient)
 
 def _thread_delete(recipient):
-    queue_manager.clear_message_pending(recipient)
     local_user = _get_local_user()
+    queue_manager.clear_message_pending(recipient, local_user)
     messages = mailboxes.delete_thread(local_user, recipient)
     return _response_return_to_previous()
 
@@ -0,0 +1,258 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Incremental parser for the RockBLOCK's AT command responses.
+
+Bytes are fed in as they arrive from the serial line, in chunks of any size,
+and come out as complete tokens: command echoes, final result codes,
+intermediate response lines, unsolicited lines (SBDRING), and the binary
+frame that follows AT+SBDRB.  ATTokenReader wraps a parser around a blocking
+read function for the synchronous driver.
+'''
+
+from collections import deque, namedtuple
+import time
+
+
+ECHO = 'echo'
+RESULT = 'result'
+INTERMEDIATE = 'intermediate'
+UNSOLICITED = 'unsolicited'
+FRAME = 'frame'
+BAD_FRAME = 'bad_frame'
+# Too many bytes without a line ending; see ATTokenReader.
+NOISE = 'noise'
+
+RESULT_CODES = (b'OK', b'ERROR', b'READY', b'HARDWARE FAILURE')
+UNSOLICITED_CODES = (b'SBDRING',)
+
+# AT+SBDRB response: 2-byte length, message, 2-byte checksum.
+FRAME_LENGTH_SIZE = 2
+FRAME_CHECKSUM_SIZE = 2
+FRAME_COMMAND = b'AT+SBDRB'
+
+# The most that ATTokenReader will buffer without completing a token.  The
+# longest legitimate token is an MT frame: 2 + 270 + 2 bytes.
+MAX_PENDING = 1024
+
+
+ATToken = namedtuple('ATToken', ['kind', 'data'])
+
+
+class ATResponseParser(object):
+    def __init__(self):
+        self._buf = bytearray()
+        self._in_frame = False
+
+
+    def reset(self):
+        """Discard any partial line or frame, e.g. after a timeout.
+
+        Returns: the discarded bytes.
+        """
+        result = bytes(self._buf)
+        self._buf = bytearray()
+        self._in_frame = False
+        return result
+
+
+    def pending(self):
+        """Returns: the number of bytes buffered but not yet tokenized."""
+        return len(self._buf)
+
+
+    def feed(self, data):
+        """
+        Args:
+            data (bytes): The next chunk read from the serial line.
+
+        Returns: list of ATTokens completed by this chunk, in order.
+        """
+        self._buf += data
+        result = []
+        while True:
+            if self._in_frame:
+                token = self._take_frame()
+            else:
+                token = self._take_line()
+            if token is None:
+                return result
+            if token is not False:
+                result.append(token)
+
+
+    def _take_line(self):
+        """
+        Returns: the next token, None if there's no complete line buffered,
+        or False if the line was empty.
+        """
+        buf = self._buf
+        cr = buf.find(b'\r')
+        lf = buf.find(b'\n')
+        if cr == -1 and lf == -1:
+            return None
+        i = lf if cr == -1 or (lf != -1 and lf < cr) else cr
+
+        line = bytes(buf[:i])
+        del buf[:i + 1]
+        if not line:
+            return False
+
+        kind = classify_line(line)
+        if kind == ECHO and line.upper() == FRAME_COMMAND:
+            # The frame starts straight after the \r that terminates the
+            # echo, so it must not be skipped as an empty line.
+            self._in_frame = True
+        return ATToken(kind, line)
+
+
+    def _take_frame(self):
+        buf = self._buf
+        if len(buf) < FRAME_LENGTH_SIZE:
+            return None
+        length = int.from_bytes(buf[:FRAME_LENGTH_SIZE], byteorder='big')
+        total = FRAME_LENGTH_SIZE + length + FRAME_CHECKSUM_SIZE
+        if len(buf) < total:
+            return None
+
+        payload = bytes(buf[FRAME_LENGTH_SIZE:FRAME_LENGTH_SIZE + length])
+        checksum = int.from_bytes(buf[total - FRAME_CHECKSUM_SIZE:total],
+                                  byteorder='big')
+        del buf[:total]
+        self._in_frame = False
+
+        kind = FRAME if checksum == sbd_checksum(payload) else BAD_FRAME
+        return ATToken(kind, payload)
+
+
+class ATTokenReader(object):
+    """
+    Reads ATTokens using a blocking read function, such as a wrapper around
+    pyserial's Serial.read.  Every read has a deadline, at most max_pending
+    bytes are buffered, and unsolicited lines are passed to on_unsolicited
+    rather than returned.
+    """
+
+    def __init__(self, read, on_unsolicited=None, max_pending=MAX_PENDING):
+        """
+        Args:
+            read (function): Called with a timeout in seconds, and returns
+                whatever bytes arrive in that time (b'' if none).
+            on_unsolicited (function): Called with each UNSOLICITED
+                ATToken.
+            max_pending (int): See MAX_PENDING.
+        """
+        self._read = read
+        self.on_unsolicited = on_unsolicited
+        self.max_pending = max_pending
+        self.parser = ATResponseParser()
+        self._tokens = deque()
+
+
+    def read_token(self, deadline):
+        """
+        Args:
+            deadline (float): time.monotonic() by which to give up.
+
+        Returns: the next ATToken, or None if none completed before the
+        deadline (in which case any partial line stays buffered).  If the
+        buffer overflows, everything buffered is discarded and returned as
+        a NOISE token.
+        """
+        while True:
+            while self._tokens:
+                token = self._tokens.popleft()
+                if token.kind != UNSOLICITED:
+                    return token
+                if self.on_unsolicited is not None:
+                    self.on_unsolicited(token)
+
+            if self.parser.pending() > self.max_pending:
+                return ATToken(NOISE, self.discard())
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            data = self._read(remaining)
+            if data:
+                self._tokens.extend(self.parser.feed(data))
+
+
+    def drain(self):
+        """Read whatever has already arrived, pass on any unsolicited lines
+        in it (and in what's buffered), and then discard the rest, e.g.
+        before a command whose response mustn't be mixed up with leftovers.
+
+        Returns: the discarded bytes, as for discard.
+        """
+        while True:
+            data = self._read(0)
+            if not data:
+                break
+            self._tokens.extend(self.parser.feed(data))
+        tokens = self._tokens
+        self._tokens = deque()
+        for token in tokens:
+            if token.kind != UNSOLICITED:
+                self._tokens.append(token)
+            elif self.on_unsolicited is not None:
+                self.on_unsolicited(token)
+        return self.discard()
+
+
+    def discard(self):
+        """Discard everything buffered, e.g. before resyncing.
+
+        Returns: the discarded bytes, with the lines of any complete but
+        unread tokens rejoined.
+        """
+        lines = [t.data + b'\r\n' for t in self._tokens]
+        self._tokens.clear()
+        return b''.join(lines) + self.parser.reset()
+
+
+def classify_line(line):
+    """Returns: the token kind for the given complete, non-empty line."""
+    if line[:2].upper() == b'AT':
+        return ECHO
+    if line in RESULT_CODES:
+        return RESULT
+    if line in UNSOLICITED_CODES:
+        return UNSOLICITED
+    return INTERMEDIATE
+
+
+def sbd_checksum(data):
+    """Returns: the SBD checksum (the low 16 bits of the byte sum)."""
+    return sum(data) & 0xffff
@@ -0,0 +1,344 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Compression of SBD payloads.
+
+Each message record (in the legacy "number:body" format) may be encoded with
+one of the codecs here, in which case it starts with that codec's one-byte
+tag.  The tags can never start a legacy record (which is UTF-8 text), so
+decode() accepts either, and unencoded records are still understood by
+everything downstream.
+
+    ZLIB: raw deflate with a preset dictionary of SMS-style text, so that
+        even a short message has something to refer back to.
+    SMAZ: a short-string coder in the style of SMAZ, where each byte is an
+        index into a codebook of common fragments.
+    BINARY: the compact binary format from holonet.wire_format, with the
+        number in BCD and the text in GSM-7 where possible.
+
+CODEC_SMALLEST tries each of them and keeps whichever is smallest (which
+may be the message unencoded).  The dictionary and codebook are part of the
+wire format: never change them; add a new tag instead.
+
+Run this module directly to see how well each codec does on a sample
+corpus, or on files of messages, one per line.
+'''
+
+import argparse
+import zlib
+
+from . import wire_format
+
+
+TAG_ZLIB = 0xf8
+TAG_SMAZ = 0xf9
+TAG_BINARY = wire_format.TAG_BINARY
+
+CODEC_NONE = 'none'
+CODEC_ZLIB = 'zlib'
+CODEC_SMAZ = 'smaz'
+CODEC_BINARY = 'binary'
+CODEC_SMALLEST = 'smallest'
+CODECS = (CODEC_NONE, CODEC_ZLIB, CODEC_SMAZ, CODEC_BINARY)
+
+# SBD messages are billed in credits of this many bytes.
+CREDIT_SIZE = 50
+
+
+class CompressionException(Exception):
+    pass
+
+
+# Most frequent strings last, because they're cheapest to refer to there.
+ZLIB_DICTIONARY = (
+    b'weather forecast storm wind rain snow trail summit ridge camp '
+    b'water food supplies battery charge GPS position coordinates miles km '
+    b'arrive arrived leaving left heading north south east west '
+    b'tomorrow morning afternoon evening tonight today yesterday '
+    b'please call me when you get this message '
+    b'let me know if you need anything '
+    b'can you send pick us up at the '
+    b'we are all safe and well, '
+    b'everything is fine here. '
+    b'Did you get my message? '
+    b'How are you doing? '
+    b'What time will you be back? '
+    b'I will be home soon. '
+    b'See you soon! Love you. Miss you. '
+    b'Thank you, thanks! OK, ok. Yes, no. '
+    b'Where are you now? I am at the '
+    b'We are going to be there in about an hour. '
+    b'I love you and I miss you. '
+    b'+1415:+1650:+1408:+1510:+1:'
+)
+
+SMAZ_CODEBOOK = (
+    ' ', 'e', 't', 'a', 'o', 'i', 'n', 's', 'r', 'h', 'l', 'd', 'u', 'c',
+    'm', 'w', 'y', 'f', 'g', 'p', 'b', 'v', 'k', 'j', 'x', 'q', 'z',
+    '.', ',', '?', '!', "'", ':', '+', '-', '/', '\n',
+    '0', '1', '2', '3', '4', '5', '6', '7', '8', '9',
+    'I', 'A', 'T', 'W', 'S', 'H', 'O', 'Y', 'N', 'M', 'C', 'B', 'D', 'L',
+    'G', 'P', 'E', 'R', 'F',
+    'e ', 's ', 't ', 'd ', 'y ', 'n ', 'r ', 'o ', '. ', ', ', '? ', '! ',
+    ' t', ' a', ' s', ' w', ' i', ' o', ' b', ' c', ' m', ' h', ' f', ' y',
+    ' l', ' d', ' n', ' g', ' p',
+    'th', 'he', 'in', 'er', 'an', 're', 'on', 'at', 'en', 'nd', 'ti', 'es',
+    'or', 'te', 'of', 'ed', 'is', 'it', 'al', 'ar', 'st', 'to', 'nt', 'ng',
+    'se', 'ha', 'as', 'ou', 'io', 'le', 've', 'co', 'me', 'de', 'hi', 'ri',
+    'ro', 'ic', 'ne', 'ea', 'ra', 'ce', 'li', 'ch', 'll', 'be', 'ma', 'si',
+    'om', 'ur', 'ee', 'oo', 'wh', 'ay', 'ow', 'ok', 'OK',
+    'the', 'and', 'ing', 'you', 'are', 'for', 'ent', 'ion', 'her', 'was',
+    'all', 'not', 'but', 'can', 'get', 'got', 'now', 'how', 'see', 'out',
+    'our', 'day', 'has',
+    ' the ', ' and ', ' you', ' to ', ' of ', ' in ', ' is ', ' it ',
+    ' at ', ' on ', ' be ', ' we ', ' are ', ' for ', ' will ', ' have ',
+    ' with ', ' that ', ' this ', ' from ', ' here', ' there', ' where',
+    ' what', ' when', ' back', ' home', ' soon', ' safe', ' camp',
+    ' water', ' food', ' need', ' know', ' love', ' miss', ' call',
+    ' today', ' tomorrow', ' tonight', ' morning', ' weather', ' message',
+    ' please', ' thanks', ' just', ' going', ' good', ' fine', ' well',
+    ' help', ' trail', ' storm', ' battery', ' hour',
+    'Thanks', 'thanks', 'Thank you', 'Love you', 'love you', 'I am ',
+    "I'm ", 'We are ', 'we are ', 'Are you ', 'are you ', 'Hi ', 'Hey ',
+    'Yes', 'No ', 'All ', 'OK ', 'ok ', 'See you', 'Where ', 'When ',
+    'What ', 'How ',
+)
+
+SMAZ_VERBATIM_BYTE = 0xfe
+SMAZ_VERBATIM_RUN = 0xff
+SMAZ_MAX_RUN = 255
+
+_SMAZ_ENTRIES = [s.encode('ascii') for s in SMAZ_CODEBOOK]
+_SMAZ_INDEX = {s: i for (i, s) in enumerate(_SMAZ_ENTRIES)}
+_SMAZ_MAX_ENTRY = max(len(s) for s in _SMAZ_ENTRIES)
+assert len(_SMAZ_INDEX) == len(_SMAZ_ENTRIES) <= SMAZ_VERBATIM_BYTE
+
+# A sample of the sort of thing that people send, for main().
+SAMPLE_CORPUS = (
+    '+14158008000:We are all safe and well, at camp now.',
+    '+14158008000:Did you get my message?',
+    '+16505551234:Storm coming in from the west. Staying put tonight.',
+    '+14158008000:Thanks! Love you.',
+    '+14085550000:Where are you now?',
+    '+14158008000:Arrived at the summit at 11:30. Heading back down.',
+    '+15105559876:Can you send more water and food to the north trail '
+    'camp tomorrow morning?',
+    '+14158008000:OK',
+    '+14158008000:Battery at 40%. Will check in again at 6pm.',
+    '+16505551234:Everything is fine here. See you soon!',
+    '+14158008000:What time will you be back?',
+    '+14085550000:Please call me when you get this message.',
+    '+14158008000:GPS 37.7749 N 122.4194 W. All good.',
+    '+15105559876:Miss you! How is the weather there?',
+    '+14158008000:Running late, we are going to be there in about an hour.',
+    '+14158008000:Need help. Twisted ankle, 2 miles south of the ridge.',
+    '+16505551234:Yes',
+    '+14158008000:No change. Still waiting for the wind to drop.',
+    '+14085550000:Happy birthday!! Wish I was there with you.',
+    '+14158008000:Leaving camp now, should be home by Sunday.',
+)
+
+
+def encode(data, codec=CODEC_SMALLEST):
+    """
+    Args:
+        data (bytes): A message record.
+        codec (str): One of the CODEC_* values.
+
+    Returns: the encoded record.
+    """
+    if codec == CODEC_NONE:
+        return data
+    if codec == CODEC_ZLIB:
+        return bytes([TAG_ZLIB]) + zlib_compress(data)
+    if codec == CODEC_SMAZ:
+        return bytes([TAG_SMAZ]) + smaz_compress(data)
+    if codec == CODEC_BINARY:
+        try:
+            return wire_format.encode_record(data)
+        except wire_format.WireFormatException:
+            # Not a "number:body" record that it can represent.
+            return data
+    if codec == CODEC_SMALLEST:
+        return min((encode(data, c) for c in CODECS), key=len)
+    raise ValueError('Unknown codec %s' % codec)
+
+
+def decode(data):
+    """
+    Args:
+        data (bytes): A record that may have been encoded with encode().
+
+    Returns: the original record.
+
+    Raises: CompressionException if the data is corrupt.
+    """
+    if not data:
+        return data
+    tag = data[0]
+    if tag == TAG_ZLIB:
+        return zlib_decompress(data[1:])
+    if tag == TAG_SMAZ:
+        return smaz_decompress(data[1:])
+    if tag == TAG_BINARY:
+        try:
+            return wire_format.decode_record(data)
+        except wire_format.WireFormatException as err:
+            raise CompressionException(str(err))
+    return data
+
+
+def zlib_compress(data):
+    c = zlib.compressobj(level=9, wbits=-15, zdict=ZLIB_DICTIONARY)
+    return c.compress(data) + c.flush()
+
+
+def zlib_decompress(data):
+    d = zlib.decompressobj(wbits=-15, zdict=ZLIB_DICTIONARY)
+    try:
+        result = d.decompress(data) + d.flush()
+    except zlib.error as err:
+        raise CompressionException(str(err))
+    if not d.eof:
+        raise CompressionException('Truncated zlib data.')
+    return result
+
+
+def smaz_compress(data):
+    result = bytearray()
+    verbatim = bytearray()
+
+    def flush_verbatim():
+        for i in range(0, len(verbatim), SMAZ_MAX_RUN):
+            run = verbatim[i:i + SMAZ_MAX_RUN]
+            if len(run) == 1:
+                result.append(SMAZ_VERBATIM_BYTE)
+            else:
+                result.append(SMAZ_VERBATIM_RUN)
+                result.append(len(run))
+            result.extend(run)
+        verbatim.clear()
+
+    i = 0
+    while i < len(data):
+        for n in range(min(_SMAZ_MAX_ENTRY, len(data) - i), 0, -1):
+            index = _SMAZ_INDEX.get(data[i:i + n])
+            if index is not None:
+                flush_verbatim()
+                result.append(index)
+                i += n
+                break
+        else:
+            verbatim.append(data[i])
+            i += 1
+    flush_verbatim()
+    return bytes(result)
+
+
+def smaz_decompress(data):
+    result = bytearray()
+    i = 0
+    try:
+        while i < len(data):
+            b = data[i]
+            if b == SMAZ_VERBATIM_BYTE:
+                result.append(data[i + 1])
+                i += 2
+            elif b == SMAZ_VERBATIM_RUN:
+                n = data[i + 1]
+                if i + 2 + n > len(data):
+                    raise CompressionException('Truncated SMAZ run.')
+                result += data[i + 2:i + 2 + n]
+                i += 2 + n
+            else:
+                result += _SMAZ_ENTRIES[b]
+                i += 1
+    except IndexError:
+        raise CompressionException('Bad SMAZ data at offset %d.' % i)
+    return bytes(result)
+
+
+def credits(size):
+    """Returns: the number of SBD credits that a payload of size costs."""
+    return max(1, (size + CREDIT_SIZE - 1) // CREDIT_SIZE)
+
+
+def benchmark(records):
+    """
+    Returns: dict of codec to dict of total 'bytes', 'ratio' and 'credits'
+    over the given records.
+    """
+    result = {}
+    raw_size = sum(len(r) for r in records)
+    for codec in CODECS + (CODEC_SMALLEST,):
+        encoded = [encode(r, codec) for r in records]
+        for (r, e) in zip(records, encoded):
+            assert decode(e) == r
+        size = sum(len(e) for e in encoded)
+        result[codec] = {
+            'bytes': size,
+            'ratio': size / raw_size if raw_size else 1.0,
+            'credits': sum(credits(len(e)) for e in encoded),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Report how well each codec compresses messages.')
+    parser.add_argument('files', nargs='*',
+                        help='Files of messages, one per line (default: '
+                        'a built-in sample).')
+    args = parser.parse_args()
+
+    if args.files:
+        lines = []
+        for fname in args.files:
+            with open(fname, 'r') as f:
+                lines += [line.rstrip('\n') for line in f if line.strip()]
+    else:
+        lines = SAMPLE_CORPUS
+    records = [line.encode('utf-8') for line in lines]
+
+    print('%d messages, %d bytes' % (len(records),
+                                     sum(len(r) for r in records)))
+    result = benchmark(records)
+    for codec in CODECS + (CODEC_SMALLEST,):
+        r = result[codec]
+        print('%-10s %6d bytes  ratio %.3f  %4d credits' % (
+            codec, r['bytes'], r['ratio'], r['credits']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+A persistent record of which MT messages we've already delivered to the
+inbox, so that a message that arrives twice is only delivered once.
+
+This happens when a session is retried after a resync, or when the MT
+buffer is read twice: the gateway sends the message again, with the same
+MTMSN.  MTMSNs are only 16 bits, and some gateways reuse them, so a message
+is identified by its MTMSN and a hash of its content together.
+
+Entries are dropped after MAX_AGE, or when there are more than
+MAX_ENTRIES, oldest first.
+'''
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from .utils import write_file
+
+
+MAX_AGE = 7 * 24 * 3600
+MAX_ENTRIES = 1000
+
+
+_logger = logging.getLogger('holonet.dedup_index')
+
+
+def message_key(mtmsn, data):
+    """Returns: the key that identifies the given MT message."""
+    return '%d:%s' % (mtmsn, hashlib.sha256(data).hexdigest()[:32])
+
+
+class DedupIndex(object):
+    def __init__(self, path, max_age=MAX_AGE, max_entries=MAX_ENTRIES):
+        """
+        Args:
+            path (str): Where to keep the index.  It's created if necessary.
+            max_age (float): Seconds to remember each message for.
+            max_entries (int): The most messages to remember.
+        """
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        # Key: message_key; value: when we saw it, in seconds since the
+        # epoch.
+        self._seen = {}
+        self._lock = threading.Lock()
+        self.load()
+
+
+    def __contains__(self, key):
+        return key in self._seen
+
+
+    def __len__(self):
+        return len(self._seen)
+
+
+    def add(self, key, now=None):
+        """Remember that we've delivered the message with the given key."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._seen[key] = now
+            self._evict(now)
+            data = json.dumps({'seen': self._seen})
+        self._save(data)
+
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                seen = json.load(f)['seen']
+        except FileNotFoundError:
+            return
+        except Exception as err:
+            _logger.warning('Ignoring bad dedup index in %s: %s', self.path,
+                            err)
+            return
+        with self._lock:
+            self._seen = {k: float(t) for (k, t) in seen.items()}
+            self._evict(time.time())
+
+
+    def _evict(self, now):
+        cutoff = now - self.max_age
+        keys = sorted(self._seen, key=self._seen.get)
+        excess = len(keys) - self.max_entries
+        for (i, k) in enumerate(keys):
+            if i >= excess and self._seen[k] >= cutoff:
+                break
+            del self._seen[k]
+
+
+    def _save(self, data):
+        try:
+            write_file(self.path, data)
+        except Exception as err:
+            _logger.warning('Failed to write %s: %s', self.path, err)
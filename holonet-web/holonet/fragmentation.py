@@ -0,0 +1,150 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Segmentation and reassembly of messages that are too long for one SBD
+payload.
+
+Each fragment is:
+
+    FRAGMENT_MAGIC (1 byte), version (1 byte), message ID (2 bytes),
+    fragment index (1 byte), fragment count (1 byte), data
+
+where the data of all the fragments, in index order, is the whole message in
+the legacy "number:body" format.  Fragments may arrive in any order, and in
+different sessions; see mailboxes.save_fragment for the receiving end.
+'''
+
+from collections import namedtuple
+import random
+
+from .packing import MAX_PAYLOAD
+
+
+FRAGMENT_MAGIC = 0xfd
+FRAGMENT_VERSION = 1
+HEADER_SIZE = 6
+MAX_FRAGMENT_DATA = MAX_PAYLOAD - HEADER_SIZE
+MAX_FRAGMENTS = 255
+
+# How long to keep the fragments of an incomplete message, in seconds.
+REASSEMBLY_TIMEOUT = 3 * 24 * 3600
+
+
+Fragment = namedtuple('Fragment', ['msg_id', 'index', 'count', 'data'])
+
+
+class FragmentationException(Exception):
+    pass
+
+
+def needs_fragmenting(data):
+    return len(data) > MAX_PAYLOAD
+
+
+def new_message_id():
+    return random.getrandbits(16)
+
+
+def fragment_count(data, size=MAX_FRAGMENT_DATA):
+    return max(1, (len(data) + size - 1) // size)
+
+
+def fragment(data, msg_id, index, size=MAX_FRAGMENT_DATA):
+    """
+    Args:
+        data (bytes): The whole message.
+        msg_id (int): See new_message_id.
+        index (int): Which fragment to return.
+        size (int): The most data to put in each fragment.
+
+    Returns: the index'th fragment of data, as a payload.
+
+    Raises: FragmentationException if data is too long to fragment.
+    """
+    count = fragment_count(data, size)
+    if count > MAX_FRAGMENTS:
+        raise FragmentationException(
+            'Message of %d bytes is too long to fragment.' % len(data))
+    assert 0 <= index < count
+
+    header = bytes([FRAGMENT_MAGIC, FRAGMENT_VERSION]) + \
+        msg_id.to_bytes(2, byteorder='big') + bytes([index, count])
+    return header + data[index * size:(index + 1) * size]
+
+
+def fragment_all(data, msg_id, size=MAX_FRAGMENT_DATA):
+    """Returns: list of all the fragments of data; see fragment."""
+    return [fragment(data, msg_id, i, size)
+            for i in range(fragment_count(data, size))]
+
+
+def is_fragment(payload):
+    return len(payload) > 0 and payload[0] == FRAGMENT_MAGIC
+
+
+def parse(payload):
+    """
+    Returns: the given fragment payload as a Fragment.
+
+    Raises: FragmentationException if it's malformed.
+    """
+    if len(payload) < HEADER_SIZE or not is_fragment(payload):
+        raise FragmentationException('Not a fragment.')
+    if payload[1] != FRAGMENT_VERSION:
+        raise FragmentationException(
+            'Unsupported fragment version %d.' % payload[1])
+    msg_id = int.from_bytes(payload[2:4], byteorder='big')
+    (index, count) = (payload[4], payload[5])
+    if index >= count:
+        raise FragmentationException(
+            'Fragment %d of %d is out of range.' % (index, count))
+    return Fragment(msg_id, index, count, payload[HEADER_SIZE:])
+
+
+def reassemble(fragments):
+    """
+    Args:
+        fragments (list of Fragment): All the fragments of one message, in
+            any order.
+
+    Returns: the whole message.
+
+    Raises: FragmentationException if any are missing.
+    """
+    by_index = {f.index: f for f in fragments}
+    count = fragments[0].count if fragments else 0
+    if not count or sorted(by_index) != list(range(count)):
+        raise FragmentationException(
+            'Have fragments %s of %d.' % (sorted(by_index), count))
+    return b''.join(by_index[i].data for i in range(count))
@@ -0,0 +1,213 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+A cache of parsed messages for holonet.mailbox_store.DirectoryStore, so that
+looking at the same thread again doesn't mean listing its directory and
+reading every file again.
+
+There's an entry for each mailbox directory (a thread, or the dead letter
+box), holding its sorted filenames and whichever of its messages have been
+read.  Writes made through the store update the entry directly.  Anything
+else that changes the directory changes its mtime, and the entry is thrown
+away the next time it's used, so a cache hit costs one stat.
+
+The cache is bounded by the number of messages it holds, and drops the
+least recently used directories first.  It's safe to share between threads.
+Callers get copies of the cached messages, so they can change them.
+'''
+
+import bisect
+import copy
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from .message import Message
+
+
+MAX_MESSAGES = 2000
+
+
+_logger = logging.getLogger('holonet.mailbox_cache')
+
+
+class _Entry(object):
+    def __init__(self, mtime_ns, filenames):
+        self.mtime_ns = mtime_ns
+        # Sorted, so chronological.  This is replaced rather than changed,
+        # so that readers don't need the lock.
+        self.filenames = filenames
+        # Key: filename; value: Message.
+        self.messages = {}
+
+
+class MailboxCache(object):
+    def __init__(self, max_messages=MAX_MESSAGES):
+        self.max_messages = max_messages
+        # Key: directory path; value: _Entry.  Least recently used first.
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+
+    def __len__(self):
+        """Returns: the number of messages in the cache."""
+        return self._size
+
+
+    def filenames(self, path):
+        """
+        Returns: the message filenames in the given directory, sorted
+        chronologically.  Don't change the list.
+        """
+        return self._entry(path).filenames
+
+
+    def read(self, path, filenames=None):
+        """
+        Returns: the messages with the given filenames (by default, all of
+        them) in the given directory, in the same order.  Only the ones that
+        aren't already cached are read.
+        """
+        entry = self._entry(path)
+        if filenames is None:
+            filenames = entry.filenames
+
+        result = []
+        for filename in filenames:
+            msg = entry.messages.get(filename)
+            if msg is None:
+                msg = self._read_message(path, filename)
+                if msg is None:
+                    continue
+                self._add_message(path, entry, filename, msg)
+            result.append(copy.copy(msg))
+        return result
+
+
+    def put(self, path, filename, msg):
+        """Record that msg has just been written to filename in path."""
+        msg = copy.copy(msg)
+        msg.filename = filename
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return
+            mtime_ns = _mtime_ns(path)
+            if mtime_ns is None:
+                self._remove(path)
+                return
+            entry.mtime_ns = mtime_ns
+            i = bisect.bisect_left(entry.filenames, filename)
+            if i == len(entry.filenames) or entry.filenames[i] != filename:
+                entry.filenames = (entry.filenames[:i] + [filename] +
+                                   entry.filenames[i:])
+            if filename not in entry.messages:
+                self._size += 1
+            entry.messages[filename] = msg
+            self._evict()
+
+
+    def invalidate(self, path):
+        with self._lock:
+            self._remove(path)
+
+
+    def _entry(self, path):
+        mtime_ns = _mtime_ns(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.mtime_ns == mtime_ns:
+                self._entries.move_to_end(path)
+                return entry
+            self._remove(path)
+
+        if mtime_ns is None:
+            return _Entry(None, [])
+        filenames = sorted(_list_mailbox(path))
+        entry = _Entry(mtime_ns, filenames)
+        with self._lock:
+            self._remove(path)
+            self._entries[path] = entry
+        return entry
+
+
+    def _add_message(self, path, entry, filename, msg):
+        with self._lock:
+            if self._entries.get(path) is not entry or \
+                    filename in entry.messages:
+                return
+            entry.messages[filename] = msg
+            self._size += 1
+            self._evict()
+
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._size -= len(entry.messages)
+
+
+    def _evict(self):
+        while self._size > self.max_messages and self._entries:
+            (path, entry) = self._entries.popitem(last=False)
+            self._size -= len(entry.messages)
+
+
+    def _read_message(self, path, filename):
+        msg_path = os.path.join(path, filename)
+        try:
+            with open(msg_path, 'r') as f:
+                msg = Message(json.load(f))
+        except Exception as err:
+            _logger.error('Failed to read %s!  %s', msg_path, err)
+            return None
+        msg.filename = filename
+        return msg
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _list_mailbox(path):
+    try:
+        return [f for f in os.listdir(path) if f.endswith('.json')]
+    except Exception as err:
+        _logger.error('Failed to list %s even though it exists!  %s', path,
+                      err)
+        return []
@@ -0,0 +1,777 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Storage backends for holonet.mailboxes.
+
+DirectoryStore is the original layout: a JSON file per message, in a
+directory per mailbox (and per thread), plus the outbox journal (see
+holonet.outbox_index).  SQLiteStore keeps the same mailboxes in an SQLite
+database in WAL mode, where reading a thread or listing recipients is an
+indexed query rather than a directory scan and a file read per message.
+
+Messages are identified within each mailbox by their filename, which is a
+timestamp (see utils.timestamp_filename), so ordering by filename is
+chronological, whichever backend is used.  Fragments of incoming messages
+are short-lived and stay as files either way.
+
+Changes made inside a store's transaction() are committed together, so
+that either all or none of them survive losing power, for the price of one
+fsync round.  SQLiteStore uses an SQLite transaction.  DirectoryStore
+appends the changes to its journal (TRANSACTION_JOURNAL) as one line of
+JSON, fsyncs that, and then writes the message files without fsyncing them.
+Every CHECKPOINT_TRANSACTIONS transactions, and when the store is closed,
+it fsyncs the files and directories that it's changed and empties the
+journal.  Any transactions left in the journal when the store is opened
+(because we lost power) are applied again.
+'''
+
+import bisect
+import contextlib
+import json
+import logging
+import os
+import os.path
+import shutil
+import sqlite3
+import threading
+
+from .mailbox_cache import MailboxCache
+from .message import Message
+from .outbox_index import OutboxIndex
+from .utils import mkdir_p, utcnow_str, write_file
+
+
+BACKEND_DIRECTORY = 'directory'
+BACKEND_SQLITE = 'sqlite'
+BACKENDS = (BACKEND_DIRECTORY, BACKEND_SQLITE)
+
+# The outbox journal, in the outbox directory of a DirectoryStore.
+OUTBOX_JOURNAL = 'journal'
+# The thread summaries (see holonet.summary_index) of a DirectoryStore, in
+# the mailboxes root.
+THREAD_SUMMARIES = 'thread_summaries.json'
+# The transaction journal of a DirectoryStore, in the mailboxes root.
+TRANSACTION_JOURNAL = 'mailboxes.journal'
+CHECKPOINT_TRANSACTIONS = 100
+# The database of an SQLiteStore, in the mailboxes root.
+SQLITE_DB = 'mailboxes.sqlite3'
+
+SCHEMA_VERSION = 1
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS threads (
+    local_user TEXT NOT NULL,
+    remote_user TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (local_user, remote_user, filename)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS outbox (
+    filename TEXT PRIMARY KEY,
+    message TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS dead_letter (
+    filename TEXT PRIMARY KEY,
+    message TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS inbox (
+    filename TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+'''
+
+
+_logger = logging.getLogger('holonet.mailbox_store')
+
+
+def open_store(backend, root):
+    """
+    Args:
+        backend (str): One of BACKENDS.
+        root (str): The mailboxes root directory.
+
+    Returns: the store.  An SQLiteStore is first given anything that's in
+    a directory layout under root, if it hasn't been already.
+    """
+    if backend == BACKEND_DIRECTORY:
+        return DirectoryStore(root)
+    if backend == BACKEND_SQLITE:
+        store = SQLiteStore(os.path.join(root, SQLITE_DB))
+        if not store.migrated():
+            old = DirectoryStore(root)
+            try:
+                store.migrate_from(old)
+            finally:
+                old.close()
+        return store
+    raise ValueError('Unknown mailbox backend %s' % backend)
+
+
+class DirectoryStore(object):
+    # pylint: disable=missing-docstring,no-self-use
+    def __init__(self, root):
+        self.root = root
+        self._cache = MailboxCache()
+        self._outbox_index = None
+        self._outbox_lock = threading.Lock()
+        # Held while committing (and so while applying changes or
+        # checkpointing).
+        self._commit_lock = threading.RLock()
+        # .changes is the change list of the current thread's transaction.
+        self._local = threading.local()
+        self._journal = None
+        self._journal_path = os.path.join(root, TRANSACTION_JOURNAL)
+        self._journal_records = 0
+        # Files and directories that have been changed since the last
+        # checkpoint, and need fsyncing.
+        self._dirty_files = set()
+        self._dirty_dirs = set()
+        self._dirty_outbox = False
+        self._recover()
+
+
+    def close(self):
+        with self._commit_lock:
+            if self._journal is not None:
+                self._checkpoint()
+                self._journal.close()
+                self._journal = None
+        with self._outbox_lock:
+            if self._outbox_index is not None:
+                self._outbox_index.close()
+                self._outbox_index = None
+
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Commit the changes that this thread makes in the with block together,
+        when it ends, unless it raises.  Reads in the block don't see the
+        changes.  Transactions nest; only the outermost one commits.
+        """
+        if getattr(self._local, 'changes', None) is not None:
+            yield
+            return
+        changes = self._local.changes = []
+        try:
+            yield
+        finally:
+            self._local.changes = None
+        if changes:
+            self._commit(changes)
+
+
+    def list_local_users(self):
+        try:
+            return sorted(
+                d for d in os.listdir(self.root)
+                if os.path.isdir(os.path.join(self.root, d, 'thread')))
+        except FileNotFoundError:
+            return []
+
+
+    def list_recipients(self, local_user):
+        threadboxes_path = self._path_of_threadboxes(local_user)
+        if not os.path.exists(threadboxes_path):
+            return []
+
+        try:
+            return sorted([d for d in os.listdir(threadboxes_path)
+                           if not d.startswith('.')])
+        except Exception as err:
+            _logger.error(
+                'Error: failed to list %s even though it exists!  %s',
+                threadboxes_path, err)
+            return []
+
+
+    def read_thread(self, local_user, remote_user):
+        return self._cache.read(
+            self._path_of_threadbox(local_user, remote_user))
+
+
+    def read_thread_page(self, local_user, remote_user, limit, before=None):
+        # The directory still has to be listed (if it's not cached), but only
+        # the files on this page are read.
+        threadbox_path = self._path_of_threadbox(local_user, remote_user)
+        filenames = self._cache.filenames(threadbox_path)
+        if before is not None:
+            filenames = filenames[:bisect.bisect_left(filenames, before)]
+        page = filenames[max(len(filenames) - limit, 0):]
+        more = len(filenames) > limit
+        return (self._cache.read(threadbox_path, page), more)
+
+
+    def read_thread_message(self, local_user, remote_user, filename):
+        threadbox_path = self._path_of_threadbox(local_user, remote_user)
+        msgs = self._cache.read(threadbox_path, [filename])
+        return msgs[0] if msgs else None
+
+
+    def put_thread_message(self, local_user, remote_user, filename, msg):
+        self._put_message(self._path_of_threadbox(local_user, remote_user),
+                          filename, msg)
+
+
+    def delete_thread(self, local_user, remote_user):
+        threadbox_path = self._path_of_threadbox(local_user, remote_user)
+        self._change({'op': 'rmtree', 'path': self._relpath(threadbox_path)})
+
+
+    def read_outbox(self):
+        return self._outbox().messages()
+
+
+    def outbox_contains(self, filename):
+        return filename in self._outbox()
+
+
+    def outbox_size(self):
+        return len(self._outbox())
+
+
+    def put_outbox(self, filename, msg):
+        self._change({'op': 'outbox_put', 'filename': filename,
+                      'message': msg.to_json()})
+
+
+    def remove_outbox(self, filename):
+        if filename not in self._outbox():
+            return False
+        self._change({'op': 'outbox_del', 'filename': filename})
+        return True
+
+
+    def read_dead_letter(self):
+        return self._cache.read(self._path_of_mailbox('dead_letter'))
+
+
+    def put_dead_letter(self, filename, msg):
+        self._put_message(self._path_of_mailbox('dead_letter'), filename, msg)
+
+
+    def read_inbox(self):
+        inbox_path = self._path_of_mailbox('inbox')
+        if not os.path.exists(inbox_path):
+            return []
+
+        try:
+            infiles = [f for f in os.listdir(inbox_path)
+                       if f.endswith(".bin")]
+        except Exception as err:
+            _logger.error('Failed to list %s even though it exists!  %s',
+                          inbox_path, err)
+            return []
+
+        result = []
+        for filename in sorted(infiles):
+            path = os.path.join(inbox_path, filename)
+            try:
+                with open(path, 'rb') as f:
+                    result.append((filename, f.read()))
+            except Exception as err:
+                _logger.error('Failed to read %s!  %s', path, err)
+        return result
+
+
+    def put_inbox(self, filename, data):
+        # This is the only copy of a message that the gateway has already
+        # forgotten, so it's written (and fsync'd) straight away.
+        write_file(os.path.join(self._path_of_mailbox('inbox'), filename),
+                   data)
+
+
+    def remove_inbox(self, filename):
+        path = os.path.join(self._path_of_mailbox('inbox'), filename)
+        self._change({'op': 'del', 'path': self._relpath(path)})
+
+
+    def read_summaries(self):
+        """Returns: the thread summaries, as given to put_summaries, or None
+           if there aren't any."""
+        path = os.path.join(self.root, THREAD_SUMMARIES)
+        try:
+            with open(path, 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+    def put_summaries(self, data):
+        self._change({'op': 'put', 'path': THREAD_SUMMARIES, 'data': data})
+
+
+    def _put_message(self, mailbox_path, filename, msg):
+        path = os.path.join(mailbox_path, filename)
+        self._change({'op': 'put', 'path': self._relpath(path),
+                      'data': msg.to_json_str()},
+                     (mailbox_path, filename, msg))
+
+
+    def _change(self, record, cached=None):
+        """
+        Make the change described by record, as part of this thread's
+        transaction if it has one, or else in a transaction of its own.
+
+        Args:
+            record (dict): The journal record.
+            cached: (mailbox path, filename, Message) for self._cache, if
+                the change puts a message in a mailbox.
+        """
+        changes = getattr(self._local, 'changes', None)
+        if changes is not None:
+            changes.append((record, cached))
+        else:
+            self._commit([(record, cached)])
+
+
+    def _commit(self, changes):
+        line = json.dumps([record for (record, _) in changes],
+                          separators=(',', ':')) + '\n'
+        with self._commit_lock:
+            if self._journal is None:
+                mkdir_p(self.root)
+                self._journal = open(self._journal_path, 'ab')
+            self._journal.write(line.encode('utf-8'))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal_records += 1
+
+            for (record, cached) in changes:
+                self._apply(record)
+                if cached is not None:
+                    self._cache.put(*cached)
+            if self._journal_records >= CHECKPOINT_TRANSACTIONS:
+                self._checkpoint()
+
+
+    def _apply(self, record):
+        """Make the change described by record (which has been committed
+           to the journal).  Doing this twice is harmless."""
+        op = record['op']
+        if op == 'outbox_put':
+            msg = Message(record['message'])
+            self._outbox().put(record['filename'], msg, sync=False)
+            self._dirty_outbox = True
+            return
+        if op == 'outbox_del':
+            self._outbox().remove(record['filename'], sync=False)
+            self._dirty_outbox = True
+            return
+
+        path = os.path.join(self.root, record['path'])
+        if op == 'put':
+            write_file(path, record['data'], sync=False)
+            self._dirty_files.add(path)
+        elif op == 'del':
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        elif op == 'rmtree':
+            shutil.rmtree(path, ignore_errors=True)
+            self._cache.invalidate(path)
+        else:
+            _logger.error('Ignoring unknown journal record %s!', op)
+            return
+        # Any directories that this created need fsyncing too.
+        d = os.path.dirname(path)
+        while len(d) >= len(self.root) and d not in self._dirty_dirs:
+            self._dirty_dirs.add(d)
+            d = os.path.dirname(d)
+
+
+    def _checkpoint(self):
+        """Make everything in the journal durable without it, and then
+           empty it.  Called with self._commit_lock held."""
+        for path in self._dirty_files:
+            _fsync_if_exists(path)
+        for path in self._dirty_dirs:
+            _fsync_if_exists(path)
+        if self._dirty_outbox:
+            self._outbox().sync()
+        self._dirty_files.clear()
+        self._dirty_dirs.clear()
+        self._dirty_outbox = False
+
+        if self._journal is not None:
+            self._journal.truncate(0)
+            os.fsync(self._journal.fileno())
+        self._journal_records = 0
+
+
+    def _recover(self):
+        """Apply any transactions left in the journal by a crash."""
+        try:
+            with open(self._journal_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        if not data:
+            return
+
+        count = 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                # A torn append: that transaction was never committed.
+                break
+            try:
+                records = json.loads(line.decode('utf-8'))
+            except Exception as err:
+                _logger.error('Skipping bad transaction in %s!  %s',
+                              self._journal_path, err)
+                continue
+            for record in records:
+                self._apply(record)
+            count += 1
+        _logger.info('Replayed %d transactions from %s.', count,
+                     self._journal_path)
+
+        with self._commit_lock:
+            self._journal = open(self._journal_path, 'ab')
+            self._checkpoint()
+
+
+    def _relpath(self, path):
+        return os.path.relpath(path, self.root)
+
+
+    def _outbox(self):
+        """
+        Returns: the OutboxIndex, loading it first if need be.  The outbox
+        used to be a directory of message files, like the other mailboxes,
+        so any of those are moved into the index when it's loaded.
+        """
+        with self._outbox_lock:
+            if self._outbox_index is not None:
+                return self._outbox_index
+            outbox_path = self._path_of_mailbox('outbox')
+            index = OutboxIndex(
+                os.path.join(outbox_path, OUTBOX_JOURNAL)).load()
+
+            # The journal records are durable before we delete the files,
+            # so a crash part way through just means doing this again next
+            # time.
+            for msg in _read_mailbox_sorted(outbox_path):
+                _logger.info('Moving %s into the outbox journal.',
+                             msg.filename)
+                index.put(msg.filename, msg)
+                os.remove(os.path.join(outbox_path, msg.filename))
+            self._outbox_index = index
+            return index
+
+
+    def _path_of_mailbox(self, label):
+        return os.path.join(self.root, label)
+
+    def _path_of_threadboxes(self, local_user):
+        return os.path.join(self.root, local_user, 'thread')
+
+    def _path_of_threadbox(self, local_user, remote_user):
+        return os.path.join(self._path_of_threadboxes(local_user),
+                            remote_user)
+
+
+class SQLiteStore(object):
+    # pylint: disable=missing-docstring
+    def __init__(self, path):
+        self.path = path
+        mkdir_p(os.path.dirname(path))
+        # The connection is shared between the Flask and queue manager
+        # threads, so all use of it is under self._lock, which is held for
+        # the whole of a transaction.
+        self._lock = threading.RLock()
+        self._in_transaction = False
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # Sync the WAL on every commit, so that a commit survives losing
+        # power, as the directory layout's fsync'd files do.
+        self._db.execute('PRAGMA synchronous=FULL')
+        with self._db:
+            self._db.executescript(SCHEMA)
+            self._db.execute('PRAGMA user_version=%d' % SCHEMA_VERSION)
+
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """As for DirectoryStore.transaction, except that reads in the block
+           do see the changes."""
+        with self._lock:
+            if self._in_transaction:
+                yield
+                return
+            self._in_transaction = True
+            try:
+                with self._db:
+                    yield
+            finally:
+                self._in_transaction = False
+
+
+    def list_local_users(self):
+        return [u for (u,) in self._query(
+            'SELECT DISTINCT local_user FROM threads ORDER BY local_user')]
+
+
+    def list_recipients(self, local_user):
+        return [r for (r,) in self._query(
+            'SELECT DISTINCT remote_user FROM threads WHERE local_user = ? '
+            'ORDER BY remote_user', (local_user,))]
+
+
+    def read_thread(self, local_user, remote_user):
+        return _to_messages(self._query(
+            'SELECT filename, message FROM threads '
+            'WHERE local_user = ? AND remote_user = ? ORDER BY filename',
+            (local_user, remote_user)))
+
+
+    def read_thread_page(self, local_user, remote_user, limit, before=None):
+        if before is None:
+            before_clause = ''
+            args = (local_user, remote_user, limit + 1)
+        else:
+            before_clause = 'AND filename < ? '
+            args = (local_user, remote_user, before, limit + 1)
+        rows = self._query(
+            'SELECT filename, message FROM threads '
+            'WHERE local_user = ? AND remote_user = ? ' + before_clause +
+            'ORDER BY filename DESC LIMIT ?', args)
+        more = len(rows) > limit
+        return (_to_messages(reversed(rows[:limit])), more)
+
+
+    def read_thread_message(self, local_user, remote_user, filename):
+        msgs = _to_messages(self._query(
+            'SELECT filename, message FROM threads '
+            'WHERE local_user = ? AND remote_user = ? AND filename = ?',
+            (local_user, remote_user, filename)))
+        if not msgs:
+            _logger.error('Failed to find %s in thread %s / %s!', filename,
+                          local_user, remote_user)
+            return None
+        return msgs[0]
+
+
+    def put_thread_message(self, local_user, remote_user, filename, msg):
+        self._execute(
+            'INSERT OR REPLACE INTO threads VALUES (?, ?, ?, ?)',
+            (local_user, remote_user, filename, msg.to_json_str()))
+
+
+    def delete_thread(self, local_user, remote_user):
+        self._execute(
+            'DELETE FROM threads WHERE local_user = ? AND remote_user = ?',
+            (local_user, remote_user))
+
+
+    def read_outbox(self):
+        return _to_messages(self._query(
+            'SELECT filename, message FROM outbox ORDER BY filename'))
+
+
+    def outbox_contains(self, filename):
+        return bool(self._query(
+            'SELECT 1 FROM outbox WHERE filename = ?', (filename,)))
+
+
+    def outbox_size(self):
+        return self._query('SELECT COUNT(*) FROM outbox')[0][0]
+
+
+    def put_outbox(self, filename, msg):
+        self._execute('INSERT OR REPLACE INTO outbox VALUES (?, ?)',
+                      (filename, msg.to_json_str()))
+
+
+    def remove_outbox(self, filename):
+        return self._execute('DELETE FROM outbox WHERE filename = ?',
+                             (filename,)) > 0
+
+
+    def read_dead_letter(self):
+        return _to_messages(self._query(
+            'SELECT filename, message FROM dead_letter ORDER BY filename'))
+
+
+    def put_dead_letter(self, filename, msg):
+        self._execute('INSERT OR REPLACE INTO dead_letter VALUES (?, ?)',
+                      (filename, msg.to_json_str()))
+
+
+    def read_inbox(self):
+        return [(f, bytes(d)) for (f, d) in self._query(
+            'SELECT filename, data FROM inbox ORDER BY filename')]
+
+
+    def put_inbox(self, filename, data):
+        self._execute('INSERT OR REPLACE INTO inbox VALUES (?, ?)',
+                      (filename, data))
+
+
+    def remove_inbox(self, filename):
+        self._execute('DELETE FROM inbox WHERE filename = ?', (filename,))
+
+
+    def read_summaries(self):
+        rows = self._query(
+            "SELECT value FROM meta WHERE key = 'thread_summaries'")
+        return rows[0][0] if rows else None
+
+
+    def put_summaries(self, data):
+        self._execute(
+            "INSERT OR REPLACE INTO meta VALUES ('thread_summaries', ?)",
+            (data,))
+
+
+    def migrated(self):
+        return bool(self._query(
+            "SELECT 1 FROM meta WHERE key = 'migrated_at'"))
+
+
+    def migrate_from(self, src):
+        """
+        Copy everything from src (a DirectoryStore) into this store, in one
+        transaction.  The files are left where they are, but are ignored
+        from then on.
+
+        Returns: the number of messages copied.
+        """
+        rows = {'threads': [], 'outbox': [], 'dead_letter': [], 'inbox': []}
+        for local_user in src.list_local_users():
+            for remote_user in src.list_recipients(local_user):
+                for msg in src.read_thread(local_user, remote_user):
+                    rows['threads'].append((local_user, remote_user,
+                                            msg.filename, msg.to_json_str()))
+        for msg in src.read_outbox():
+            rows['outbox'].append((msg.filename, msg.to_json_str()))
+        for msg in src.read_dead_letter():
+            rows['dead_letter'].append((msg.filename, msg.to_json_str()))
+        rows['inbox'] = src.read_inbox()
+        summaries = src.read_summaries()
+        if summaries is not None:
+            rows['meta'] = [('thread_summaries', summaries)]
+
+        with self._lock, self._db:
+            for (table, values) in rows.items():
+                if not values:
+                    continue
+                params = ', '.join('?' * len(values[0]))
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO %s VALUES (%s)' % (table, params),
+                    values)
+            self._db.execute(
+                "INSERT INTO meta VALUES ('migrated_at', ?)", (utcnow_str(),))
+
+        count = sum(len(rows[t]) for t in ('threads', 'outbox', 'dead_letter',
+                                           'inbox'))
+        if count:
+            _logger.info('Copied %d messages from %s into %s.  The old files '
+                         'can be deleted.', count, src.root, self.path)
+        return count
+
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+
+    def _execute(self, sql, params=()):
+        """Returns: the number of rows changed."""
+        with self._lock:
+            if self._in_transaction:
+                return self._db.execute(sql, params).rowcount
+            with self._db:
+                return self._db.execute(sql, params).rowcount
+
+
+def _fsync_if_exists(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _to_messages(rows):
+    result = []
+    for (filename, msg_str) in rows:
+        msg = Message(json.loads(msg_str))
+        msg.filename = filename
+        result.append(msg)
+    return result
+
+
+def _read_mailbox_sorted(mailbox_path):
+    """
+    Returns: messages in the given directory, sorted chronologically.
+    """
+    if not os.path.exists(mailbox_path):
+        return []
+
+    try:
+        filenames = [f for f in os.listdir(mailbox_path)
+                     if f.endswith(".json")]
+    except Exception as err:
+        _logger.error('Failed to list %s even though it exists!  %s',
+                      mailbox_path, err)
+        return []
+
+    result = []
+    for filename in sorted(filenames):
+        path = os.path.join(mailbox_path, filename)
+        try:
+            result.append(_read_message(path, filename))
+        except Exception as err:
+            _logger.error('Failed to read %s!  %s', path, err)
+    return result
+
+
+def _read_message(path, filename):
+    with open(path, 'r') as f:
+        msg = Message(json.load(f))
+    msg.filename = filename
+    return msg
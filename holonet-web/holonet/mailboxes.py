@@ -33,17 +33,24 @@ ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 '''
 
-import json
+import base64
+import binascii
+import contextlib
 import logging
 import os
 import os.path
 import shutil
+import threading
+import time
 
+from datetime import datetime, timedelta
 from enum import Enum
 
-from .message import Message
-from .utils import mkdir_p, normalize_phone_number, timestamp_filename, \
-    utcnow_str
+from . import compression, dedup_index, fragmentation, mailbox_store, \
+    summary_index
+from .message import Message, PRIORITY_NORMAL
+from .utils import normalize_phone_number, timestamp_filename, utc_str, \
+    utcnow_str, write_file
 
 
 MAILBOXES_ROOT = '/var/opt/pr-holonet/mailboxes'
@@ -52,195 +59,491 @@ MAILBOXES_ROOT = '/var/opt/pr-holonet/mailboxes'
 # Will be overridden by app.py for non-Gunicorn builds.
 mailboxes_root = MAILBOXES_ROOT
 
+# Which holonet.mailbox_store backend to keep the mailboxes in.  app.py sets
+# this from HOLONET_MAILBOX_BACKEND.
+storage_backend = mailbox_store.BACKEND_DIRECTORY
+
+# The record of MT messages that we've delivered, in mailboxes_root; see
+# holonet.dedup_index.
+MT_DEDUP_INDEX = 'mt_delivered.json'
+
+# How many messages get_thread_page returns if it's not told.
+THREAD_PAGE_SIZE = 50
+
 _logger = logging.getLogger('holonet.mailboxes')
 
+_store_instance = None
+_store_key = None
+_store_lock = threading.Lock()
+_dedup_index = None
+_dedup_index_lock = threading.Lock()
+# The SummaryIndex, and the store that it came from.  _summary_lock is
+# held while changing it (and saving it to the store) and while loading it.
+# It's always taken before any lock in the store.
+_summary_index = None
+_summary_store = None
+_summary_lock = threading.RLock()
+
 
 class MailboxKind(Enum):  # pylint: disable=too-few-public-methods
     thread = 1  # A thread of messages exchanged between two people
     outbox = 2  # Messages waiting to be sent
     inbox = 3  # Messages waiting to be read
+    fragments = 4  # Fragments of incoming messages waiting for the rest
+    dead_letter = 5  # Messages that we gave up trying to send
 
 
 def list_recipients(local_user):
-    threadboxes_path = _path_of_threadboxes(local_user)
-    if not os.path.exists(threadboxes_path):
-        return []
+    return _store().list_recipients(local_user)
+
+
+def list_threads(local_user):
+    """
+    Returns: summary_index.ThreadSummary list for the given user's threads,
+    most recently active first.
+    """
+    return _summaries().summaries(local_user)
 
-    try:
-        return sorted([d for d in os.listdir(threadboxes_path)
-                       if not d.startswith('.')])
-    except Exception as err:
-        _logger.error('Error: failed to list %s even though it exists!  %s',
-                      threadboxes_path, err)
-        return []
+
+def mark_thread_read(local_user, recipient):
+    if not _summaries().unread(local_user, recipient):
+        return
+    with _summary_transaction() as (_, summaries):
+        summaries.mark_read(local_user, recipient)
 
 
 def get_thread(local_user, recipient):
-    threadbox_path = _path_of_threadbox(local_user, recipient)
-    return _read_mailbox_sorted(threadbox_path, check_outbox=True)
+    store = _store()
+    messages = store.read_thread(local_user, recipient)
+    _mark_not_yet_sent(store, messages)
+    return messages
 
 
-def delete_thread(local_user, recipient):
-    threadbox_path = _path_of_threadbox(local_user, recipient)
+def get_thread_page(local_user, recipient, limit=THREAD_PAGE_SIZE,
+                    before=None):
+    """
+    Args:
+        limit (int): The maximum number of messages to return.
+        before (str): A cursor from a previous call, to get the messages
+            before that page, or None to get the newest ones.
+
+    Returns: (messages, older), where messages are the newest messages in
+        the thread (before the given cursor), sorted chronologically, and
+        older is the cursor for the page before this one, or None if there
+        are no older messages.  Older messages aren't read at all.
+
+    Raises: ValueError if before isn't a valid cursor.
+    """
+    store = _store()
+    (messages, more) = store.read_thread_page(
+        local_user, recipient, limit, _decode_cursor(before))
+    _mark_not_yet_sent(store, messages)
+    older = _encode_cursor(messages[0].filename) if more else None
+    return (messages, older)
+
+
+def _mark_not_yet_sent(store, messages):
+    for msg in messages:
+        if store.outbox_contains(msg.filename):
+            msg.not_yet_sent = True
+
+
+def _encode_cursor(filename):
+    return base64.urlsafe_b64encode(
+        filename.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    if cursor is None:
+        return None
     try:
-        shutil.rmtree(threadbox_path)
-    except Exception as err:
-        _logger.error('Cannot delete %s!  %s', threadbox_path, err)
+        filename = base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+    except (binascii.Error, UnicodeError):
+        raise ValueError('Invalid thread cursor %r' % cursor)
+    if not filename.endswith('.json') or os.path.sep in filename:
+        raise ValueError('Invalid thread cursor %r' % cursor)
+    return filename
+
+
+def delete_thread(local_user, recipient):
+    with _summary_transaction() as (store, summaries):
+        store.delete_thread(local_user, recipient)
+        summaries.remove(local_user, recipient)
 
 
-def queue_message_send(local_user, recipient_, body):
+def queue_message_send(local_user, recipient_, body,
+                       priority=PRIORITY_NORMAL, ttl=None):
+    """
+    Args:
+        priority (int): One of the message.PRIORITY_* values.
+        ttl (int): Seconds to keep trying to send the message, or None to
+            keep trying forever.
+    """
     recipient = normalize_phone_number(recipient_)
     if not recipient:
         _logger.error('Refusing to send message to invalid phone number %s',
                       recipient_)
 
-    threadbox_path = _path_of_threadbox(local_user, recipient)
-    outbox_path = _path_of_mailbox(MailboxKind.outbox)
-
-    now = utcnow_str()
+    now_dt = datetime.utcnow()
+    now = utc_str(now_dt)
 
     msg = Message()
     msg.local_user = local_user
     msg.recipient = recipient
     msg.timestamp = now
     msg.body = body
-
-    msg_str = msg.to_json_str()
+    if priority != PRIORITY_NORMAL:
+        msg.priority = priority
+    if ttl is not None:
+        msg.expires_at = utc_str(now_dt + timedelta(seconds=ttl))
 
     fname = timestamp_filename(now, 'json')
-    thread_path = os.path.join(threadbox_path, fname)
-    outbox_path = os.path.join(outbox_path, fname)
 
-    _write_file(outbox_path, msg_str)
-    _write_file(thread_path, msg_str)
+    with _summary_transaction() as (store, summaries):
+        store.put_outbox(fname, msg)
+        store.put_thread_message(local_user, recipient, fname, msg)
+        summaries.add_message(local_user, recipient, fname, msg)
 
 
 def read_outbox():
     """
     Returns: messages in the outbox, sorted chronologically.
     """
-    outbox_path = _path_of_mailbox(MailboxKind.outbox)
-    return _read_mailbox_sorted(outbox_path)
+    return _store().read_outbox()
+
+
+def outbox_size():
+    return _store().outbox_size()
 
 
 def remove_from_outbox(fname):
-    _remove_from_mailbox(fname, MailboxKind.outbox)
+    if not _store().remove_outbox(fname):
+        _logger.error('Failed to remove %s from the outbox: it is not there!',
+                      fname)
 
 
-def _read_mailbox_sorted(mailbox_path, check_outbox=False):
+def expire_outbox(now=None):
     """
-    Returns: messages in the given mailbox, sorted chronologically.
+    Remove any messages from the outbox that have passed their expiry time,
+    and mark their copies in the threads as expired.
+
+    Returns: the expired messages.
     """
-    messages = _read_mailbox(mailbox_path)
+    now = now or datetime.utcnow()
+    result = []
+    with _store().transaction():
+        for msg in read_outbox():
+            if not msg.is_expired(now):
+                continue
+            _logger.warning('Giving up on %s: it expired at %s.',
+                            msg.filename, msg.expires_at)
+            remove_from_outbox(msg.filename)
+            _mark_thread_message(msg, expired=True)
+            result.append(msg)
+    return result
 
-    if check_outbox:
-        outbox_path = _path_of_mailbox(MailboxKind.outbox)
-        outbox_contents = _read_mailbox(outbox_path)
 
-        for msg in messages.values():
-            if msg.filename in outbox_contents:
-                msg.not_yet_sent = True
+def move_to_dead_letter(msg, reason):
+    """
+    Give up trying to send msg (which came from read_outbox): move it to the
+    dead letter box, and mark its copy in the thread as failed.
 
-    result = []
-    for fname in sorted(messages.keys()):
-        result.append(messages[fname])
-    return result
+    Args:
+        reason (str): Why we gave up, for the user.
+    """
+    _logger.warning('Giving up on %s: %s', msg.filename, reason)
+    msg.failed = reason
+    msg.next_attempt_at = None
+    store = _store()
+    with store.transaction():
+        store.put_dead_letter(msg.filename, msg)
+        remove_from_outbox(msg.filename)
+        _mark_thread_message(msg, failed=reason)
 
 
-def _read_mailbox(mailbox_path):
+def read_dead_letter():
+    """
+    Returns: messages in the dead letter box, sorted chronologically.
+    """
+    return _store().read_dead_letter()
+
+
+def _mark_thread_message(msg, **kwargs):
+    """Set the given attributes on the thread copy of the given outbox
+       message."""
+    if not msg.recipient:
+        return
+    store = _store()
+    thread_msg = store.read_thread_message(msg.local_user, msg.recipient,
+                                           msg.filename)
+    if thread_msg is None:
+        return
+    for (k, v) in kwargs.items():
+        setattr(thread_msg, k, v)
+    store.put_thread_message(msg.local_user, msg.recipient, msg.filename,
+                             thread_msg)
+
+
+def update_outbox_message(msg):
+    """Write back msg (which came from read_outbox), e.g. to record sending
+       progress."""
+    _store().put_outbox(msg.filename, msg)
+
+
+def _store():
+    """Returns: the storage backend for mailboxes_root, opening it first if
+       need be."""
+    global _store_instance
+    global _store_key
+
+    key = (storage_backend, mailboxes_root)
+    with _store_lock:
+        if _store_instance is not None and _store_key == key:
+            return _store_instance
+        if _store_instance is not None:
+            _store_instance.close()
+        _store_instance = mailbox_store.open_store(*key)
+        _store_key = key
+        return _store_instance
+
+
+def close_store():
+    global _store_instance
+    global _summary_index
+
+    with _summary_lock, _store_lock:
+        if _store_instance is not None:
+            _store_instance.close()
+            _store_instance = None
+        _summary_index = None
+
+
+def mt_already_delivered(mtmsn, payload):
     """
-    Returns: dict where the key is the filename for the message, and the
-    value is a Message instance.
+    Returns: whether we've already delivered the MT payload that arrived with
+    the given MTMSN.
     """
-    if not os.path.exists(mailbox_path):
-        return {}
+    return dedup_index.message_key(mtmsn, payload) in _dedup()
+
+
+def record_mt_delivery(mtmsn, payload):
+    """Remember that we've delivered the given MT payload, once it's safely
+       in the inbox (or the fragments mailbox)."""
+    _dedup().add(dedup_index.message_key(mtmsn, payload))
+
+
+def _dedup():
+    """Returns: the DedupIndex for mailboxes_root, loading it first if need
+       be."""
+    global _dedup_index
+
+    path = os.path.join(mailboxes_root, MT_DEDUP_INDEX)
+    with _dedup_index_lock:
+        if _dedup_index is None or _dedup_index.path != path:
+            _dedup_index = dedup_index.DedupIndex(path)
+        return _dedup_index
+
+
+def _summaries():
+    """Returns: the SummaryIndex for the store, loading it (or building it
+       from the threads, if the store doesn't have one) first if need be."""
+    global _summary_index
+    global _summary_store
+
+    store = _store()
+    index = _summary_index
+    if index is not None and _summary_store is store:
+        return index
+
+    with _summary_lock:
+        if _summary_index is not None and _summary_store is store:
+            return _summary_index
+        data = store.read_summaries()
+        try:
+            index = summary_index.SummaryIndex(data)
+        except ValueError as err:
+            _logger.warning('Rebuilding the thread summaries: %s', err)
+            data = None
+        if data is None:
+            index = summary_index.SummaryIndex()
+            index.add_messages(_last_thread_messages(store))
+            store.put_summaries(index.to_json_str())
+        _summary_index = index
+        _summary_store = store
+        return index
+
+
+@contextlib.contextmanager
+def _summary_transaction():
+    """
+    A store transaction that the thread summaries are saved in too.
 
-    try:
-        filenames = [f for f in os.listdir(mailbox_path)
-                     if f.endswith(".json")]
-
-        result = {}
-        for filename in filenames:
-            path = os.path.join(mailbox_path, filename)
-            try:
-                msg = _read_message(path)
-                msg.filename = filename
-                result[filename] = msg
-            except Exception as err:
-                _logger.error('Failed to read %s!  %s', path, err)
-        return result
-    except Exception as err:
-        _logger.error('Failed to list %s even though it exists!  %s',
-                      mailbox_path, err)
+    Yields: (store, SummaryIndex), for the with block to make its changes
+    with.  If the block raises, the changes to the summaries are thrown away
+    along with the rest.
+    """
+    global _summary_index
+
+    with _summary_lock:
+        summaries = _summaries()
+        store = _summary_store
+        try:
+            with store.transaction():
+                yield (store, summaries)
+                store.put_summaries(summaries.to_json_str())
+        except BaseException:
+            # Load them again from the store next time.
+            _summary_index = None
+            raise
+
+
+def _last_thread_messages(store):
+    for local_user in store.list_local_users():
+        for recipient in store.list_recipients(local_user):
+            (page, _) = store.read_thread_page(local_user, recipient, 1)
+            if page:
+                yield (local_user, recipient, page[0].filename, page[0])
 
 
 def save_message_to_inbox(data):
-    inbox_path = _path_of_mailbox(MailboxKind.inbox)
     now = utcnow_str()
 
     fname = timestamp_filename(now, 'bin')
-    inbox_file_path = os.path.join(inbox_path, fname)
-    _write_file(inbox_file_path, data)
+    _store().put_inbox(fname, data)
+
+
+def save_fragment(payload):
+    """
+    Store the given fragment (see holonet.fragmentation) until the rest of
+    its message arrives.
+
+    Returns: the whole message if this was the last fragment, or None.
+
+    Raises: fragmentation.FragmentationException if payload is malformed.
+    """
+    frag = fragmentation.parse(payload)
+    frag_path = _path_of_fragments(frag.msg_id)
+    fname = '%03d.bin' % frag.index
+    write_file(os.path.join(frag_path, fname), payload)
+
+    try:
+        fnames = [f for f in os.listdir(frag_path) if f.endswith('.bin')]
+    except Exception as err:
+        _logger.error('Failed to list %s!  %s', frag_path, err)
+        return None
+    if len(fnames) < frag.count:
+        return None
+
+    frags = []
+    for fname in fnames:
+        path = os.path.join(frag_path, fname)
+        try:
+            frags.append(fragmentation.parse(_read_bytes(path)))
+        except Exception as err:
+            _logger.error('Failed to read %s!  %s', path, err)
+    try:
+        result = fragmentation.reassemble(
+            [f for f in frags if f.count == frag.count])
+    except fragmentation.FragmentationException as err:
+        _logger.warning('Cannot reassemble message %s yet: %s', frag.msg_id,
+                        err)
+        return None
+    shutil.rmtree(frag_path, ignore_errors=True)
+    return result
+
+
+def expire_fragments(max_age):
+    """Discard the fragments of any message that has been incomplete for
+       longer than max_age secs."""
+    fragments_path = _path_of_mailbox(MailboxKind.fragments)
+    if not os.path.exists(fragments_path):
+        return
+
+    cutoff = time.time() - max_age
+    for d in os.listdir(fragments_path):
+        path = os.path.join(fragments_path, d)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                _logger.warning('Discarding incomplete message %s.', d)
+                shutil.rmtree(path)
+        except Exception as err:
+            _logger.error('Failed to expire %s!  %s', path, err)
 
 
 def accept_all_inbox_messages():
-    msgs = read_inbox()
+    msgs = []
+    for msg in read_inbox():
+        parsed = _parse_inbox_message(msg['data'])
+        if parsed is None:
+            # Leave it there to be looked at, rather than let it hold up
+            # the rest.
+            _logger.warning('Ignoring malformed message %s in the inbox: %r',
+                            msg['filename'], msg['data'])
+            continue
+        msgs.append((msg['filename'], parsed))
+    if not msgs:
+        return []
 
     result = []
-    for msg in msgs:
-        msg_filename = msg['filename']
-        msg_data = msg['data']
-
-        (sender, body) = msg_data.split(':', 1)
-        now = utcnow_str()
-        local_user = 'local'
-        sender = sender
-        timestamp = now
-        received_at = now
-        body = body
-
-        new_msg = _accept_message(local_user, sender, timestamp, received_at,
-                                  body)
-        _remove_from_mailbox(msg_filename, MailboxKind.inbox)
-        result.append(new_msg)
-
+    last_dt = None
+    with _summary_transaction() as (store, summaries):
+        for (msg_filename, (sender, body)) in msgs:
+            # Without an fsync per message, this loop is quick enough that
+            # the clock might not move, and the timestamp is the filename.
+            now_dt = datetime.utcnow()
+            if last_dt is not None and now_dt <= last_dt:
+                now_dt = last_dt + timedelta(microseconds=1)
+            last_dt = now_dt
+            now = utc_str(now_dt)
+            local_user = 'local'
+            timestamp = now
+            received_at = now
+
+            new_msg = _accept_message(local_user, sender, timestamp,
+                                      received_at, body)
+            store.remove_inbox(msg_filename)
+            result.append(new_msg)
+
+        summaries.add_messages(
+            [(m.local_user, m.sender, m.filename, m) for m in result],
+            unread=True)
     return result
 
 
-def read_inbox():
+def _parse_inbox_message(data):
     """
-    Returns: dict list where the dict contains 'filename' and 'data'.
+    Returns: (sender, body) from the given number:body inbox message, or None
+    if it's not one.  The sender names the thread's directory, so it mustn't
+    be a path.
     """
-    inbox_path = _path_of_mailbox(MailboxKind.inbox)
+    if ':' not in data:
+        return None
+    (sender, body) = data.split(':', 1)
+    if not sender or sender.startswith('.') or '/' in sender or \
+            os.path.sep in sender:
+        return None
+    return (sender, body)
 
-    if not os.path.exists(inbox_path):
-        return []
 
-    try:
-        infiles = [f for f in os.listdir(inbox_path)
-                   if f.endswith(".bin")]
-
-        result = []
-        for filename in sorted(infiles):
-            path = os.path.join(inbox_path, filename)
-            try:
-                data = _read_bin(path)
-                result.append({
-                    'filename': filename,
-                    'data': data,
-                })
-            except Exception as err:
-                _logger.error('Failed to read %s!  %s', path, err)
-        return result
-    except Exception as err:
-        _logger.error('Failed to list %s even though it exists!  %s',
-                      inbox_path, err)
-        return []
+def read_inbox():
+    """
+    Returns: dict list where the dict contains 'filename' and 'data'.  The
+    data is decoded (see holonet.compression) and returned as a str.
+    """
+    result = []
+    for (filename, data) in _store().read_inbox():
+        try:
+            result.append({
+                'filename': filename,
+                'data': compression.decode(data).decode('utf-8', 'replace'),
+            })
+        except Exception as err:
+            _logger.error('Failed to read %s!  %s', filename, err)
+    return result
 
 
 def _accept_message(local_user, sender, timestamp, received_at, body):
-    threadbox_path = _path_of_threadbox(local_user, sender)
-
     msg = Message()
     msg.local_user = local_user
     msg.sender = sender
@@ -248,60 +551,23 @@ def _accept_message(local_user, sender, timestamp, received_at, body):
     msg.received_at = received_at
     msg.body = body
 
-    msg_str = msg.to_json_str()
-
-    fname = timestamp_filename(received_at, 'json')
-    thread_path = os.path.join(threadbox_path, fname)
-    _write_file(thread_path, msg_str)
+    msg.filename = timestamp_filename(received_at, 'json')
+    _store().put_thread_message(local_user, sender, msg.filename, msg)
 
     return msg
 
 
-def _remove_from_mailbox(filename, kind):
-    mailbox_path = _path_of_mailbox(kind)
-    path = os.path.join(mailbox_path, filename)
-    try:
-        os.remove(path)
-    except Exception as err:
-        _logger.error('Failed to remove %s!  %s', path, err)
-
-
-def _read_bin(path):
-    with open(path, 'r') as f:
+def _read_bytes(path):
+    with open(path, 'rb') as f:
         return f.read()
 
 
-def _read_message(path):
-    msg_json = _read_json(path)
-    return Message(msg_json)
-
-
-def _read_json(path):
-    with open(path, 'r') as f:
-        return json.load(f)
-
-
-def _write_file(path, data):
-    mkdir_p(os.path.dirname(path))
-
-    mode = 'w' if isinstance(data, str) else 'wb'
-    tmpfile = '%s.tmp' % path
-    with open(tmpfile, mode) as f:
-        f.write(data)
-        f.flush()
-        os.fsync(f.fileno())
-    os.rename(tmpfile, path)
-
-
 def _path_of_mailbox(kind):
     kind_label = _label_of_kind(kind)
     return os.path.join(mailboxes_root, kind_label)
 
-def _path_of_threadboxes(local_user):
-    return os.path.join(mailboxes_root, local_user, 'thread')
-
-def _path_of_threadbox(local_user, remote_user):
-    return os.path.join(_path_of_threadboxes(local_user), remote_user)
+def _path_of_fragments(msg_id):
+    return os.path.join(_path_of_mailbox(MailboxKind.fragments), str(msg_id))
 
 
 def _label_of_kind(kind):
@@ -309,5 +575,7 @@ def _label_of_kind(kind):
         MailboxKind.thread: 'thread',
         MailboxKind.outbox: 'outbox',
         MailboxKind.inbox: 'inbox',
+        MailboxKind.fragments: 'fragments',
+        MailboxKind.dead_letter: 'dead_letter',
     }
     return kinds[kind]
@@ -35,7 +35,20 @@ ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import json
 
-from .utils import printable_phone_number
+from .utils import parse_utc_str, printable_phone_number
+
+
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+PRIORITY_EMERGENCY = 3
+
+PRIORITY_LABELS = {
+    PRIORITY_LOW: 'Low',
+    PRIORITY_NORMAL: 'Normal',
+    PRIORITY_HIGH: 'High',
+    PRIORITY_EMERGENCY: 'Emergency',
+}
 
 
 class MissingRecipientException(Exception):
@@ -51,6 +64,31 @@ class Message(object):  # pylint: disable=too-many-instance-attributes
         self.received_at = None
         self.body = None
 
+        # For outgoing messages: one of the PRIORITY_* values (None means
+        # PRIORITY_NORMAL), and when to give up trying to send it (a UTC
+        # timestamp string like timestamp, or None for never).
+        self.priority = None
+        self.expires_at = None
+
+        # Set while a message that's too long for one SBD payload is being
+        # sent in fragments; see holonet.fragmentation.
+        self.fragment_id = None
+        self.fragments_sent = None
+
+        # For outgoing messages that have failed to send: how many times,
+        # why the last attempt failed, and when to try again (a UTC
+        # timestamp string, or None for as soon as possible).
+        self.attempts = None
+        self.last_error = None
+        self.next_attempt_at = None
+
+        # Set on the thread copy of a message that expired before it could
+        # be sent.
+        self.expired = None
+        # Set on the thread copy of a message that we gave up trying to send
+        # (and on the copy in the dead letter box): the reason why.
+        self.failed = None
+
         self.not_yet_sent = None
 
         if json_dict:
@@ -74,6 +112,36 @@ class Message(object):  # pylint: disable=too-many-instance-attributes
     direction = property(_get_direction)
 
 
+    def _get_effective_priority(self):
+        return PRIORITY_NORMAL if self.priority is None else self.priority
+    effective_priority = property(_get_effective_priority)
+
+
+    def _get_priority_label(self):
+        return PRIORITY_LABELS.get(self.effective_priority, 'Unknown')
+    priority_label = property(_get_priority_label)
+
+
+    def is_expired(self, now):
+        """
+        Args:
+            now (datetime): The current UTC time.
+        """
+        return (self.expires_at is not None and
+                parse_utc_str(self.expires_at) <= now)
+
+
+    def is_due(self, now):
+        """
+        Returns: whether it's time to (re)try sending this message.
+
+        Args:
+            now (datetime): The current UTC time.
+        """
+        return (self.next_attempt_at is None or
+                parse_utc_str(self.next_attempt_at) <= now)
+
+
     def to_bytes(self):
         if not self.recipient:
             raise MissingRecipientException()
@@ -85,7 +153,9 @@ class Message(object):  # pylint: disable=too-many-instance-attributes
     def to_json(self):
         d = {}
         for k in ('local_user', 'recipient', 'sender', 'timestamp',
-                  'received_at', 'body'):
+                  'received_at', 'body', 'priority', 'expires_at', 'expired',
+                  'fragment_id', 'fragments_sent', 'attempts', 'last_error',
+                  'next_attempt_at', 'failed'):
             v = getattr(self, k, None)
             if v is not None:
                 d[k] = v
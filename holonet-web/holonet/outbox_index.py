@@ -0,0 +1,261 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+An in-memory index of the outbox, kept on disk as an append-only journal.
+
+Every change to the outbox is appended to the journal as one line of JSON,
+and fsync'd before it's applied to the index, so the index is rebuilt at
+startup by replaying the journal.  If we lose power part way through an
+append, the torn last line is discarded on replay, and the change that it
+was recording never happened (the caller hadn't been told that it had).
+When the journal is mostly superseded records, it's compacted: rewritten
+with one record per message, and renamed over the old one.
+
+Journal records are either
+
+    {"op": "put", "filename": ..., "message": {Message.to_json()}}
+
+or
+
+    {"op": "del", "filename": ...}
+'''
+
+import bisect
+import copy
+import json
+import logging
+import os
+import os.path
+import threading
+
+from .message import Message
+from .utils import fsync_dir, mkdir_p
+
+
+# Compact the journal when it has more than this many records, and more
+# than COMPACT_RATIO times as many as there are messages in the outbox.
+COMPACT_MIN_RECORDS = 1000
+COMPACT_RATIO = 4
+
+
+_logger = logging.getLogger('holonet.outbox_index')
+
+
+class OutboxIndex(object):
+    """
+    The outbox messages, by filename.  Filenames are timestamps (see
+    utils.timestamp_filename), so filename order is chronological.
+
+    This is safe to use from several threads.  The Message instances that
+    it returns are (shallow) copies, so changing them doesn't change the
+    outbox until they're put back.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The journal file.  It's created if necessary.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._messages = {}
+        self._order = []
+        self._records = 0
+        self._journal = None
+
+
+    def load(self):
+        """Replay the journal, and open it for appending."""
+        with self._lock:
+            mkdir_p(os.path.dirname(self.path))
+            good_size = self._replay()
+            self._journal = open(self.path, 'ab')
+            if self._journal.tell() != good_size:
+                _logger.warning('Discarding torn record at the end of %s.',
+                                self.path)
+                self._journal.truncate(good_size)
+                self._journal.seek(good_size)
+            self._maybe_compact()
+        return self
+
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+    def __contains__(self, filename):
+        return filename in self._messages
+
+
+    def __len__(self):
+        return len(self._messages)
+
+
+    def get(self, filename):
+        """Returns: the message with the given filename, or None."""
+        with self._lock:
+            msg = self._messages.get(filename)
+            return None if msg is None else copy.copy(msg)
+
+
+    def messages(self):
+        """Returns: all the messages, sorted chronologically."""
+        with self._lock:
+            return [copy.copy(self._messages[f]) for f in self._order]
+
+
+    def put(self, filename, msg, sync=True):
+        """Add msg to the outbox with the given filename, or replace the
+           message that's there already.  If sync isn't set, the journal
+           isn't fsync'd; the caller must call sync (having made the change
+           durable some other way in the meantime)."""
+        d = msg.to_json()
+        with self._lock:
+            self._append({'op': 'put', 'filename': filename, 'message': d},
+                         sync)
+            self._apply_put(filename, d)
+            self._maybe_compact()
+
+
+    def remove(self, filename, sync=True):
+        """
+        Remove the message with the given filename.  sync is as for put.
+
+        Returns: False if there was no such message.
+        """
+        with self._lock:
+            if filename not in self._messages:
+                return False
+            self._append({'op': 'del', 'filename': filename}, sync)
+            self._apply_del(filename)
+            self._maybe_compact()
+            return True
+
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+
+    def sync(self):
+        """fsync the journal, after changes made with sync=False."""
+        with self._lock:
+            if self._journal is not None:
+                os.fsync(self._journal.fileno())
+
+
+    def _replay(self):
+        """
+        Load self.path into the index.
+
+        Returns: the length of the journal up to the end of the last good
+        record.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+
+        good_size = 0
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                # A torn append; see load.
+                break
+            try:
+                record = json.loads(line.decode('utf-8'))
+                if record['op'] == 'put':
+                    self._apply_put(record['filename'], record['message'])
+                else:
+                    self._apply_del(record['filename'])
+            except Exception as err:
+                _logger.error('Skipping bad record in %s!  %s', self.path,
+                              err)
+            self._records += 1
+            good_size += len(line)
+        return good_size
+
+
+    def _append(self, record, sync=True):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        self._journal.write(line.encode('utf-8'))
+        self._journal.flush()
+        if sync:
+            os.fsync(self._journal.fileno())
+        self._records += 1
+
+
+    def _apply_put(self, filename, d):
+        if filename not in self._messages:
+            bisect.insort(self._order, filename)
+        msg = Message(d)
+        msg.filename = filename
+        self._messages[filename] = msg
+
+
+    def _apply_del(self, filename):
+        if self._messages.pop(filename, None) is None:
+            return
+        i = bisect.bisect_left(self._order, filename)
+        del self._order[i]
+
+
+    def _maybe_compact(self):
+        if (self._records > COMPACT_MIN_RECORDS and
+                self._records > COMPACT_RATIO * len(self._messages)):
+            self._compact()
+
+
+    def _compact(self):
+        _logger.debug('Compacting %s: %d records, %d messages.', self.path,
+                      self._records, len(self._messages))
+        tmpfile = '%s.tmp' % self.path
+        with open(tmpfile, 'wb') as f:
+            for filename in self._order:
+                record = {'op': 'put', 'filename': filename,
+                          'message': self._messages[filename].to_json()}
+                line = json.dumps(record, separators=(',', ':')) + '\n'
+                f.write(line.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmpfile, self.path)
+        fsync_dir(os.path.dirname(self.path))
+
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.path, 'ab')
+        self._records = len(self._messages)
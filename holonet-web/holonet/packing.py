@@ -0,0 +1,145 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Packing of several messages into one SBD payload.
+
+Each SBD message is billed per 50-byte credit and costs a whole satellite
+session, so short messages are packed together where possible.  A packed
+payload is:
+
+    PACKED_MAGIC (1 byte), version (1 byte), then one record per message:
+    length (1 byte), record (length bytes)
+
+where each record is a message in the legacy "recipient:body" format.  The
+magic byte can never start a legacy payload (which is UTF-8 text), so
+unpack() accepts either.
+'''
+
+PACKED_MAGIC = 0xfe
+PACKED_VERSION = 1
+HEADER_SIZE = 2
+RECORD_LENGTH_SIZE = 1
+MAX_RECORD_SIZE = 255
+
+# The largest MO payload that the RockBLOCK 9602 accepts.
+MAX_PAYLOAD = 340
+
+
+class PackingException(Exception):
+    pass
+
+
+def is_packed(payload):
+    return len(payload) > 0 and payload[0] == PACKED_MAGIC
+
+
+def pack(records):
+    """
+    Args:
+        records (list of bytes): The messages to pack.
+
+    Returns: the packed payload.
+
+    Raises: PackingException if any record is too long to pack.
+    """
+    result = bytearray([PACKED_MAGIC, PACKED_VERSION])
+    for record in records:
+        if len(record) > MAX_RECORD_SIZE:
+            raise PackingException(
+                'Record of %d bytes is too long to pack.' % len(record))
+        result.append(len(record))
+        result += record
+    return bytes(result)
+
+
+def pack_greedy(records, max_payload=MAX_PAYLOAD):
+    """
+    Pack as many of the given records as will fit into one payload, in
+    order.  If only one fits, it is returned as it is, so that it can be
+    read without unpack().
+
+    Args:
+        records (iterable of bytes): The messages to pack, in order.  This
+            is only consumed as far as is needed.
+        max_payload (int): The size of payload to fill.
+
+    Returns: a tuple (payload, count), where count is the number of records
+    in the payload, or (None, 0) if there were no records.
+    """
+    records = iter(records)
+    first = next(records, None)
+    if first is None:
+        return (None, 0)
+
+    packed = [first]
+    size = HEADER_SIZE + RECORD_LENGTH_SIZE + len(first)
+    if len(first) <= MAX_RECORD_SIZE and size <= max_payload:
+        for record in records:
+            size += RECORD_LENGTH_SIZE + len(record)
+            if len(record) > MAX_RECORD_SIZE or size > max_payload:
+                break
+            packed.append(record)
+
+    if len(packed) == 1:
+        return (first, 1)
+    return (pack(packed), len(packed))
+
+
+def unpack(payload):
+    """
+    Args:
+        payload (bytes): A packed payload, or a legacy single message.
+
+    Returns: list of the messages in the payload, as bytes.
+
+    Raises: PackingException if the payload is packed but malformed.
+    """
+    if not is_packed(payload):
+        return [payload]
+    if len(payload) < HEADER_SIZE:
+        raise PackingException('Truncated header.')
+    version = payload[1]
+    if version != PACKED_VERSION:
+        raise PackingException('Unsupported packing version %d.' % version)
+
+    result = []
+    i = HEADER_SIZE
+    while i < len(payload):
+        length = payload[i]
+        i += RECORD_LENGTH_SIZE
+        if i + length > len(payload):
+            raise PackingException('Truncated record at offset %d.' % i)
+        result.append(payload[i:i + length])
+        i += length
+    return result
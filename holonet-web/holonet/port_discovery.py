@@ -0,0 +1,221 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Finds the serial port that the RockBLOCK is attached to.
+
+The port and IMEI that we found last time are cached, and that port is
+tried first, so that a normal boot costs a single short handshake.  If that
+fails, every candidate port is probed concurrently.  On Linux, sysfs is
+used to skip tty nodes that have no hardware behind them (virtual consoles,
+unconfigured 8250 UARTs and so on).
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
+import logging
+import os.path
+import re
+import sys
+import time
+
+import serial
+
+from .utils import write_file
+
+
+CACHE_FILE = '/var/opt/pr-holonet/rockblock_port.json'
+SYSFS_TTY = '/sys/class/tty'
+PROBE_TIMEOUT = 0.5
+PROBE_BAUD = 19200
+# A modem that has just woken up often ignores the first AT, so we try more
+# than once.
+PROBE_AT_ATTEMPTS = 2
+
+# Will be overridden by app.py for non-Gunicorn builds.
+cache_file = CACHE_FILE
+
+_IMEI_RE = re.compile(b'^[0-9]{15}$')
+
+_logger = logging.getLogger('holonet.port_discovery')
+
+
+def find_rockblock():
+    """
+    Returns: the path of the port with a RockBLOCK on it, or None.
+    """
+    start = time.monotonic()
+    cached = _read_cache()
+    cached_port = cached.get('port')
+    cached_imei = cached.get('imei')
+
+    if cached_port:
+        imei = probe(cached_port)
+        if imei is not None and (cached_imei is None or imei == cached_imei):
+            _logger.debug('Found RockBLOCK %s on cached port %s in %.2f '
+                          'secs.', imei, cached_port,
+                          time.monotonic() - start)
+            return cached_port
+
+    # The cached port is probed again along with the others: the modem may
+    # only have been slow to wake up.
+    ports = candidate_ports()
+    if cached_port and cached_port not in ports:
+        ports.append(cached_port)
+    found = probe_all(ports)
+    if not found:
+        _logger.warning('No RockBLOCK found on any of %s.', ports)
+        return None
+
+    # Prefer the modem that we saw last time, if there's more than one.
+    port = next((p for p in found if found[p] == cached_imei), None)
+    if port is None:
+        port = sorted(found)[0]
+    _logger.info('Found RockBLOCK %s on %s in %.2f secs.', found[port], port,
+                 time.monotonic() - start)
+    _write_cache(port, found[port])
+    return port
+
+
+def probe_all(ports):
+    """
+    Probe the given ports concurrently.
+
+    Returns: dict of port: IMEI for each port with a modem on it.
+    """
+    if not ports:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        imeis = list(executor.map(probe, ports))
+    return dict((p, i) for (p, i) in zip(ports, imeis) if i is not None)
+
+
+def probe(port, timeout=PROBE_TIMEOUT):
+    """
+    Check for a modem on the given port with AT (up to PROBE_AT_ATTEMPTS
+    times) and AT+GSN.
+
+    Returns: the modem's IMEI as a str, or None.
+    """
+    try:
+        s = serial.Serial(port, PROBE_BAUD, timeout=timeout,
+                          write_timeout=timeout)
+    except (OSError, serial.SerialException) as err:
+        _logger.debug('Cannot open %s: %s', port, err)
+        return None
+
+    try:
+        s.reset_input_buffer()
+        for _ in range(PROBE_AT_ATTEMPTS):
+            if _probe_command(s, b'AT', timeout) is not None:
+                break
+        else:
+            return None
+        lines = _probe_command(s, b'AT+GSN', timeout)
+        if lines is None:
+            return None
+        imeis = [line for line in lines if _IMEI_RE.match(line)]
+        return imeis[0].decode('ascii') if imeis else None
+    except (OSError, serial.SerialException) as err:
+        _logger.debug('Failed to probe %s: %s', port, err)
+        return None
+    finally:
+        s.close()
+
+
+def _probe_command(s, cmd, timeout):
+    """
+    Returns: the response lines before OK, or None if OK didn't arrive
+    within timeout.
+    """
+    s.write(cmd + b'\r')
+    deadline = time.monotonic() + timeout
+    lines = []
+    while time.monotonic() < deadline:
+        line = s.readline()
+        if not line:
+            break
+        line = line.strip()
+        if line == b'OK':
+            return lines
+        if line and line != cmd and line != b'SBDRING':
+            lines.append(line)
+    return None
+
+
+def candidate_ports():
+    if sys.platform.startswith('win'):
+        return ['COM' + str(i + 1) for i in range(256)]
+    elif sys.platform.startswith('darwin'):
+        return glob.glob('/dev/tty.*')
+
+    ports = sorted(glob.glob('/dev/tty[A-Za-z]*'))
+    if not os.path.isdir(SYSFS_TTY):
+        return ports
+    return [p for p in ports if is_possible_modem(os.path.basename(p))]
+
+
+def is_possible_modem(name, sysfs_tty=SYSFS_TTY):
+    """
+    Use the sysfs attributes of the given tty to decide whether there
+    could be a modem on it.
+    """
+    tty_path = os.path.join(sysfs_tty, name)
+    if not os.path.exists(os.path.join(tty_path, 'device')):
+        # Virtual consoles, ptys and the like.
+        return False
+
+    # 8250-style UARTs are registered whether or not the hardware exists,
+    # and report a port type of 0 (PORT_UNKNOWN) if it doesn't.
+    try:
+        with open(os.path.join(tty_path, 'type'), 'r') as f:
+            return f.read().strip() != '0'
+    except (OSError, ValueError):
+        return True
+
+
+def _read_cache():
+    try:
+        with open(cache_file, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cached if isinstance(cached, dict) else {}
+
+
+def _write_cache(port, imei):
+    try:
+        write_file(cache_file, json.dumps({'port': port, 'imei': imei}))
+    except Exception as err:
+        _logger.warning('Failed to write %s: %s', cache_file, err)
@@ -34,40 +34,116 @@ ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
 import asyncio
+import heapq
+import itertools
 import logging
+import random
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from threading import Thread
+from threading import Event, Lock, Thread
 
 from serial import serialutil
 
-from holonet import holonetGPIO, mailboxes, rockblock
-
-SIGNAL_CHECK_SECONDS = 60 * 5
-
-
-last_known_signal_status = False
-last_known_signal_strength = 0
-last_known_signal_time = datetime.min
-last_known_rockblock_status = 'Unknown'
-last_txfailed_mo_status = 0
-message_pending_senders = {}
-rockblock_serial_identifier = None
+from holonet import compression, fragmentation, holonetGPIO, mailboxes, \
+    packing, port_discovery, rockblock, signal_scheduler, status
+from holonet.message import MissingRecipientException
+from holonet.utils import parse_utc_str, utc_str
+
+
+# What we know about the RockBLOCK and the queues; see holonet.status.
+status_board = status.StatusBoard()
+
+# Whether to pack several outbox messages into each MO payload (see
+# holonet.packing).  The relay has to understand the packed format, so this
+# is off by default; app.py turns it on with HOLONET_PACK_OUTBOX.
+pack_outbox = False
+# Whether to send messages that are too long for one MO payload in
+# fragments (see holonet.fragmentation).  Again, the relay has to
+# understand them; app.py turns this on with HOLONET_FRAGMENT_OUTBOX.
+# Otherwise, such messages are moved to the dead letter box.
+fragment_outbox = False
+# Which holonet.compression codec to encode outgoing messages with.  Again,
+# the relay has to be able to decode them; app.py sets this from
+# HOLONET_OUTBOX_CODEC.
+outbox_codec = compression.CODEC_NONE
+# How many times to try sending a message before giving up and moving it to
+# the dead letter box.  app.py sets this from HOLONET_MAX_SEND_ATTEMPTS.
+max_send_attempts = 10
+
+# Between attempts, we back off exponentially from RETRY_BASE_SECS up to
+# RETRY_MAX_SECS; see retry_delay.
+RETRY_BASE_SECS = 60
+RETRY_MAX_SECS = 6 * 3600
+
+# +SBDIX MO statuses that mean that the message itself is at fault, so
+# there's no point trying it again.
+PERMANENT_MO_STATUSES = (12, 14)
+
+_MO_STATUS_REASONS = {
+    -1: 'The RockBLOCK failed to start a session',
+    10: 'The call to the gateway timed out',
+    11: 'The gateway\'s queue is full',
+    12: 'The message has too many segments',
+    13: 'The session did not complete',
+    14: 'The message is an invalid size',
+    15: 'Access to the gateway was denied',
+    16: 'The RockBLOCK is locked',
+    17: 'The gateway is not responding',
+    18: 'The connection was lost',
+    19: 'The link failed',
+    32: 'There is no network service',
+    35: 'The RockBLOCK is busy',
+    36: 'The gateway asked us to try later',
+    37: 'SBD service is temporarily disabled',
+    38: 'The gateway asked us to try later',
+}
+
+# A signal reading (or request for one) at most this old is good enough
+# for request_signal_strength.
+SIGNAL_MAX_AGE_SECS = 30
+
+# Work items are run most urgent first; see _call_soon.
+WORK_PRIORITY_RING = 0
+WORK_PRIORITY_USER = 1
+WORK_PRIORITY_BACKGROUND = 2
+
+# Work items that are redundant while the given one is pending: a session
+# to get messages sends the outbox too.
+_SUBSUMED_BY = {
+    'check_outbox': 'get_messages',
+}
 
 _logger = logging.getLogger('holonet.queue_manager')
 
+# The event loop runs the timers, and the executor runs the work items, one
+# at a time, so that the loop isn't held up while the RockBLOCK driver waits
+# for the sky.
 _event_loop = None
 _thread = None
+_executor = None
 _queue_manager = None
 
+# The work items waiting to run: a heap of [priority, sequence number,
+# method name, args] lists, and the same lists by method name.  An entry
+# that has been superseded has its method name set to None.
+_work_heap = []
+_work_pending = {}
+_work_lock = Lock()
+_work_sequence = itertools.count()
+# The priority of the work item that is running, if any, and the driver's
+# interrupt event, which we set when something more urgent is queued.
+_work_running = None
+_work_interrupt = Event()
 
-class SendFailureException(Exception):
-    pass
+# When request_signal_strength last asked for a reading.
+_last_signal_request = datetime.min
 
 
 def start(device=None):
     global _event_loop
     global _thread
+    global _executor
     global _queue_manager
 
     _queue_manager = QueueManager(device=device)
@@ -76,38 +152,176 @@ def start(device=None):
     _thread = Thread(target=_event_loop.run_forever)
     _thread.daemon = True
     _thread.start()
+    _executor = ThreadPoolExecutor(max_workers=1,
+                                   thread_name_prefix='holonet-work')
 
-    _event_loop.call_soon_threadsafe(_queue_manager.get_serial_identifier)
+    _call_soon('get_serial_identifier')
     request_signal_strength()
-    _event_loop.call_later(SIGNAL_CHECK_SECONDS, _check_signal)
+    _event_loop.call_later(signal_scheduler.IDLE_POLL_SECS, _check_signal)
 
 
 def check_outbox():
-    _event_loop.call_soon_threadsafe(_queue_manager.check_outbox)
+    _call_soon('check_outbox')
 
-def clear_message_pending(sender):
-    if sender in message_pending_senders:
-        del message_pending_senders[sender]
-    led_status = bool(message_pending_senders)
-    holonetGPIO.HolonetGPIO.set_led_message_pending(led_status)
+def get_status():
+    """Returns: the current holonet.status.Status."""
+    return status_board.get()
 
-def get_messages(ack_ring):
-    _event_loop.call_soon_threadsafe(_queue_manager.get_messages, ack_ring)
+def clear_message_pending(sender, local_user='local'):
+    mailboxes.mark_thread_read(local_user, sender)
+    status_board.modify(
+        lambda s: {'pending_senders': s.pending_senders - {sender}})
+
+def _update_message_pending_led(old, new):
+    if bool(old.pending_senders) != bool(new.pending_senders):
+        holonetGPIO.HolonetGPIO.set_led_message_pending(
+            bool(new.pending_senders))
+
+
+status_board.subscribe(_update_message_pending_led)
 
-def request_signal_strength():
-    _event_loop.call_soon_threadsafe(_queue_manager.request_signal_strength)
+
+def get_messages(ack_ring):
+    # Answering a ring comes first: the gateway is waiting for us.
+    priority = WORK_PRIORITY_RING if ack_ring else WORK_PRIORITY_USER
+    _call_soon('get_messages', ack_ring, priority=priority)
+
+def request_signal_strength(max_age=SIGNAL_MAX_AGE_SECS):
+    """
+    Ask for a new signal reading, unless the last one (or the last request
+    for one) is less than max_age seconds old.
+    """
+    global _last_signal_request
+
+    now = datetime.utcnow()
+    with _work_lock:
+        age = now - max(get_status().signal_time, _last_signal_request)
+        if age < timedelta(seconds=max_age):
+            _logger.debug('Signal reading is fresh enough (%s old).', age)
+            return
+        _last_signal_request = now
+    _call_soon('request_signal_strength')
 
 def _check_signal():
-    _event_loop.call_soon_threadsafe(_queue_manager.check_signal)
-    _event_loop.call_later(SIGNAL_CHECK_SECONDS, _check_signal)
+    _call_soon('check_signal', priority=WORK_PRIORITY_BACKGROUND)
+    _event_loop.call_later(_queue_manager.next_signal_check_delay(),
+                           _check_signal)
+
+def _call_soon(method_name, *args, priority=WORK_PRIORITY_USER):
+    """
+    Queue a call to the given QueueManager method on the work executor.
+    The modem can only do one thing at a time, so if the same method is
+    already waiting to run then this call is folded into that one, taking
+    whichever priority (and args) is more urgent.  If the work item that is
+    running is less urgent, the driver is interrupted, so that it gives up
+    on any wait (for the signal, say) and lets this one run.
+    """
+    # A QueueManager can be driven directly, without start(), e.g. against
+    # the RockBLOCK emulator.  In that case there's no executor to defer to,
+    # and the caller is responsible for doing the work itself.
+    if _executor is None:
+        _logger.debug('No executor; not scheduling %s.', method_name)
+        return
+
+    with _work_lock:
+        if _SUBSUMED_BY.get(method_name) in _work_pending:
+            _logger.debug('Dropping %s: %s is pending.', method_name,
+                          _SUBSUMED_BY[method_name])
+            return
+        pending = _work_pending.get(method_name)
+        if pending is not None and pending[0] <= priority:
+            _logger.debug('Dropping %s: it is already pending.', method_name)
+            return
+        entry = [priority, next(_work_sequence), method_name, args]
+        _work_pending[method_name] = entry
+        heapq.heappush(_work_heap, entry)
+        if _work_running is not None and priority < _work_running:
+            _logger.debug('Interrupting the running work item for %s.',
+                          method_name)
+            _work_interrupt.set()
+        if pending is not None:
+            # This supersedes a less urgent entry, which already has a run
+            # scheduled for it, so that run will do this one instead.
+            pending[2] = None
+            return
+    _executor.submit(_run_next_work_item)
+
+def _run_next_work_item():
+    global _work_running
+
+    with _work_lock:
+        while True:
+            (priority, _, method_name, args) = heapq.heappop(_work_heap)
+            if method_name is not None:
+                break
+        while _work_heap and _work_heap[0][2] is None:
+            heapq.heappop(_work_heap)
+        del _work_pending[method_name]
+        _work_running = priority
+        # Whatever interrupted the last work item is this one, or queued
+        # behind it.
+        _work_interrupt.clear()
+    # Anything that's asked for while this runs is queued again, since it
+    # may be asking about something that's changed since we started.
+    try:
+        getattr(_queue_manager, method_name)(*args)
+    except Exception as err:
+        _logger.error('Work item %s failed: %s', method_name, err)
+        traceback.print_exc()
+    finally:
+        with _work_lock:
+            _work_running = None
+
+
+def retry_delay(attempts, rand=random.random):
+    """
+    Returns: seconds to wait before trying to send a message again, after it
+    has failed the given number of times.  This doubles with each failure,
+    up to RETRY_MAX_SECS, and the top half of it is random so that messages
+    that failed together don't all retry together.
+    """
+    delay = min(RETRY_MAX_SECS, RETRY_BASE_SECS * 2 ** (attempts - 1))
+    return delay / 2 * (1 + rand())
+
+
+def _mo_status_reason(mo_status):
+    return _MO_STATUS_REASONS.get(mo_status, 'MO status %s' % mo_status)
+
+
+def _give_up_reason(msg):
+    """Returns: why we should give up on the given outbox message, or None
+       if we should keep trying."""
+    if msg.failed:
+        return msg.failed
+    if (msg.attempts or 0) >= max_send_attempts:
+        return '%s (after %d attempts)' % (msg.last_error, msg.attempts)
+    return None
+
+
+def _send_order(msg):
+    # read_outbox returns the messages oldest first, and sort is stable, so
+    # age is the final tie-breaker.
+    expires_at = (datetime.max if msg.expires_at is None
+                  else parse_utc_str(msg.expires_at))
+    return (-msg.effective_priority, msg.fragments_sent or 0, expires_at)
 
 
 class QueueManager(rockblock.RockBlockProtocol,
                    holonetGPIO.HolonetGPIOProtocol):
     def __init__(self, device):
-        global last_known_rockblock_status
-
-        self.send_status = None
+        # The outbox messages that are in the RockBLOCK's MO buffer, as
+        # (Message, fragment index, fragment count) tuples, where the
+        # fragment index is None for a whole message.
+        self._mo_loaded = []
+        # Whether we've already counted a failed attempt to send
+        # self._mo_loaded.  The driver may try several sessions with the
+        # same MO buffer, but we count that as one attempt.
+        self._mo_failed = False
+        # When check_signal last asked for a reading.
+        self._last_signal_request = datetime.min
+
+        self.scheduler = signal_scheduler.SignalScheduler(
+            signal_scheduler.history_file)
 
         self.gpio = holonetGPIO.HolonetGPIO(self)
         self.gpio.set_led_connection_status(holonetGPIO.BLUE)
@@ -115,40 +329,31 @@ class QueueManager(rockblock.RockBlockProtocol,
 
         try:
             if device is None:
-                devices = rockblock.RockBlock.listPorts()
-                if not devices:
-                    _logger.error(
-                        'Cannot find RockBLOCK (or any working serial '
-                        'connections)!  Will muddle on without it.')
-                    self.rockblock = None
-                    last_known_rockblock_status = 'Missing'
-                    return
-                # Check if ttyS0 is available and connect to it. That is where our rockblock is at
-                #TODO: write code to test connections for rockblock before selecting.
-                for x in range(0, len(devices)):
-                    if '/dev/ttyS0' == devices[x]:
-                        device = devices[x]
+                device = port_discovery.find_rockblock()
                 if device is None:
                     _logger.error(
-                        'Cannot find expected RockBlock serial port. ttyS0 not listed. Will muddle on without it'
-                        )
+                        'Cannot find RockBLOCK on any serial port!  Will '
+                        'muddle on without it.')
                     self.rockblock = None
-                    last_known_rockblock_status = 'Missing'
+                    status_board.update(rockblock_status='Missing')
+                    self.gpio.set_led_connection_status(holonetGPIO.RED)
                     return
             self.rockblock = rockblock.RockBlock(device, self)
-            last_known_rockblock_status = 'Installed'
+            self.rockblock.scheduler = self.scheduler
+            self.rockblock.interrupt = _work_interrupt
+            status_board.update(rockblock_status='Installed')
         except serialutil.SerialException as err:
             _logger.error(
                 'Failed to initialize RockBLOCK!  Will muddle on without it.  '
                 '%s', err)
             self.rockblock = None
-            last_known_rockblock_status = 'Missing'
+            status_board.update(rockblock_status='Missing')
         except:  # noqa pylint: disable=bare-except
             _logger.error(
                 'Failed to initialize RockBLOCK!  Will muddle on without it.')
             traceback.print_exc()
             self.rockblock = None
-            last_known_rockblock_status = 'Broken'
+            status_board.update(rockblock_status='Broken')
 
         if self.rockblock is None:
             self.gpio.set_led_connection_status(holonetGPIO.RED)
@@ -161,8 +366,8 @@ class QueueManager(rockblock.RockBlockProtocol,
             return
 
         try:
-            global rockblock_serial_identifier
-            rockblock_serial_identifier = self.rockblock.getSerialIdentifier()
+            status_board.update(
+                rockblock_serial=self.rockblock.getSerialIdentifier())
         except Exception as err:
             _logger.error('Failed to get RockBLOCK serial identifier: %s', err)
             traceback.print_exc()
@@ -178,9 +383,9 @@ class QueueManager(rockblock.RockBlockProtocol,
         try:
             msgs = mailboxes.accept_all_inbox_messages()
             if msgs:
-                for msg in msgs:
-                    message_pending_senders[msg.sender] = True
-                self.gpio.set_led_message_pending(True)
+                senders = frozenset(msg.sender for msg in msgs)
+                status_board.modify(
+                    lambda s: {'pending_senders': s.pending_senders | senders})
         except Exception as err:
             _logger.error('Failed to accept messages: %s', err)
             traceback.print_exc()
@@ -197,58 +402,172 @@ class QueueManager(rockblock.RockBlockProtocol,
         self.rockblock.messageCheck(ack_ring=ack_ring)
 
 
-    def rockBlockRxReceived(self, _mtmsn, data):
-        _ = self
+    def rockBlockRxReceived(self, mtmsn, data):
         _logger.debug('RockBLOCK: Received data of length %s.', len(data))
-        mailboxes.save_message_to_inbox(data)
+        # The same MT message can arrive twice, e.g. if a session is retried
+        # after a resync.  We check the whole payload rather than each
+        # record in it, because a packed payload can legitimately contain
+        # the same record twice.
+        if mailboxes.mt_already_delivered(mtmsn, data):
+            _logger.info('RockBLOCK: dropping duplicate MT message %s.',
+                         mtmsn)
+            return
+        self._save_received(data)
+        mailboxes.record_mt_delivery(mtmsn, data)
 
 
-    def check_outbox(self):
-        outbox = mailboxes.read_outbox()
-        for msg in outbox:
-            self._send_message(msg)
+    def _save_received(self, data):
+        _ = self
+        try:
+            records = packing.unpack(data)
+        except packing.PackingException as err:
+            _logger.error('Failed to unpack received message: %s', err)
+            records = [data]
+        for record in records:
+            if fragmentation.is_fragment(record):
+                record = self._reassemble(record)
+                if record is None:
+                    continue
+            mailboxes.save_message_to_inbox(record)
+
+
+    def _reassemble(self, payload):
+        _ = self
+        mailboxes.expire_fragments(fragmentation.REASSEMBLY_TIMEOUT)
+        try:
+            return mailboxes.save_fragment(payload)
+        except fragmentation.FragmentationException as err:
+            _logger.error('Discarding bad fragment: %s', err)
+            return None
 
 
-    def _send_message(self, msg):
+    def check_outbox(self):
+        if not self._due_outbox():
+            return
         if self.rockblock is None:
-            _logger.info('Cannot send message: we have no RockBLOCK.  %s', msg)
+            _logger.info('Cannot send messages: we have no RockBLOCK.')
             return
 
-        try:
-            self._try_to_send_message(msg)
-            mailboxes.remove_from_outbox(msg.filename)
-            _logger.debug('Successfully sent and removed %s.', msg.filename)
-        except Exception as err:
-            _logger.warning('Tried to send message %s, but failed: %s',
-                            msg.filename, err)
-            # TODO: We're currently just leaving the message, so we'll retry it
-            # forever.  Give up at some point?
-
+        # Outbox messages are loaded into the MO buffer by
+        # rockBlockNextMoMessage, a payload per session, so sending is just
+        # a matter of running sessions, and any MT traffic that's waiting
+        # comes back on the same sessions.
+        self.get_messages(ack_ring=False)
 
-    def _try_to_send_message(self, msg):
-        _logger.debug('RockBLOCK: sending %s.', msg.filename)
 
-        msg_bytes = msg.to_bytes()
-        # We get calls to rockBlockTxSuccess / rockBlockTxFailed during the
-        # call below.  We use self.send_status as a hack to unpick the
-        # callback.
-        self.send_status = None
-        self.rockblock.sendMessage(msg_bytes)
-        assert self.send_status is not None
-        if not self.send_status:
-            _logger.warning('RockBLOCK: sending %s failed.', msg)
-            raise SendFailureException()
+    def rockBlockNextMoMessage(self):
+        units = list(self._outbox_units())
+        if pack_outbox:
+            (payload, count) = packing.pack_greedy(
+                unit[3] for unit in units)
+        elif units:
+            (payload, count) = (units[0][3], 1)
+        else:
+            (payload, count) = (None, 0)
+
+        self._mo_loaded = [unit[:3] for unit in units[:count]]
+        self._mo_failed = False
+        if payload is not None:
+            _logger.debug('RockBLOCK: loading %s.', ', '.join(
+                m.filename for (m, _, _) in self._mo_loaded))
+        return payload
+
+
+    def _outbox_units(self):
+        """
+        Yields: (Message, fragment index, fragment count, payload) for the
+        next thing to send from each outbox message, in the order that they
+        should be sent: by priority, then earliest expiry, then oldest
+        first.  The next fragment of a long message waits behind any message
+        of the same priority that hasn't had as many fragments sent, so
+        that a long message can't hold up short ones.  Messages that are
+        waiting to retry are skipped, and messages that can't be sent are
+        moved to the dead letter box.
+        """
+        outbox = self._due_outbox()
+        outbox.sort(key=_send_order)
+        for msg in outbox:
+            try:
+                data = compression.encode(msg.to_bytes(), outbox_codec)
+            except MissingRecipientException:
+                mailboxes.move_to_dead_letter(msg, 'It has no recipient')
+                continue
+            if not fragmentation.needs_fragmenting(data):
+                yield (msg, None, 1, data)
+                continue
+            if not fragment_outbox:
+                mailboxes.move_to_dead_letter(
+                    msg, 'It is too long to send (%d bytes, and the limit '
+                    'is %d)' % (len(data), fragmentation.MAX_PAYLOAD))
+                continue
+
+            if msg.fragment_id is None:
+                msg.fragment_id = fragmentation.new_message_id()
+            index = msg.fragments_sent or 0
+            try:
+                yield (msg, index, fragmentation.fragment_count(data),
+                       fragmentation.fragment(data, msg.fragment_id, index))
+            except fragmentation.FragmentationException as err:
+                mailboxes.move_to_dead_letter(msg, str(err))
+
+
+    def _due_outbox(self):
+        """
+        Returns: the outbox messages that are due to be sent, after dropping
+        any that have expired and moving any that we've given up on to the
+        dead letter box.
+        """
+        _ = self
+        mailboxes.expire_outbox()
+        now = datetime.utcnow()
+        result = []
+        for msg in mailboxes.read_outbox():
+            reason = _give_up_reason(msg)
+            if reason:
+                mailboxes.move_to_dead_letter(msg, reason)
+            elif msg.is_due(now):
+                result.append(msg)
+        return result
 
 
     def rockBlockTxFailed(self, moStatus):
-        global last_txfailed_mo_status
-        last_txfailed_mo_status = moStatus
-        self.send_status = False
+        status_board.update(txfailed_mo_status=moStatus)
+        if self._mo_failed:
+            return
+        self._mo_failed = True
+
+        # The messages stay in the outbox (and in self._mo_loaded, in case
+        # the driver tries again and succeeds).  If we're giving up on them,
+        # _due_outbox moves them to the dead letter box next time round.
+        reason = _mo_status_reason(moStatus)
+        now = datetime.utcnow()
+        for (msg, _, _) in self._mo_loaded:
+            msg.attempts = (msg.attempts or 0) + 1
+            msg.last_error = reason
+            _logger.warning('RockBLOCK: sending %s failed (attempt %d): %s.',
+                            msg.filename, msg.attempts, reason)
+            if moStatus in PERMANENT_MO_STATUSES:
+                msg.failed = reason
+            else:
+                delay = retry_delay(msg.attempts)
+                msg.next_attempt_at = utc_str(now + timedelta(seconds=delay))
+            mailboxes.update_outbox_message(msg)
 
 
     def rockBlockTxSuccess(self, momsn):
         _logger.debug('RockBLOCK: TxSuccess.  Message ID: %s.', momsn)
-        self.send_status = True
+        loaded = self._mo_loaded
+        self._mo_loaded = []
+        for (msg, index, count) in loaded:
+            if index is not None and index + 1 < count:
+                msg.fragments_sent = index + 1
+                msg.attempts = None
+                msg.last_error = None
+                msg.next_attempt_at = None
+                mailboxes.update_outbox_message(msg)
+                continue
+            mailboxes.remove_from_outbox(msg.filename)
+            _logger.debug('Successfully sent and removed %s.', msg.filename)
 
 
     def rockBlockRxStarted(self):
@@ -257,6 +576,11 @@ class QueueManager(rockblock.RockBlockProtocol,
     def rockBlockRxFailed(self):
         _logger.debug('RockBLOCK: RxFailed.')
 
+    def rockBlockRxMessageQueue(self, count):
+        _ = self
+        _logger.debug('RockBLOCK: %s messages still queued.', count)
+        status_board.update(mt_queued=count)
+
 
     def request_signal_strength(self):
         if self.rockblock is None:
@@ -269,20 +593,15 @@ class QueueManager(rockblock.RockBlockProtocol,
         self.rockblock.requestSignalStrength()
 
     def rockBlockSignalUpdate(self, signal):
-        global last_known_signal_status
-        global last_known_signal_strength
-        global last_known_signal_time
-
         _logger.info('RockBLOCK: signal strength = %s.', signal)
-        last_known_signal_strength = signal
-        last_known_signal_time = datetime.utcnow()
-        if signal < rockblock.SIGNAL_THRESHOLD:
+        signal_ok = signal >= rockblock.SIGNAL_THRESHOLD
+        last = get_status().signal_ok
+        status_board.update(signal_ok=signal_ok, signal_strength=signal,
+                            signal_time=datetime.utcnow())
+        if not signal_ok:
             _logger.warning('RockBLOCK: No signal.')
-            last_known_signal_status = False
             self.gpio.set_led_connection_status(holonetGPIO.YELLOW)
         else:
-            last = last_known_signal_status
-            last_known_signal_status = True
             self.gpio.set_led_connection_status(holonetGPIO.GREEN)
             if last:
                 return
@@ -292,14 +611,37 @@ class QueueManager(rockblock.RockBlockProtocol,
 
 
     def check_signal(self):
-        global last_known_signal_time
-
         now = datetime.utcnow()
-        then = last_known_signal_time + timedelta(seconds=SIGNAL_CHECK_SECONDS)
+        last = max(get_status().signal_time, self._last_signal_request)
+        then = last + timedelta(seconds=signal_scheduler.PENDING_POLL_SECS)
         if then < now:
-            last_known_signal_time = now
+            self._last_signal_request = now
             self.request_signal_strength()
 
+        # Messages that are backing off after a failure aren't retried by
+        # anything else, so pick them up here once they're due.
+        if get_status().signal_ok and self._due_outbox():
+            self.check_outbox()
+
+
+    def next_signal_check_delay(self):
+        """
+        Returns: seconds until the next background signal check.  We check
+        more often when there's traffic waiting, and less often when the
+        signal history says that it's not worth it right now.
+        """
+        pending = mailboxes.outbox_size() > 0
+        return self.scheduler.next_check_delay(pending)
+
+
+    def rockBlockRingAlert(self):
+        # An SBDRING on the serial line, for RockBLOCKs whose ring indicator
+        # pin isn't wired up.  This usually arrives while a work item is
+        # running; _call_soon cuts short its waits so that this goes next.
+        _ = self
+        _logger.info('RockBLOCK: ring alert.')
+        get_messages(ack_ring=True)
+
 
     def holonetGPIORingIndicatorChanged(self, status):
         _logger.info('RockBLOCK: ring indicator = %s.', status)
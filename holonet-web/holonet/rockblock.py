@@ -23,13 +23,13 @@ Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
 
 
 
-import glob
 import logging
-import sys
+import threading
 import time
-import traceback
 import serial
 
+from . import at_parser, rockblock_stats
+from .at_parser import ATTokenReader, sbd_checksum
 from .utils import do_callback
 
 
@@ -39,8 +39,27 @@ SIGNAL_ATTEMPTS = 10
 # used for waiting on rockblock to send all data to system
 RESCAN_DELAY = 10
 SIGNAL_THRESHOLD = 2
-SYNC_COMMS_ATTEMPTS = 3
-ROCKBLOCK_POWER_BACKOFF = 40
+# How long a good signal reading is trusted while draining the MT queue.
+SIGNAL_FRESH_SECS = 60
+# How long to wait for each response line while connecting, and afterwards.
+CONNECT_TIMEOUT = 5
+COMMAND_TIMEOUT = 60
+# Delays before each attempt to get back in sync with the modem after a
+# garbled or missing response, or a serial error.
+RESYNC_SCHEDULE = (0, 0.5, 1, 2, 4, 8)
+# How long the line must be quiet before we consider the input drained.
+RESYNC_QUIET = 0.2
+RESYNC_PING_TIMEOUT = 1
+MT_READ_ATTEMPTS = 2
+# Failed sessions allowed per _attemptSession, and the delay before the
+# first retry, which doubles with each failure.
+SESSION_ATTEMPTS = 3
+SESSION_RETRY_DELAY = 5
+# Commands that are not sent again after a resync, because the modem may
+# have acted on them even though we lost the response: repeating a session
+# could send the MO buffer twice.  _attemptSession decides what to do.
+NO_RESEND_COMMANDS = (b'AT+SBDIX', b'AT+SBDIXA')
+MT_READ_TIMEOUT = 10
 
 _logger = logging.getLogger('holonet.rockblock')
 
@@ -69,7 +88,15 @@ class RockBlockProtocol(object):
     def rockBlockRxMessageQueue(self, count):
         pass
 
+    def rockBlockRingAlert(self):
+        pass
+
     # MO
+    def rockBlockNextMoMessage(self):
+        """Returns: the next message (bytes) to load into the MO buffer, so
+           that it rides along on the next session, or None."""
+        return None
+
     def rockBlockTxStarted(self):
         pass
 
@@ -84,6 +111,13 @@ class RockBlockException(Exception):
     pass
 
 
+# Why we lost sync with the modem, as diagnosed by RockBlock._resync.
+RESYNC_SILENT = 'silent'  # Nothing extra on the line; a response went missing
+RESYNC_STALE = 'stale'  # Leftover responses to earlier commands
+RESYNC_NOISE = 'noise'  # Bytes that can't be AT responses
+RESYNC_BROWNOUT = 'brownout'  # The port failed, e.g. the modem lost power
+
+
 class RockBlock(object):
 
     # May 11, 2014, at 14:23:55 (This will be 're-epoched' every couple of
@@ -99,19 +133,51 @@ class RockBlock(object):
         # messages to download.
         self.autoSession = True
 
-        self.s = serial.Serial(self.portId, 19200, timeout=5)
+        # time.monotonic() of the last good signal reading or session.
+        self._last_good_signal_time = None
+
+        # The modem's MOMSN as of the last session or AT+SBDSX, or None if
+        # we don't know it.  It goes up each time an MO message is sent,
+        # which is how we tell whether a session whose response we lost
+        # sent the MO buffer.
+        self._momsn = None
+
+        self.stats = rockblock_stats.stats
+        # An optional holonet.signal_scheduler.SignalScheduler, which we keep
+        # informed of signal readings and sessions, and which decides how
+        # hard to try in wait_for_good_signal.
+        self.scheduler = None
+        # The rockblock_stats.CommandRecord for the command in flight.
+        self._command_record = None
+        # While this is set, our waits (for network time, for a signal,
+        # before a session retry, and between resync attempts) end at once
+        # and give up, so that a caller on another thread can get the modem
+        # back quickly for something more urgent.  The caller may replace
+        # it with an Event of its own, and is responsible for clearing it.
+        self.interrupt = threading.Event()
+
+        self.command_timeout = CONNECT_TIMEOUT
+        self._reader = ATTokenReader(self._read_chunk, self._on_unsolicited)
+
+        # Set while we're resyncing (and while connecting) so that we don't
+        # try to resync recursively.
+        self._resyncing = True
+
+        self.s = serial.Serial(self.portId, 19200,
+                               timeout=self.command_timeout)
 
         if not self._configurePort():
             self.close()
             raise RockBlockException()
 
         self.ping()  # KEEP SACRIFICIAL!
-        self.s.timeout = 60
+        self.command_timeout = COMMAND_TIMEOUT
 
         if not self.ping():
             self.close()
             raise RockBlockException()
 
+        self._resyncing = False
         self._do_callback(RockBlockProtocol.rockBlockConnected)
 
     def ping(self):
@@ -134,10 +200,15 @@ class RockBlock(object):
 
             _logger.debug('Failed to get network time after try %d; '
                           'will retry after %d secs.', retries, TIME_DELAY)
-            time.sleep(TIME_DELAY)
+            if not self._sleep(TIME_DELAY):
+                return False
         assert False  # Unreachable.
 
     def wait_for_good_signal(self):
+        attempts = SIGNAL_ATTEMPTS
+        if self.scheduler is not None:
+            attempts = self.scheduler.signal_attempts(attempts)
+
         retries = 0
         while True:
             signal = self.requestSignalStrength()
@@ -145,19 +216,36 @@ class RockBlock(object):
                 return True
 
             retries += 1
-            if retries == SIGNAL_ATTEMPTS:
+            if retries >= attempts:
                 _logger.warning('Failed to get good signal after %d retries; '
                                 'giving up.', retries)
                 return False
 
+            delay = RESCAN_DELAY
+            if self.scheduler is not None:
+                delay = self.scheduler.rescan_delay(retries, delay)
             _logger.debug('Failed to get good signal after try %d; '
-                          'will retry after %d secs.', retries, RESCAN_DELAY)
-            time.sleep(RESCAN_DELAY)
+                          'will retry after %d secs.', retries, delay)
+            if not self._sleep(delay):
+                return False
         assert False  # Unreachable.
 
+    def _sleep(self, secs):
+        """Wait for secs, unless self.interrupt is set first.
+
+           Returns: False if we were interrupted."""
+        if self.interrupt.wait(secs):
+            _logger.debug('Interrupted; giving up the modem.')
+            return False
+        return True
+
     def requestSignalStrength(self):
         signal = self._doRequestSignalStrength()
         _logger.debug('Signal strength is %d.', signal)
+        if signal >= SIGNAL_THRESHOLD:
+            self._last_good_signal_time = time.monotonic()
+        if self.scheduler is not None:
+            self.scheduler.record_signal(signal)
         self._do_callback(RockBlockProtocol.rockBlockSignalUpdate, signal)
         return signal
 
@@ -191,7 +279,8 @@ class RockBlock(object):
         self._do_callback(RockBlockProtocol.rockBlockRxStarted)
 
         if self._attemptConnection() and \
-                self._attemptSession(ack_ring=ack_ring):
+                self._attemptSession(ack_ring=ack_ring,
+                                     mo_loaded=self._load_next_mo()):
             return True
 
         self._do_callback(RockBlockProtocol.rockBlockRxFailed)
@@ -204,22 +293,13 @@ class RockBlock(object):
 
         self._do_callback(RockBlockProtocol.rockBlockTxStarted)
 
-        if self._queueMessage(msg) and self._attemptConnection():
-            SESSION_DELAY = 1
-            SESSION_ATTEMPTS = 3
-
-            while True:
-                SESSION_ATTEMPTS -= 1
-                if SESSION_ATTEMPTS == 0:
-                    break
-
-                if self._attemptSession():
-                    return True
-                else:
-                    time.sleep(SESSION_DELAY)
+        if not self._queueMessage(msg) or not self._attemptConnection():
+            self._do_callback(RockBlockProtocol.rockBlockTxFailed, -1)
+            return False
 
-        self._do_callback(RockBlockProtocol.rockBlockTxFailed, -1)
-        return False
+        # This retries failed sessions itself, and reports the failure if
+        # it gives up.
+        return self._attemptSession(mo_loaded=True)
 
     def getSerialIdentifier(self):
         self._ensureConnectionStatus()
@@ -259,33 +339,11 @@ class RockBlock(object):
         return True
 
     def close(self):
+        self._finish_command('incomplete')
         if self.s is not None:
             self.s.close()
             self.s = None
 
-    @staticmethod
-    def listPorts():
-
-        if sys.platform.startswith('win'):
-            ports = ['COM' + str(i + 1) for i in range(256)]
-        elif (sys.platform.startswith('linux') or
-              sys.platform.startswith('cygwin')):
-            ports = glob.glob('/dev/tty[A-Za-z]*')
-        elif sys.platform.startswith('darwin'):
-            ports = glob.glob('/dev/tty.*')
-
-        result = []
-
-        for port in ports:
-            try:
-                s = serial.Serial(port)
-                s.close()
-                result.append(port)
-            except (OSError, serial.SerialException):
-                pass
-
-        return result
-
     def _queueMessage(self, msg):
         self._ensureConnectionStatus()
 
@@ -296,19 +354,14 @@ class RockBlock(object):
 
         msg_len_bytes = bytes(str(msg_len), 'ascii')
         command = b'AT+SBDWB=' + msg_len_bytes
-        self._send_command(command)
-
-        if (self._read_next_line() != command or
+        if (not self._send_command_and_read_echo(command) or
                 self._read_next_line() != b'READY'):
             return False
 
-        checksum = 0
-        for b in msg:
-            checksum += b
+        checksum = sbd_checksum(msg)
 
         # _logger.debug('RockBLOCK: queuing message: %s', msg)
-        self.s.write(msg)
-        self.s.write(checksum.to_bytes(2, byteorder='big'))
+        self._write(msg + checksum.to_bytes(2, byteorder='big'))
 
         result = (self._read_next_line() == b'0')
         if not self._read_ok(command):
@@ -339,172 +392,284 @@ class RockBlock(object):
         self._ensureConnectionStatus()
         return self._send_and_ack_command(b'AT+SBDMTA=1')
 
-    def _attemptSession(self, ack_ring=False):
-        self._ensureConnectionStatus()
+    def _attemptSession(self, ack_ring=False, mo_loaded=False):
+        """
+        Run SBD sessions until the MO buffer is sent, and then (if
+        autoSession is set) keep going until the MT queue at the gateway is
+        drained and the callback has no more outbound messages.  Every
+        session carries one MO and one MT message, so after each successful
+        session the next outbound message (from rockBlockNextMoMessage) is
+        loaded into the MO buffer, and traffic in each direction rides on
+        the other's sessions.  The drain is a loop rather than a fresh call
+        per message, and reuses the last good signal reading while it is
+        fresh, so a backlog costs one session per message rather than one
+        signal wait per message.  A failed session is retried (up to
+        SESSION_ATTEMPTS in all) after a back-off and a fresh signal check;
+        if we give up with a message in the MO buffer, rockBlockTxFailed is
+        called once, with the last MO status.  If we lose the response to a
+        session, AT+SBDSX tells us whether the MO buffer went, so that it
+        isn't sent again.
 
-        SESSION_ATTEMPTS = 3
+        Args:
+            ack_ring (bool): See messageCheck.
+            mo_loaded (bool): Whether the MO buffer holds a message.
 
-        while True:
-            if SESSION_ATTEMPTS == 0:
-                return False
+        Returns: True if the MO buffer was sent.
+        """
+        self._ensureConnectionStatus()
 
-            SESSION_ATTEMPTS -= 1
-
-            command = b'AT+SBDIXA' if ack_ring else b'AT+SBDIX'
-            if not self._send_command_and_read_echo(command):
-                _logger.warning("Warning: Comms with rockblock out of sync while trying to transmit %s. Attempting "
-                                "ping after 10 second sleep", command)
-                time.sleep(RESCAN_DELAY)
-                # flush input buffer for any random data received
-                self.s.reset_input_buffer()
-                # Echo or read fail. Try to sync comms again and send the command, otherwise fail
-                system_synced = False
-                for x in range(1, SYNC_COMMS_ATTEMPTS):
-                    system_synced = self.ping()
-                if not system_synced:
-                    _logger.error("Sync Failed")
-                    return False
+        mo_done = False
+        mt_queued = 0
+        failures = 0
+        while True:
+            if mo_loaded and self._momsn is None:
+                (_, self._momsn) = self._readMoStatus()
+            status = self._session(ack_ring)
+            if status is None:
+                # We don't know whether the session ran.  If the MOMSN has
+                # moved on then it did, and sent the MO buffer (though any
+                # MT message that came with it is lost to us); otherwise
+                # this counts as a failed attempt.
+                last_momsn = self._momsn
+                (mo_flag, self._momsn) = (self._readMoStatus() if mo_loaded
+                                          else (None, None))
+                if mo_loaded and None not in (last_momsn, self._momsn) and \
+                        self._momsn != last_momsn:
+                    _logger.info('Lost the response to a session, but MO '
+                                 'message %s was sent.', self._momsn)
+                    self._last_good_signal_time = time.monotonic()
+                    failed_status = None
+                    mo_done = True
+                    ack_ring = False
+                    mo_loaded = False
+                    self._clearMoBuffer()
+                    self._do_callback(RockBlockProtocol.rockBlockTxSuccess,
+                                      self._momsn)
+                elif mo_loaded and mo_flag == 0:
+                    # The modem has lost the MO buffer, e.g. to a brown-out,
+                    # so there's nothing to retry with.
+                    _logger.warning('The MO buffer was lost; giving up.')
+                    self._do_callback(RockBlockProtocol.rockBlockTxFailed,
+                                      -1)
+                    return mo_done
+                else:
+                    failed_status = -1
+            else:
+                (moStatus, moMsn, mtStatus, mtMsn, mtLength, mtQueued) = \
+                    status
+                self._momsn = moMsn
+                self.stats.record_session(moStatus, mtStatus)
+                if self.scheduler is not None:
+                    self.scheduler.record_session(moStatus <= 4)
+
+                # Mobile Originated
+                if moStatus <= 4:
+                    # A completed session is as good as a signal reading.
+                    self._last_good_signal_time = time.monotonic()
+                    failed_status = None
+                    mt_queued = mtQueued
+                    mo_done = True
+                    ack_ring = False
+                    if mo_loaded:
+                        mo_loaded = False
+                        self._clearMoBuffer()
+                        self._do_callback(
+                            RockBlockProtocol.rockBlockTxSuccess, moMsn)
                 else:
-                    _logger.info("Sync Successful")
-                    self._send_command_and_read_echo(command)
+                    _logger.warning('Got moStatus %d', moStatus)
+                    failed_status = moStatus
+
+                if mtStatus == 1 and mtLength > 0:
+                    # SBD message successfully received from the GSS.
+                    _logger.debug('Will process message %s. %s additional '
+                                  'messages queued', mtMsn, mtQueued)
+                    self._processMtMessage(mtMsn)
+
+                self._do_callback(RockBlockProtocol.rockBlockRxMessageQueue,
+                                  mt_queued)
+
+            if failed_status is not None:
+                failures += 1
+                self._last_good_signal_time = None
+                if self._retry_session(failures):
+                    continue
+                if mo_loaded:
+                    self._do_callback(RockBlockProtocol.rockBlockTxFailed,
+                                      failed_status)
+                return mo_done
+
+            if not self.autoSession:
+                return True
+            if not mo_loaded:
+                mo_loaded = self._load_next_mo()
+            # There are additional MT messages queued to download, or MO
+            # messages to send.
+            if mt_queued == 0 and not mo_loaded:
+                return True
+            if not self._ensure_good_signal():
+                _logger.warning("Failed to get good signal. Aborting message retrieval. %s messages queued",
+                                mt_queued)
+                return True
+            _logger.debug(" %s messages queued. Retrieving the next one", str(mt_queued))
 
-            response = self._read_next_line()
-            if not response.startswith(b'+SBDIX: '):
-                _logger.error('Got bad response when creating session: %s',
-                              response)
-                return False
+    def _retry_session(self, failures):
+        """Back off after the given number of failed sessions, and then
+           check the signal.
 
-            if not self._read_ok(command):
-                return False
+           Returns: True if another session is worth trying."""
+        if failures >= SESSION_ATTEMPTS:
+            _logger.warning('Giving up after %d failed sessions.', failures)
+            return False
+        delay = SESSION_RETRY_DELAY * 2 ** (failures - 1)
+        _logger.debug('Session failed (attempt %d); will retry after %d '
+                      'secs.', failures, delay)
+        return self._sleep(delay) and self._ensure_good_signal()
 
-            # +SBDIX: <MO status>, <MOMSN>, <MT status>, <MTMSN>, <MT length>,
-            # <MTqueued>
-            response = response[len(b'+SBDIX: '):]
-            parts = response.split(b',')
-            if len(parts) != 6:
-                _logger.error('Got bad parts in response when creating '
-                              'session: %s / %s.', response, parts)
-                return False
-            (moStatus, moMsn, mtStatus, mtMsn, mtLength, mtQueued) = \
-                map(int, parts)
+    def _session(self, ack_ring):
+        """
+        Run one SBD session with AT+SBDIX (or AT+SBDIXA).
 
-            # Mobile Originated
-            if moStatus <= 4:
-                self._clearMoBuffer()
-                self._do_callback(RockBlockProtocol.rockBlockTxSuccess, moMsn)
-            else:
-                _logger.warning('Got moStatus %d', moStatus)
-                self._do_callback(RockBlockProtocol.rockBlockTxFailed,
-                                  moStatus)
-
-            if mtStatus == 1 and mtLength > 0:
-                # SBD message successfully received from the GSS.
-                _logger.debug('Will process message %s. %s additional messages queued', mtMsn, mtQueued)
-                self._processMtMessage(mtMsn)
-
-            # AUTOGET NEXT MESSAGE
-
-            self._do_callback(RockBlockProtocol.rockBlockRxMessageQueue,
-                              mtQueued)
-
-            # There are additional MT messages to queued to download
-            if mtQueued > 0 and self.autoSession:
-                _logger.debug("Getting signal strength before retrieving remaining %s messages", str(mtQueued))
-                if self.wait_for_good_signal():
-                    _logger.debug(" %s messages queued. Retrieving the next one", str(mtQueued))
-                    self._attemptSession()
-                else:
-                    _logger.warning("Failed to get good signal. Aborting message retrieval. %s messages queued",
-                                    mtQueued)
+        Returns: the six +SBDIX fields as ints, or None if we didn't get a
+        good response.
+        """
+        command = b'AT+SBDIXA' if ack_ring else b'AT+SBDIX'
+        if not self._send_command_and_read_echo(command):
+            return None
 
-            if moStatus <= 4:
-                return True
+        response = self._read_next_line()
+        if not response.startswith(b'+SBDIX: '):
+            _logger.error('Got bad response when creating session: %s',
+                          response)
+            return None
+
+        if not self._read_ok(command):
+            return None
+
+        # +SBDIX: <MO status>, <MOMSN>, <MT status>, <MTMSN>, <MT length>,
+        # <MTqueued>
+        response = response[len(b'+SBDIX: '):]
+        parts = response.split(b',')
+        if len(parts) != 6:
+            _logger.error('Got bad parts in response when creating '
+                          'session: %s / %s.', response, parts)
+            return None
+        try:
+            return tuple(map(int, parts))
+        except ValueError:
+            _logger.error('Got bad parts in response when creating '
+                          'session: %s.', response)
+            return None
+
+    def _readMoStatus(self):
+        """Returns: (MO flag, MOMSN) from AT+SBDSX, where the MO flag is 1
+           if the MO buffer holds a message, or (None, None) if we can't get
+           them."""
+        command = b'AT+SBDSX'
+        if not self._send_command_and_read_echo(command):
+            return (None, None)
+
+        # +SBDSX: <MO flag>, <MOMSN>, <MT flag>, <MTMSN>, <RA flag>,
+        # <msg waiting>
+        response = self._read_next_line()
+        if not self._read_ok(command):
+            return (None, None)
+        parts = response[len(b'+SBDSX: '):].split(b',')
+        try:
+            if not response.startswith(b'+SBDSX: ') or len(parts) != 6:
+                raise ValueError()
+            return (int(parts[0]), int(parts[1]))
+        except ValueError:
+            _logger.error('Got bad response to %s: %s', command, response)
+            return (None, None)
+
+    def _load_next_mo(self):
+        """Ask the callback for the next outbound message, and load it into
+           the MO buffer.
+
+           Returns: True if a message was loaded."""
+        msg = self._do_callback(RockBlockProtocol.rockBlockNextMoMessage)
+        if msg is None:
+            return False
+        self._do_callback(RockBlockProtocol.rockBlockTxStarted)
+        if self._queueMessage(msg):
+            return True
+        self._do_callback(RockBlockProtocol.rockBlockTxFailed, -1)
+        return False
 
-        assert False  # Unreachable, while (True) above.
+    def _ensure_good_signal(self):
+        """Like wait_for_good_signal, but trusts a recent good reading."""
+        last = self._last_good_signal_time
+        if last is not None and \
+                time.monotonic() - last < SIGNAL_FRESH_SECS:
+            return True
+        return self.wait_for_good_signal()
 
     def _attemptConnection(self):
         self._ensureConnectionStatus()
         return self._wait_for_network_time() and self.wait_for_good_signal()
 
     def _processMtMessage(self, mtMsn):
-        RESP_CHECKSUM_SIZE = 2
-        RESP_MSG_LEN_SIZE = 2
+        for attempt in range(1, MT_READ_ATTEMPTS + 1):
+            result = self._readMtBuffer()
+            if result is not None:
+                self._do_callback(RockBlockProtocol.rockBlockRxReceived,
+                                  mtMsn, result)
+                return True
+            # The message is still in the modem's MT buffer, so a garbled
+            # read over the serial line can just be retried.
+            _logger.warning('Failed to read MT message %s (attempt %d of '
+                            '%d).', mtMsn, attempt, MT_READ_ATTEMPTS)
+        return False
 
+    def _readMtBuffer(self):
+        """
+        Read the MT buffer with AT+SBDRB.  The response is a 2-byte length,
+        the message itself, and a 2-byte checksum, with no line ending, so
+        the tokenizer reads it as a frame by length rather than by line.
+
+        Returns: the message as bytes, or None on timeout or checksum
+        failure.
+        """
         self._ensureConnectionStatus()
 
         command = b'AT+SBDRB'
+        # Leftovers would be taken for the start of the binary response, but
+        # a ring that is waiting must still get through.
+        self._reader.drain()
         self._send_command(command)
-        # wait some time to ensure we get the checksum as well
-        response = self._read_next_line()
-        if not response.startswith(command + b'\r'):
-            _logger.error('Incorrect echo for %s: %s', command, response)
-            return
-        _logger.debug('Received message from rockblock: "%s"', response)
-        # discard command echo and RC
-        response = response[(len(command) + 1):]
-
-        if response == b'OK':
-            _logger.warning('No message content.. strange!')
-        else:
-            # TODO: Fix checksum, it is broken.
-            # TODO: rewrite the process for getting the data so that bytes are counted as reported by the rockblock
-            reported_msg_len = int.from_bytes(response[:2], byteorder='big')
-            # discard message length (2 bytes)
-            rcvd_msg = response[RESP_MSG_LEN_SIZE:]
-            rcvd_msg_len = len(rcvd_msg)
-
-            if rcvd_msg_len < reported_msg_len + RESP_CHECKSUM_SIZE:
-                _logger.warning("Incomplete message received. Waiting for completion. Holding off for %s s",
-                                str(TIME_DELAY))
-                time.sleep(TIME_DELAY)
-                response += self._read_next_line()
-                _logger.debug("Updated message from rockblock is: \n%s", response)
-                rcvd_msg = response[RESP_MSG_LEN_SIZE:RESP_MSG_LEN_SIZE + reported_msg_len]
-                rcvd_msg_len = len(rcvd_msg)
-                _logger.debug("Captured received message:\n%s", rcvd_msg)
-
-            if rcvd_msg_len < reported_msg_len + RESP_CHECKSUM_SIZE:
-                _logger.warning(
-                    'Ignoring message length mismatch! %s counted != %s reported in message %s (parsed as: "%s")',
-                    rcvd_msg_len, reported_msg_len, response, rcvd_msg)
-
-            our_checksum = sum(map(int, rcvd_msg[:-RESP_CHECKSUM_SIZE])) & 0xffff
-            # Read one more line in case the checksum was in late.
-            # TODO: Handle delayed responses better
-            checksum_read = response[RESP_MSG_LEN_SIZE + reported_msg_len: RESP_MSG_LEN_SIZE + reported_msg_len + 2]
-            checksum_read = int.from_bytes(checksum_read, byteorder='big')
-
-            if our_checksum != checksum_read:
-                _logger.warning('Ignoring checksum failure! %s (our calculated checksum) != %s (reported '
-                                'checksum)  in message %s', our_checksum, checksum_read, response)
-
-            if response[:-RESP_CHECKSUM_SIZE] != b'OK':
-                if not self._read_ok(command):
-                    return False
-        rcvd_msg = rcvd_msg[:-RESP_CHECKSUM_SIZE]
-        self._do_callback(RockBlockProtocol.rockBlockRxReceived, mtMsn, rcvd_msg)
+        deadline = time.monotonic() + MT_READ_TIMEOUT
+
+        token = self._read_token(deadline)
+        if token is None or token.data != command:
+            _logger.error('Incorrect echo for %s: %s', command,
+                          token and token.data)
+            self._resync(command, junk=token.data if token else b'')
+            return None
+
+        token = self._read_token(deadline)
+        if token is None:
+            _logger.error('Timed out reading MT message.')
+            return None
+        if token.kind == at_parser.BAD_FRAME:
+            _logger.error('MT message checksum failure (%d bytes).',
+                          len(token.data))
+            self._read_ok(command)
+            return None
+        if token.kind != at_parser.FRAME:
+            _logger.error('Expected MT message, got %s.', token.data)
+            self._resync(command, junk=token.data)
+            return None
+
+        if not self._read_ok(command):
+            return None
+        return token.data
 
     def _isNetworkTimeValid(self):
         self._ensureConnectionStatus()
 
         command = b'AT-MSSTM'
         if not self._send_command_and_read_echo(command):
-            # TODO: I probably need to just create a resync_comms method instead of pasting this all over the place
-            _logger.warning("Warning: Comms with rockblock out of sync while trying to transmit %s. Attempting ping "
-                            "after 10 second sleep", command)
-            time.sleep(RESCAN_DELAY)
-            # flush input buffer for any random data received
-            self.s.reset_input_buffer()
-            # Echo or read fail. Try to sync comms again and send the command, otherwise fail
-            system_synced = False
-            for x in range(1, SYNC_COMMS_ATTEMPTS):
-                system_synced = self.ping()
-            if not system_synced:
-                _logger.error("Sync Failed")
-                return False
-            else:
-                _logger.info("Sync Successful")
-                self._send_command_and_read_echo(command)
+            return False
 
         response = self._read_next_line()
         if response.startswith(b'-MSSTM'):
@@ -528,67 +693,213 @@ class RockBlock(object):
         return self._read_ok(command)
 
     def _send_and_ack_command(self, cmd):
-        self._send_command(cmd)
-        return self._read_ack(cmd)
+        return (self._send_command_and_read_echo(cmd) and
+                self._read_ok(cmd))
 
     def _send_command_and_read_echo(self, cmd):
+        """Send cmd and check its echo.  If the echo is wrong, resync with
+           the modem and try once more, unless cmd is one of
+           NO_RESEND_COMMANDS."""
         self._send_command(cmd)
-        return self._read_echo(cmd)
+        response = self._read_next_line()
+        if response == cmd:
+            return True
+        _logger.error('Incorrect echo for %s: %s', cmd, response)
+        if self._resync(cmd, junk=response) and \
+                cmd not in NO_RESEND_COMMANDS:
+            self._send_command(cmd, retry=True)
+            if self._read_echo(cmd):
+                return True
+        self._finish_command('bad_echo')
+        return False
+
+    def _resync(self, cmd, brownout=False, junk=b''):
+        """
+        Get back in step with the modem after a bad or missing response to
+        cmd, or a serial error.  Whatever is on the line is drained and
+        used (along with any junk that the caller has already read) to
+        diagnose what went wrong, then we ping until the modem
+        answers, backing off per RESYNC_SCHEDULE (or giving up after one
+        try if self.interrupt is set).  If the port itself has
+        failed, it is reopened and the modem reconfigured, because a
+        brown-out will have reset it.
+
+        Returns: True if we're back in sync.
+        """
+        if self._resyncing:
+            return False
+        self._resyncing = True
+        if self._command_record is not None:
+            self._command_record.resyncs += 1
+        start = time.monotonic()
+        cause = RESYNC_BROWNOUT if brownout else None
+        try:
+            for (attempt, delay) in enumerate(RESYNC_SCHEDULE, 1):
+                # The first attempt is made even if we've been interrupted,
+                # so that the next caller has a good chance of finding the
+                # modem in sync.
+                if not self._sleep(delay) and attempt > 1:
+                    return False
+                try:
+                    if cause == RESYNC_BROWNOUT or self.s is None or \
+                            not self.s.isOpen():
+                        cause = RESYNC_BROWNOUT
+                        self._reopen()
+                    drained_cause = self._drain_input(junk)
+                    junk = b''
+                    if cause is None:
+                        cause = drained_cause
+                    if not self._sync_ping():
+                        continue
+                    if cause == RESYNC_BROWNOUT and \
+                            not self._configurePort():
+                        continue
+                except (OSError, serial.SerialException) as err:
+                    _logger.warning('Serial error while resyncing: %s', err)
+                    cause = RESYNC_BROWNOUT
+                    self.close()
+                    continue
+
+                _logger.info('Resynced with RockBLOCK after %s (%s) in %d '
+                             'attempts, %.1f secs.', cmd, cause, attempt,
+                             time.monotonic() - start)
+                self.stats.record_resync(cause, True)
+                return True
+
+            _logger.error('Failed to resync with RockBLOCK after %s (%s).',
+                          cmd, cause)
+            self.stats.record_resync(cause, False)
+            return False
+        finally:
+            self._resyncing = False
+
+    def _reopen(self):
+        self.close()
+        self._reader.discard()
+        self.s = serial.Serial(self.portId, 19200, timeout=COMMAND_TIMEOUT)
+
+    def _drain_input(self, junk=b''):
+        """
+        Read and discard whatever is on the line until it goes quiet.
+
+        Args:
+            junk (bytes): Anything unexpected that was already read.
+
+        Returns: RESYNC_SILENT, RESYNC_STALE or RESYNC_NOISE, depending on
+        what was there.
+        """
+        data = junk + self._reader.drain()
+        old_timeout = self.s.timeout
+        try:
+            self.s.timeout = RESYNC_QUIET
+            while True:
+                chunk = self.s.read(4096)
+                if not chunk:
+                    break
+                self._count_bytes_in(len(chunk))
+                data += chunk
+        finally:
+            self.s.timeout = old_timeout
+
+        if not data:
+            return RESYNC_SILENT
+        _logger.debug('Drained %d bytes while resyncing: %s', len(data),
+                      data[:64])
+        if all(b in (0x0a, 0x0d) or 0x20 <= b < 0x7f for b in data):
+            return RESYNC_STALE
+        return RESYNC_NOISE
+
+    def _sync_ping(self):
+        """Send AT, and wait for its echo and then OK, skipping anything
+           else that arrives in the meantime."""
+        self._write(b'AT\r')
+        deadline = time.monotonic() + RESYNC_PING_TIMEOUT
+        echoed = False
+        while True:
+            token = self._reader.read_token(deadline)
+            if token is None:
+                return False
+            if token.data == b'AT':
+                echoed = True
+            elif echoed and token.data == b'OK':
+                return True
 
     def _ensureConnectionStatus(self):
         if self.s is None or not self.s.isOpen():
             raise RockBlockException()
 
-    def _send_command(self, cmd):
+    def _send_command(self, cmd, retry=False):
+        self._ensureConnectionStatus()
+        if retry and self._command_record is not None:
+            self._command_record.retries += 1
+        else:
+            self._finish_command('incomplete')
+            self._command_record = self.stats.start_command(cmd)
         # _logger.debug('RockBLOCK: sending cmd: %s', cmd)
-        self.s.write(cmd + b'\r')
+        self._write(cmd + b'\r')
+
+    def _write(self, data):
+        self.s.write(data)
+        if self._command_record is not None:
+            self._command_record.bytes_out += len(data)
 
-    def _read_next_line(self):
-        """Read the next line, and return it with the trailing newline
-           stripped."""
+    def _count_bytes_in(self, n):
+        if self._command_record is not None:
+            self._command_record.bytes_in += n
 
-        next_line = None
+    def _finish_command(self, result):
+        """Record the command in flight (if any) as finished with the
+           given result."""
+        if self._command_record is not None:
+            self.stats.finish_command(self._command_record, result)
+            self._command_record = None
+
+    def _read_next_line(self, timeout=None):
+        """
+        Read the next line, skipping blank lines and handing unsolicited
+        ones (SBDRING) to _on_unsolicited.
+
+        Args:
+            timeout (float): Seconds to wait; defaults to command_timeout.
+
+        Returns: the line, with its line ending stripped.  On timeout, or
+        if the read fails with a serial error (in which case we resync),
+        returns b'' because the line that we were waiting for is lost.
+        """
+        self._ensureConnectionStatus()
+        deadline = time.monotonic() + (timeout or self.command_timeout)
+        token = self._read_token(deadline)
+        if token is None:
+            # Don't go round again: the caller will see that this isn't
+            # what it was waiting for, and resync.
+            _logger.warning('Timed out reading from RockBLOCK.')
+            return b''
+        return token.data
+
+    def _read_token(self, deadline):
+        """Returns: the next at_parser.ATToken, or None on timeout or serial
+           error."""
         try:
-            next_line = self.s.readline().rstrip()
-        except serial.SerialException as e_thrown:
-            # SerialExceptions tend to occur on the RaspberryPi depending on how it is powered. Backoff for 40 seconds
-            _logger.warning("SerialException detected. Check power and data cabling on your system. \n" + str(e_thrown))
-            _logger.warning("\nTraceback:\n" )
-            traceback.print_last()
-            # backoff of the Rockblock comms once and try SYNC_COMMS_ATTEMPTS times. Else, quit.
-            time.sleep(ROCKBLOCK_POWER_BACKOFF)
-
-            # TODO: build a better design that does not require backing off so much
-            break_now = False
-            for x in range(0,SYNC_COMMS_ATTEMPTS):
-                try:
-                    next_line = self.s.readline().rstrip()
-                except serial.SerialException:
-                    _logger.warning("SerialException recovery failed. Attempt " + str(x) + " of " + str(
-                        SYNC_COMMS_ATTEMPTS))
-                    time.sleep(ROCKBLOCK_POWER_BACKOFF)
-                    if x == SYNC_COMMS_ATTEMPTS:
-                        break
-                else:
-                    break
+            return self._reader.read_token(deadline)
+        except serial.SerialException as err:
+            # SerialExceptions tend to occur on the RaspberryPi depending on
+            # how it is powered.
+            _logger.warning('SerialException detected.  Check power and '
+                            'data cabling on your system.  %s', err)
+            self._resync(b'read', brownout=True)
+            return None
 
-        finally:
-            # _logger.debug('RockBLOCK: read line %s', result)
-            # TODO: Need to properly tokenize return strings and make sure they are being properly inspected
-            # TODO: Tokenize string and eval number of words in it. if more than expected comms out of sync
-            if next_line is None:
-                _logger.debug("No data read from serial. Trying again")
-                self._read_next_line()
-            elif next_line.strip(b'\r') == b'SBDRING' or next_line == b'':
-                # Unsolicited ring notification.  Ignore it, we're using the GPIO
-                # pin so we already know.
-                # Or a blank line.  Ignore them because we're either getting
-                # spurious ones or you get one before the SBDRING (not sure which).
-                _logger.debug("Ignoring received data. Trying again. \nReceived:\n %s\n", str(next_line))
-                return self._read_next_line()
-            else:
-                result = next_line
-                return result
+    def _read_chunk(self, timeout):
+        """Read whatever is waiting, or else block for up to timeout secs
+           for the next byte.  Used by self._reader."""
+        self.s.timeout = timeout
+        data = self.s.read(self.s.in_waiting or 1)
+        self._count_bytes_in(len(data))
+        return data
+
+    def _on_unsolicited(self, token):
+        _logger.debug('RockBLOCK: unsolicited %s', token.data)
+        self._do_callback(RockBlockProtocol.rockBlockRingAlert)
 
     def _read_ack(self, cmd):
         """Read the next two lines, checking that the first is the given cmd
@@ -611,7 +922,12 @@ class RockBlock(object):
         if not result:
             _logger.error('Got %s when expecting OK in response to %s',
                           response, cmd)
+        if response in (b'OK', b'ERROR'):
+            self._finish_command(response.decode('ascii'))
+        else:
+            # Keep the stats to a few keys, whatever noise turns up.
+            self._finish_command('unexpected' if response else 'timeout')
         return result
 
     def _do_callback(self, f, *args):
-        do_callback(self.callback, f, *args)
+        return do_callback(self.callback, f, *args)
@@ -0,0 +1,558 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Software emulation of a RockBLOCK 9602 / 9603 modem on a pseudo-terminal.
+
+This speaks the subset of the AT command set that holonet.rockblock.RockBlock
+uses, so that the driver and QueueManager can be exercised without real
+hardware or a view of the sky.  Signal strength, network time validity,
+the MT queue, session failures and per-command latency are all adjustable
+while the emulator is running, either directly or with a timed script.
+
+Run this module directly for a simple throughput benchmark:
+
+    python3 -m holonet.rockblock_emulator --messages 20 --mt-messages 20
+'''
+
+import argparse
+import collections
+import logging
+import os
+import random
+import select
+import shutil
+import tempfile
+import threading
+import time
+import tty
+
+
+DEFAULT_IMEI = '300234010753370'
+
+# +SBDIX MO status values.  See the ISU AT Command Reference.
+MO_STATUS_OK = 0
+MO_STATUS_RF_DROP = 18
+MO_STATUS_NO_NETWORK = 32
+
+# +SBDIX MT status values.
+MT_STATUS_NONE = 0
+MT_STATUS_RECEIVED = 1
+MT_STATUS_ERROR = 2
+
+MAX_MO_LENGTH = 340
+SIGNAL_THRESHOLD = 2
+
+_logger = logging.getLogger('holonet.rockblock_emulator')
+
+
+class RockBlockEmulator(object):
+    # pylint: disable=too-many-instance-attributes
+    """
+    Emulates a RockBLOCK attached to a pty.  Open self.device with
+    holonet.rockblock.RockBlock (or QueueManager(device=...)) once start()
+    has been called.
+
+    Args:
+        signal (int or callable): The +CSQ value, 0-5.  If callable, it is
+            called for each AT+CSQ and each session.
+        network_time_valid (bool or callable): Whether AT-MSSTM reports a
+            valid network time.
+        session_failure_rate (float): Probability that any given +SBDIX
+            session fails even with good signal.
+        command_latency (float): Seconds to wait before answering any
+            command.
+        latencies (dict): Per-command overrides for command_latency, keyed
+            by command name without arguments, e.g. {'AT+SBDIX': 5.0}.
+        script (list): (seconds, callable) pairs.  Each callable is called
+            with this emulator as its only argument, that many seconds after
+            start().
+        ring_callback (callable): Called with True when an SBDRING is sent,
+            standing in for the ring indicator GPIO pin.
+        seed: Seed for the session failure RNG, for repeatable runs.
+    """
+    def __init__(self, signal=5, network_time_valid=True,
+                 session_failure_rate=0.0, command_latency=0.0,
+                 latencies=None, script=None, ring_callback=None,
+                 imei=DEFAULT_IMEI, seed=None):
+        self.signal = signal
+        self.network_time_valid = network_time_valid
+        self.session_failure_rate = session_failure_rate
+        self.command_latency = command_latency
+        self.latencies = dict(latencies or {})
+        self.script = list(script or [])
+        self.ring_callback = ring_callback
+        self.imei = imei
+
+        # When set, commands are read but ignored, as if the modem had hung.
+        self.unresponsive = False
+
+        # The next this-many commands are ignored, as a modem that has just
+        # woken up ignores the first AT.
+        self.ignore_commands = 0
+
+        # Per command name (e.g. 'AT+SBDIX'), how many of its next echoes
+        # are garbled, as if by line noise.  The command itself still runs.
+        self.echo_corruptions = collections.Counter()
+
+        # Per command name, how many of its next occurrences are lost on the
+        # way to the modem, so that it neither runs them nor answers.
+        self.lost_commands = collections.Counter()
+
+        # The next this-many AT+SBDRB responses will have a bad checksum,
+        # as if garbled on the serial line.
+        self.sbdrb_corruptions = 0
+
+        self.echo = True
+        self.ring_alerts = False
+        self.mo_buffer = None
+        self.mt_buffer = None
+        self.mo_sent = []
+        self.momsn = 0
+        self.mtmsn = 0
+        self.stats = collections.Counter()
+        self.busy_time = 0.0
+
+        self.device = None
+
+        self._random = random.Random(seed)
+        self._mt_queue = collections.deque()
+        self._lock = threading.RLock()
+        self._master = None
+        self._slave = None
+        self._thread = None
+        self._timers = []
+        self._stopping = False
+        self._rx = b''
+        self._sbdwb_len = None
+
+
+    def start(self):
+        (self._master, self._slave) = os.openpty()
+        tty.setraw(self._slave)
+        self.device = os.ttyname(self._slave)
+        self._stopping = False
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+        for (delay, f) in self.script:
+            timer = threading.Timer(delay, f, args=(self,))
+            timer.daemon = True
+            timer.start()
+            self._timers.append(timer)
+
+        _logger.debug('RockBLOCK emulator running on %s.', self.device)
+        return self
+
+
+    def stop(self):
+        self._stopping = True
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = None
+        self._slave = None
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *_args):
+        self.stop()
+
+
+    def queue_mt_message(self, data, ring=True):
+        """Queue a mobile-terminated message at the (emulated) gateway."""
+        assert isinstance(data, bytes)
+        with self._lock:
+            self._mt_queue.append(data)
+        if ring:
+            self.ring()
+
+
+    def mt_queue_length(self):
+        with self._lock:
+            return len(self._mt_queue)
+
+
+    def ring(self):
+        """Send an unsolicited SBDRING, if ring alerts are enabled."""
+        with self._lock:
+            if not self.ring_alerts:
+                return
+            self.stats['SBDRING'] += 1
+            self._write(b'\r\nSBDRING\r\n')
+        if self.ring_callback is not None:
+            self.ring_callback(True)
+
+
+    def inject(self, data):
+        """Write arbitrary bytes to the serial line, e.g. line noise."""
+        with self._lock:
+            self._write(data)
+
+
+    def _run(self):
+        while not self._stopping:
+            (readable, _, _) = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                continue
+            self.stats['bytes_in'] += len(data)
+            self._rx += data
+            self._process_input()
+
+
+    def _process_input(self):
+        while True:
+            if self._sbdwb_len is not None:
+                needed = self._sbdwb_len + 2
+                if len(self._rx) < needed:
+                    return
+                payload = self._rx[:needed]
+                self._rx = self._rx[needed:]
+                self._sbdwb_len = None
+                self._handle_sbdwb_payload(payload)
+                continue
+
+            idx = self._rx.find(b'\r')
+            if idx == -1:
+                return
+            line = self._rx[:idx]
+            self._rx = self._rx[idx + 1:]
+            # Tolerate a trailing \n from hosts that send \r\n.
+            if self._rx.startswith(b'\n'):
+                self._rx = self._rx[1:]
+            self._handle_command(line)
+
+
+    def _handle_command(self, line):
+        if self.unresponsive or self.ignore_commands:
+            self.ignore_commands = max(self.ignore_commands - 1, 0)
+            self.stats['ignored'] += 1
+            return
+        cmd = line.strip().upper()
+        name = cmd.split(b'=', 1)[0].decode('ascii', 'replace')
+        if self.lost_commands[name] > 0:
+            self.lost_commands[name] -= 1
+            self.stats['ignored'] += 1
+            return
+        self.stats[name] += 1
+
+        start = time.monotonic()
+        delay = self.latencies.get(name, self.command_latency)
+        with self._lock:
+            if self.echo and self.echo_corruptions[name] > 0:
+                self.echo_corruptions[name] -= 1
+                self._write(b'\xfe' + line[1:] + b'\r')
+            elif self.echo:
+                self._write(line + b'\r')
+        if delay:
+            time.sleep(delay)
+
+        with self._lock:
+            handler = _COMMANDS.get(name)
+            if handler is None:
+                if cmd.startswith(b'ATE'):
+                    self.echo = cmd != b'ATE0'
+                    self._result(b'OK')
+                else:
+                    self._result(b'ERROR')
+            else:
+                handler(self, cmd)
+        self.busy_time += time.monotonic() - start
+
+
+    def _cmd_ok(self, _cmd):
+        self._result(b'OK')
+
+
+    def _cmd_sbdmta(self, cmd):
+        self.ring_alerts = cmd.endswith(b'=1')
+        self._result(b'OK')
+
+
+    def _cmd_csq(self, _cmd):
+        signal = self._current_signal()
+        self._result(b'+CSQ:%d' % signal, b'OK')
+
+
+    def _cmd_msstm(self, _cmd):
+        if _call_or_get(self.network_time_valid):
+            now = int(time.time() * 1000 / 90) & 0xffffffff
+            self._result(b'-MSSTM: %08x' % now, b'OK')
+        else:
+            self._result(b'-MSSTM: no network service', b'OK')
+
+
+    def _cmd_gsn(self, _cmd):
+        self._result(self.imei.encode('ascii'), b'OK')
+
+
+    def _cmd_sbdwb(self, cmd):
+        try:
+            length = int(cmd.split(b'=', 1)[1])
+        except (IndexError, ValueError):
+            self._result(b'ERROR')
+            return
+        if length < 1 or length > MAX_MO_LENGTH:
+            self._result(b'3', b'OK')
+            return
+        self._sbdwb_len = length
+        self._result(b'READY')
+
+
+    def _handle_sbdwb_payload(self, payload):
+        msg = payload[:-2]
+        checksum = int.from_bytes(payload[-2:], byteorder='big')
+        with self._lock:
+            if sum(msg) & 0xffff != checksum:
+                self.stats['checksum_errors'] += 1
+                self._result(b'2', b'OK')
+                return
+            self.mo_buffer = msg
+            self._result(b'0', b'OK')
+
+
+    def _cmd_sbdd(self, cmd):
+        if cmd.endswith(b'0') or cmd.endswith(b'2'):
+            self.mo_buffer = None
+        if cmd.endswith(b'1') or cmd.endswith(b'2'):
+            self.mt_buffer = None
+        self._result(b'0', b'OK')
+
+
+    def _cmd_sbdsx(self, _cmd):
+        self._result(
+            b'+SBDSX: %d, %d, %d, %d, %d, %d' % (
+                self.mo_buffer is not None, self.momsn,
+                self.mt_buffer is not None, self.mtmsn, 0,
+                len(self._mt_queue)),
+            b'OK')
+
+
+    def _cmd_sbdix(self, _cmd):
+        self.stats['sessions'] += 1
+        signal = self._current_signal()
+        failed = (signal < SIGNAL_THRESHOLD or
+                  self._random.random() < self.session_failure_rate)
+        if failed:
+            self.stats['failed_sessions'] += 1
+            mo_status = (MO_STATUS_NO_NETWORK if signal < SIGNAL_THRESHOLD
+                         else MO_STATUS_RF_DROP)
+            self._result(
+                b'+SBDIX: %d, %d, %d, 0, 0, %d' % (
+                    mo_status, self.momsn, MT_STATUS_ERROR,
+                    len(self._mt_queue)),
+                b'OK')
+            return
+
+        if self.mo_buffer is not None:
+            self.mo_sent.append(self.mo_buffer)
+            self.stats['mo_sent'] += 1
+        self.momsn += 1
+
+        if self._mt_queue:
+            self.mt_buffer = self._mt_queue.popleft()
+            self.mtmsn += 1
+            self.stats['mt_delivered'] += 1
+            mt = (MT_STATUS_RECEIVED, self.mtmsn, len(self.mt_buffer))
+        else:
+            mt = (MT_STATUS_NONE, self.mtmsn, 0)
+
+        self._result(
+            b'+SBDIX: %d, %d, %d, %d, %d, %d' % (
+                (MO_STATUS_OK, self.momsn) + mt + (len(self._mt_queue),)),
+            b'OK')
+
+
+    def _cmd_sbdrb(self, _cmd):
+        msg = self.mt_buffer or b''
+        checksum = sum(msg) & 0xffff
+        if self.sbdrb_corruptions > 0:
+            self.sbdrb_corruptions -= 1
+            checksum ^= 0xffff
+        self._write(len(msg).to_bytes(2, byteorder='big') + msg +
+                    checksum.to_bytes(2, byteorder='big'))
+        self._result(b'OK')
+
+
+    def _current_signal(self):
+        return _call_or_get(self.signal)
+
+
+    def _result(self, *lines):
+        for line in lines:
+            self._write(b'\r\n' + line + b'\r\n')
+
+
+    def _write(self, data):
+        if self._master is None:
+            return
+        self.stats['bytes_out'] += len(data)
+        os.write(self._master, data)
+
+
+_COMMANDS = {
+    'AT': RockBlockEmulator._cmd_ok,  # pylint: disable=protected-access
+    'AT&K0': RockBlockEmulator._cmd_ok,
+    'AT&W0': RockBlockEmulator._cmd_ok,
+    'AT&Y0': RockBlockEmulator._cmd_ok,
+    'AT*F': RockBlockEmulator._cmd_ok,
+    'AT+SBDMTA': RockBlockEmulator._cmd_sbdmta,
+    'AT+CSQ': RockBlockEmulator._cmd_csq,
+    'AT-MSSTM': RockBlockEmulator._cmd_msstm,
+    'AT+GSN': RockBlockEmulator._cmd_gsn,
+    'AT+SBDWB': RockBlockEmulator._cmd_sbdwb,
+    'AT+SBDD0': RockBlockEmulator._cmd_sbdd,
+    'AT+SBDD1': RockBlockEmulator._cmd_sbdd,
+    'AT+SBDD2': RockBlockEmulator._cmd_sbdd,
+    'AT+SBDIX': RockBlockEmulator._cmd_sbdix,
+    'AT+SBDIXA': RockBlockEmulator._cmd_sbdix,
+    'AT+SBDRB': RockBlockEmulator._cmd_sbdrb,
+    'AT+SBDSX': RockBlockEmulator._cmd_sbdsx,
+}
+
+
+def _call_or_get(v):
+    return v() if callable(v) else v
+
+
+def run_benchmark(messages, mt_messages, pack=False, **kwargs):
+    """
+    Drive a QueueManager against an emulator and report throughput.
+
+    Args:
+        pack (bool): Whether to pack outbox messages together; see
+            queue_manager.pack_outbox.
+
+    Returns: dict of timings and emulator counters.
+    """
+    # Imported here so that the emulator itself doesn't need Flask-era
+    # dependencies just to be used from a test.
+    from holonet import mailboxes, queue_manager, signal_scheduler
+
+    old_root = mailboxes.mailboxes_root
+    old_history_file = signal_scheduler.history_file
+    old_pack_outbox = queue_manager.pack_outbox
+    queue_manager.pack_outbox = pack
+    tmpdir = tempfile.mkdtemp(prefix='holonet-bench-')
+    mailboxes.mailboxes_root = tmpdir
+    signal_scheduler.history_file = os.path.join(tmpdir,
+                                                 'signal_history.json')
+    try:
+        with RockBlockEmulator(**kwargs) as emulator:
+            start = time.monotonic()
+            qm = queue_manager.QueueManager(device=emulator.device)
+            connect_time = time.monotonic() - start
+
+            for i in range(messages):
+                mailboxes.queue_message_send(
+                    'local', '+14158008000', 'Benchmark message %d' % i)
+            start = time.monotonic()
+            qm.check_outbox()
+            send_time = time.monotonic() - start
+
+            for i in range(mt_messages):
+                emulator.queue_mt_message(
+                    b'+14158008000:Benchmark reply %d' % i, ring=False)
+            start = time.monotonic()
+            qm.get_messages(ack_ring=False)
+            drain_time = time.monotonic() - start
+
+            qm.rockblock.close()
+            outbox_left = len(mailboxes.read_outbox())
+            result = {
+                'connect_secs': connect_time,
+                'send_secs': send_time,
+                'drain_secs': drain_time,
+                'modem_busy_secs': emulator.busy_time,
+                'mo_per_hour': _per_hour(messages - outbox_left, send_time),
+                'mt_per_hour': _per_hour(emulator.stats['mt_delivered'],
+                                         drain_time),
+                'mt_left_queued': emulator.mt_queue_length(),
+                'outbox_left': outbox_left,
+            }
+            result.update(emulator.stats)
+            return result
+    finally:
+        mailboxes.mailboxes_root = old_root
+        signal_scheduler.history_file = old_history_file
+        queue_manager.pack_outbox = old_pack_outbox
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def _per_hour(count, secs):
+    return count * 3600.0 / secs if secs else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark holonet against an emulated RockBLOCK.')
+    parser.add_argument('--messages', type=int, default=10)
+    parser.add_argument('--mt-messages', type=int, default=10)
+    parser.add_argument('--signal', type=int, default=5)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--session-latency', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--pack', action='store_true',
+                        help='Pack several messages into each MO payload.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = run_benchmark(
+        args.messages, args.mt_messages, pack=args.pack, signal=args.signal,
+        session_failure_rate=args.failure_rate,
+        command_latency=args.latency,
+        latencies={'AT+SBDIX': args.session_latency,
+                   'AT+SBDIXA': args.session_latency},
+        seed=args.seed)
+    for k in sorted(result):
+        print('%-20s %s' % (k, result[k]))
+
+
+if __name__ == '__main__':
+    main()
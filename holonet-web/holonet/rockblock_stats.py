@@ -0,0 +1,234 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+In-memory statistics on the AT commands sent to the RockBLOCK.
+
+For each command (AT+CSQ, AT+SBDIX, ...) we keep a latency histogram, the
+number of retries and resyncs, bytes in and out, and a count of each final
+result.  +SBDIX MO and MT status codes are counted by value, and resyncs by
+cause.  Everything is recorded by holonet.rockblock.RockBlock and can be
+read with snapshot(), which app.py serves as JSON.
+'''
+
+import bisect
+from collections import Counter
+import threading
+import time
+
+
+# Upper bounds of the latency histogram buckets, in seconds.  The last
+# bucket is unbounded.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+class LatencyHistogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+
+    def add(self, secs):
+        self.counts[bisect.bisect_left(self.buckets, secs)] += 1
+        self.count += 1
+        self.total += secs
+        self.min = secs if self.min is None else min(self.min, secs)
+        self.max = secs if self.max is None else max(self.max, secs)
+
+
+    def percentile(self, p):
+        """
+        Returns: the upper bound of the bucket containing the p'th
+        percentile, or the maximum if that's in the unbounded bucket.
+        """
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for (i, n) in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+
+    def to_json(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': [[le, n] for (le, n) in
+                        zip(list(self.buckets) + [None], self.counts)],
+        }
+
+
+class CommandStats(object):
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.results = Counter()
+        self.retries = 0
+        self.resyncs = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+    def to_json(self):
+        return {
+            'count': self.latency.count,
+            'results': dict(self.results),
+            'retries': self.retries,
+            'resyncs': self.resyncs,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'latency': self.latency.to_json(),
+        }
+
+
+class CommandRecord(object):
+    """A command in flight.  See RockBlockStats.start_command."""
+    def __init__(self, name):
+        self.name = name
+        self.start = time.monotonic()
+        self.retries = 0
+        self.resyncs = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+class RockBlockStats(object):
+    """
+    Statistics for one RockBLOCK.  Recording happens on the thread driving
+    the modem and reading on Flask's threads, so everything goes through a
+    lock.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = {}
+        self._mo_status = Counter()
+        self._mt_status = Counter()
+        self._resync_causes = Counter()
+        self._since = time.time()
+
+
+    def reset(self):
+        with self._lock:
+            self._commands = {}
+            self._mo_status = Counter()
+            self._mt_status = Counter()
+            self._resync_causes = Counter()
+            self._since = time.time()
+
+
+    def start_command(self, cmd):
+        """
+        Args:
+            cmd (bytes): The command as sent, e.g. b'AT+SBDWB=12'.  Arguments
+                are dropped for the purposes of aggregation.
+
+        Returns: a CommandRecord for the caller to update and then pass to
+        finish_command.
+        """
+        name = cmd.split(b'=', 1)[0].decode('ascii', 'replace')
+        return CommandRecord(name)
+
+
+    def finish_command(self, record, result):
+        """
+        Args:
+            record (CommandRecord): From start_command.
+            result (str): The final result, e.g. 'OK', 'ERROR', 'timeout'.
+        """
+        latency = time.monotonic() - record.start
+        with self._lock:
+            stats = self._commands.get(record.name)
+            if stats is None:
+                stats = CommandStats()
+                self._commands[record.name] = stats
+            stats.latency.add(latency)
+            stats.results[result] += 1
+            stats.retries += record.retries
+            stats.resyncs += record.resyncs
+            stats.bytes_in += record.bytes_in
+            stats.bytes_out += record.bytes_out
+
+
+    def record_session(self, mo_status, mt_status):
+        with self._lock:
+            self._mo_status[mo_status] += 1
+            self._mt_status[mt_status] += 1
+
+
+    def record_resync(self, cause, success):
+        with self._lock:
+            self._resync_causes['%s_%s' % (
+                cause, 'ok' if success else 'failed')] += 1
+
+
+    def snapshot(self):
+        """
+        Returns: a dict of everything recorded since startup or the last
+        reset, suitable for JSON.
+        """
+        with self._lock:
+            return {
+                'since': self._since,
+                'commands': dict((name, stats.to_json()) for
+                                 (name, stats) in self._commands.items()),
+                'sbdix_mo_status': _str_keys(self._mo_status),
+                'sbdix_mt_status': _str_keys(self._mt_status),
+                'resyncs': dict(self._resync_causes),
+            }
+
+
+def _str_keys(d):
+    return dict((str(k), v) for (k, v) in d.items())
+
+
+# The statistics for the RockBLOCK, shared by all RockBlock instances.
+stats = RockBlockStats()
+
+
+def snapshot():
+    return stats.snapshot()
+
+
+def reset():
+    stats.reset()
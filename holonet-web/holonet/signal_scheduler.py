@@ -0,0 +1,245 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+Plans signal polls and transmit attempts around when the sky is likely to
+be visible.
+
+Signal readings and session outcomes are kept as a rolling (exponentially
+weighted) success rate for each 15-minute slot of the day.  Where there's
+enough history to say that a slot is usually bad, we poll less often and
+give up on a signal wait sooner, and schedule the next check for the start
+of the next slot that is usually good.  A slot's rate decays back towards
+PRIOR as it ages, so that a slot that has been skipped as bad gets sampled
+again eventually.  With no history, everything behaves as it did with fixed
+intervals.
+'''
+
+from datetime import datetime, timedelta
+import json
+import logging
+import threading
+
+from .rockblock import SIGNAL_THRESHOLD
+from .utils import parse_utc_str, utc_str, write_file
+
+
+HISTORY_FILE = '/var/opt/pr-holonet/signal_history.json'
+
+SLOT_MINUTES = 15
+SLOTS = 24 * 60 // SLOT_MINUTES
+# Weight of each new observation in a slot's rolling success rate.
+EWMA_ALPHA = 0.2
+# Observations needed before we trust a slot's rate over PRIOR.
+MIN_SAMPLES = 3
+PRIOR = 0.5
+# How long it takes for a slot's rate to get halfway back to PRIOR without
+# any new observations.
+DECAY_HALF_LIFE = timedelta(days=3)
+GOOD_VISIBILITY = 0.5
+BAD_VISIBILITY = 0.2
+
+# How often to check the signal: normally, when there's traffic waiting to
+# go, and the most we'll wait during a known-bad period.
+IDLE_POLL_SECS = 5 * 60
+PENDING_POLL_SECS = 60
+MAX_POLL_SECS = 30 * 60
+
+# Signal waits during a known-bad period: fewer tries, with exponential
+# backoff up to MAX_RESCAN_DELAY.
+BAD_SIGNAL_ATTEMPTS = 3
+MAX_RESCAN_DELAY = 60
+
+SAVE_INTERVAL = timedelta(minutes=5)
+
+# Will be overridden by app.py for non-Gunicorn builds.
+history_file = HISTORY_FILE
+
+_logger = logging.getLogger('holonet.signal_scheduler')
+
+
+class SignalScheduler(object):
+    def __init__(self, path=None):
+        self.path = path
+        # Per slot: [rolling success rate, number of observations, time of
+        # the last observation].
+        self._slots = [[PRIOR, 0, None] for _ in range(SLOTS)]
+        self._lock = threading.Lock()
+        self._last_save = datetime.min
+        if path is not None:
+            self.load()
+
+
+    def record_signal(self, signal, when=None):
+        """Record a +CSQ reading.  Negative values (failed reads) are
+           ignored."""
+        if signal < 0:
+            return
+        self._record(signal >= SIGNAL_THRESHOLD, when)
+
+
+    def record_session(self, success, when=None):
+        self._record(success, when)
+
+
+    def _record(self, good, when):
+        when = when or datetime.utcnow()
+        with self._lock:
+            slot = self._slots[_slot_of(when)]
+            rate = _decayed_rate(slot, when)
+            slot[0] = rate + EWMA_ALPHA * ((1.0 if good else 0.0) - rate)
+            slot[1] += 1
+            slot[2] = max(when, slot[2] or when)
+        if when - self._last_save >= SAVE_INTERVAL:
+            self.save(when)
+
+
+    def visibility(self, when=None):
+        """
+        Returns: the estimated chance of a usable signal at the given time,
+        from 0 to 1.
+        """
+        when = when or datetime.utcnow()
+        with self._lock:
+            slot = self._slots[_slot_of(when)]
+            if slot[1] < MIN_SAMPLES:
+                return PRIOR
+            return _decayed_rate(slot, when)
+
+
+    def is_known_bad(self, when=None):
+        return self.visibility(when) < BAD_VISIBILITY
+
+
+    def next_window(self, when=None):
+        """
+        Returns: the start of the next slot (from now, or the given time)
+        that is usually good, or None if there's none in the next 24 hours.
+        """
+        when = when or datetime.utcnow()
+        start = _slot_start(when)
+        for i in range(1, SLOTS + 1):
+            t = start + timedelta(minutes=i * SLOT_MINUTES)
+            if self.visibility(t) >= GOOD_VISIBILITY:
+                return t
+        return None
+
+
+    def next_check_delay(self, pending, when=None):
+        """
+        Args:
+            pending (bool): Whether there's traffic waiting to be sent.
+
+        Returns: seconds until the signal should next be checked.
+        """
+        when = when or datetime.utcnow()
+        base = PENDING_POLL_SECS if pending else IDLE_POLL_SECS
+        if not self.is_known_bad(when):
+            return base
+
+        window = self.next_window(when)
+        if window is None:
+            return MAX_POLL_SECS
+        secs = (window - when).total_seconds()
+        return max(base, min(secs, MAX_POLL_SECS))
+
+
+    def signal_attempts(self, default, when=None):
+        """Returns: how many times to check the signal before giving up."""
+        if self.is_known_bad(when):
+            return min(default, BAD_SIGNAL_ATTEMPTS)
+        return default
+
+
+    def rescan_delay(self, retries, default, when=None):
+        """Returns: seconds to wait after the given number of failed signal
+           checks."""
+        if not self.is_known_bad(when):
+            return default
+        return min(default * 2 ** (retries - 1), MAX_RESCAN_DELAY)
+
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                slots = json.load(f)['slots']
+        except FileNotFoundError:
+            return
+        except Exception as err:
+            _logger.warning('Ignoring bad signal history in %s: %s',
+                            self.path, err)
+            return
+        if len(slots) != SLOTS:
+            _logger.warning('Ignoring signal history in %s: %d slots, '
+                            'expected %d.', self.path, len(slots), SLOTS)
+            return
+        try:
+            slots = [[float(r), int(n), t and parse_utc_str(t)]
+                     for (r, n, t) in slots]
+        except Exception as err:
+            _logger.warning('Ignoring bad signal history in %s: %s',
+                            self.path, err)
+            return
+        with self._lock:
+            self._slots = slots
+
+
+    def save(self, when=None):
+        self._last_save = when or datetime.utcnow()
+        if self.path is None:
+            return
+        with self._lock:
+            data = json.dumps({'slots': [
+                [r, n, None if t is None else utc_str(t)]
+                for (r, n, t) in self._slots]})
+        try:
+            write_file(self.path, data)
+        except Exception as err:
+            _logger.warning('Failed to write %s: %s', self.path, err)
+
+
+def _decayed_rate(slot, when):
+    (rate, _, last) = slot
+    if last is None or when <= last:
+        return rate
+    weight = 0.5 ** ((when - last) / DECAY_HALF_LIFE)
+    return PRIOR + (rate - PRIOR) * weight
+
+
+def _slot_of(when):
+    return (when.hour * 60 + when.minute) // SLOT_MINUTES
+
+
+def _slot_start(when):
+    return when.replace(minute=when.minute - when.minute % SLOT_MINUTES,
+                        second=0, microsecond=0)
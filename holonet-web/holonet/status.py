@@ -0,0 +1,131 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+The RockBLOCK and queue status, as published by holonet.queue_manager.
+
+The status is an immutable Status snapshot.  Each update makes a new one
+with a higher version and swaps it in, so readers just take the current
+snapshot, without locking, and always see a consistent set of values.
+Anything that wants to know about changes can subscribe to them, rather
+than polling.
+'''
+
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+
+_logger = logging.getLogger('holonet.status')
+
+
+# version: increases with every change.
+# signal_ok: whether the last signal reading was good enough to send.
+# signal_strength: the last +CSQ reading, 0-5.
+# signal_time: when we got it (UTC datetime), or datetime.min.
+# rockblock_status: 'Unknown', 'Installed', 'Missing', or 'Broken'.
+# rockblock_serial: the RockBLOCK's IMEI, or None if we don't know it.
+# txfailed_mo_status: the MO status of the last failed send.
+# mt_queued: how many MT messages the gateway said were waiting.
+# pending_senders: frozenset of senders whose messages haven't been read.
+Status = namedtuple('Status', [
+    'version', 'signal_ok', 'signal_strength', 'signal_time',
+    'rockblock_status', 'rockblock_serial', 'txfailed_mo_status',
+    'mt_queued', 'pending_senders'])
+
+INITIAL_STATUS = Status(
+    version=0, signal_ok=False, signal_strength=0, signal_time=datetime.min,
+    rockblock_status='Unknown', rockblock_serial=None, txfailed_mo_status=0,
+    mt_queued=0, pending_senders=frozenset())
+
+
+class StatusBoard(object):
+    def __init__(self, initial=INITIAL_STATUS):
+        self._status = initial
+        self._subscribers = []
+        # Held while subscribers are called too, so that they hear about
+        # the changes in order.
+        self._lock = threading.Lock()
+
+
+    def get(self):
+        """Returns: the current Status."""
+        return self._status
+
+
+    def update(self, **changes):
+        """
+        Set the given Status fields.
+
+        Returns: the new Status.
+        """
+        return self.modify(lambda _: changes)
+
+
+    def modify(self, func):
+        """
+        Change the status based on its current value, atomically with
+        respect to other changes.
+
+        Args:
+            func (callable): Given the current Status, returns a dict of the
+                fields to change.
+
+        Returns: the new Status.
+        """
+        with self._lock:
+            old = self._status
+            new = old._replace(**func(old))
+            if new == old:
+                return old
+            new = new._replace(version=old.version + 1)
+            self._status = new
+            for callback in self._subscribers:
+                try:
+                    callback(old, new)
+                except Exception as err:
+                    _logger.error('Status subscriber %s failed: %s',
+                                  callback, err)
+        return new
+
+
+    def subscribe(self, callback):
+        """
+        Call callback(old, new) with the old and new Status after every
+        change.  It's called on the thread that made the change, before
+        any other change can be made, so it should be quick, and it mustn't
+        change the status itself.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
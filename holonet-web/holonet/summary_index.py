@@ -0,0 +1,175 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+A summary of each thread, for the home page: the printable number, the
+last message's timestamp, direction and a snippet of its body, and how many
+messages have arrived since the thread was last read.
+
+holonet.mailboxes keeps this up to date as messages are sent, received and
+deleted, so that listing the threads doesn't need to read any of them.  It's
+kept in the mailbox store (see holonet.mailbox_store), and saved in the same
+transaction as the change to the thread, so the two can't disagree after
+losing power.  If the store doesn't have one, it's rebuilt from the threads
+(without unread counts).
+'''
+
+import json
+import re
+import threading
+from collections import namedtuple
+
+from .utils import printable_phone_number
+
+
+SNIPPET_LENGTH = 60
+
+
+class ThreadSummary(namedtuple('ThreadSummary', [
+        'recipient', 'recipient_printable', 'timestamp', 'direction',
+        'snippet', 'unread'])):
+    __slots__ = ()
+
+    @property
+    def arrow(self):
+        return '&larr;' if self.direction == 'in' else '&rarr;'
+
+
+def snippet(body, length=SNIPPET_LENGTH):
+    """Returns: the start of the given message body, on one line."""
+    s = re.sub(r'\s+', ' ', body or '').strip()
+    if len(s) > length:
+        s = s[:length - 1].rstrip() + '…'
+    return s
+
+
+class SummaryIndex(object):
+    def __init__(self, data=None):
+        """
+        Args:
+            data (str): The index, as returned by to_json_str, or None to
+                start empty.
+
+        Raises: ValueError if data isn't a valid index.
+        """
+        # Key: local_user; value: dict with key: remote user; value: dict
+        # of the ThreadSummary fields plus 'filename', the last message's.
+        self._threads = {}
+        self._lock = threading.Lock()
+        if data is not None:
+            try:
+                self._threads = json.loads(data)['threads']
+            except (ValueError, KeyError, TypeError) as err:
+                raise ValueError('Bad thread summary index: %s' % err)
+
+
+    def __len__(self):
+        return sum(len(t) for t in self._threads.values())
+
+
+    def to_json_str(self):
+        with self._lock:
+            return json.dumps({'threads': self._threads})
+
+
+    def summaries(self, local_user):
+        """
+        Returns: ThreadSummary list for the given user's threads, most
+        recently active first.
+        """
+        with self._lock:
+            entries = sorted(self._threads.get(local_user, {}).values(),
+                             key=lambda e: e['filename'], reverse=True)
+            return [ThreadSummary(*(e[f] for f in ThreadSummary._fields))
+                    for e in entries]
+
+
+    def unread(self, local_user, remote_user):
+        with self._lock:
+            entry = self._threads.get(local_user, {}).get(remote_user)
+            return entry['unread'] if entry else 0
+
+
+    def add_message(self, local_user, remote_user, filename, msg,
+                    unread=False):
+        """
+        Record that msg (which is stored as filename) has been added to the
+        thread, and count it as unread if unread is set.
+        """
+        self.add_messages([(local_user, remote_user, filename, msg)], unread)
+
+
+    def add_messages(self, messages, unread=False):
+        """
+        As for add_message, for each of messages, which are
+        (local_user, remote_user, filename, msg).
+        """
+        with self._lock:
+            for (local_user, remote_user, filename, msg) in messages:
+                self._add(local_user, remote_user, filename, msg, unread)
+
+
+    def mark_read(self, local_user, remote_user):
+        """Returns: whether there was anything to mark."""
+        with self._lock:
+            entry = self._threads.get(local_user, {}).get(remote_user)
+            if entry is None or not entry['unread']:
+                return False
+            entry['unread'] = 0
+            return True
+
+
+    def remove(self, local_user, remote_user):
+        """Returns: whether there was such a thread."""
+        with self._lock:
+            return bool(
+                self._threads.get(local_user, {}).pop(remote_user, None))
+
+
+    def _add(self, local_user, remote_user, filename, msg, unread):
+        threads = self._threads.setdefault(local_user, {})
+        entry = threads.get(remote_user)
+        if entry is None:
+            entry = threads[remote_user] = {
+                'recipient': remote_user,
+                'recipient_printable': printable_phone_number(remote_user),
+                'filename': '',
+                'unread': 0,
+            }
+        if filename >= entry['filename']:
+            entry.update({
+                'filename': filename,
+                'timestamp': msg.timestamp,
+                'direction': msg.direction,
+                'snippet': snippet(msg.body),
+            })
+        if unread:
+            entry['unread'] += 1
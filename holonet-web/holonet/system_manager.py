@@ -61,10 +61,12 @@ _logger = logging.getLogger('holonet.system_manager')
 
 # pylint: disable=unused-variable
 def get_system_status():
-    signal = queue_manager.last_known_signal_strength
-    rockblock_serial = queue_manager.rockblock_serial_identifier or "Unknown"
-    rockblock_status = queue_manager.last_known_rockblock_status
-    rockblock_err = queue_manager.last_txfailed_mo_status
+    status = queue_manager.get_status()
+    signal = status.signal_strength
+    rockblock_serial = status.rockblock_serial or "Unknown"
+    rockblock_status = status.rockblock_status
+    rockblock_err = status.txfailed_mo_status
+    mt_queued = status.mt_queued
 
     network_mode = _get_network_mode()
     ap_settings = _get_ap_settings()
@@ -74,6 +76,7 @@ def get_system_status():
     result = dict(locals())
     result.update(ap_settings)
     del result['ap_settings']
+    del result['status']
     return result
 
 
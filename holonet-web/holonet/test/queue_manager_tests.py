@@ -0,0 +1,71 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from holonet import mailboxes, queue_manager, signal_scheduler
+from holonet.rockblock_emulator import RockBlockEmulator
+
+
+class QueueManagerTests(object):
+    """Mixin for tests of a QueueManager driving a RockBlockEmulator, with
+    the mailboxes and signal history in a temporary directory.
+
+    overrides: (module, name, value) for any other module settings to
+    patch for each test.
+    """
+    # pylint: disable=no-member
+    overrides = ()
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(mailboxes, 'mailboxes_root', self.tmpdir),
+            patch.object(signal_scheduler, 'history_file',
+                         os.path.join(self.tmpdir, 'signal_history.json')),
+        ]
+        self.patches.extend(patch.object(module, name, value)
+                            for (module, name, value) in self.overrides)
+        for p in self.patches:
+            p.start()
+        self.emulator = RockBlockEmulator(seed=1).start()
+        self.qm = queue_manager.QueueManager(device=self.emulator.device)
+
+    def tearDown(self):
+        self.qm.rockblock.close()
+        self.emulator.stop()
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmpdir)
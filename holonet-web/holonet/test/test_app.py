@@ -0,0 +1,83 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+
+from holonet.message import PRIORITY_HIGH, PRIORITY_NORMAL
+
+try:
+    import app
+except ImportError:
+    # The web app needs flask_webpack, which isn't needed by anything else.
+    app = None
+
+
+@skipIf(app is None, 'the web app is not importable')
+class TestSendMessage(TestCase):
+    def setUp(self):
+        self.client = app.app.test_client()
+        self.patches = [
+            patch.object(app.mailboxes, 'queue_message_send'),
+            patch.object(app.queue_manager, 'check_outbox'),
+        ]
+        self.queue_message_send = self.patches[0].start()
+        self.patches[1].start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+
+    def _post(self, **form):
+        form.setdefault('recipient', '+15555551234')
+        form.setdefault('body', 'Hello')
+        resp = self.client.post('/send_message', data=form)
+        self.assertEqual(resp.status_code, 302)
+        (_, kwargs) = self.queue_message_send.call_args
+        return (kwargs['priority'], kwargs['ttl'])
+
+
+    def test_good_values(self):
+        self.assertEqual(self._post(priority=str(PRIORITY_HIGH), ttl='3600'),
+                         (PRIORITY_HIGH, 3600))
+        self.assertEqual(self._post(), (PRIORITY_NORMAL, None))
+
+
+    def test_bad_values(self):
+        for (priority, ttl) in (('99', '1' + '0' * 30),
+                                ('-1', '-3600'),
+                                ('x', 'y'),
+                                ('', '')):
+            self.assertEqual(self._post(priority=priority, ttl=ttl),
+                             (PRIORITY_NORMAL, None))
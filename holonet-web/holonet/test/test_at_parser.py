@@ -0,0 +1,189 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import time
+from unittest import TestCase
+
+from holonet.at_parser import ATResponseParser, ATToken, ATTokenReader, \
+    BAD_FRAME, ECHO, FRAME, INTERMEDIATE, NOISE, RESULT, UNSOLICITED
+
+
+def _frame(payload, checksum=None):
+    if checksum is None:
+        checksum = sum(payload) & 0xffff
+    return (len(payload).to_bytes(2, byteorder='big') + payload +
+            checksum.to_bytes(2, byteorder='big'))
+
+
+class TestATResponseParser(TestCase):
+    def check(self, stream, expected):
+        # Feed the stream whole, and then split at every position, to make
+        # sure that chunking doesn't matter.
+        for i in range(len(stream) + 1):
+            p = ATResponseParser()
+            r = p.feed(stream[:i]) + p.feed(stream[i:])
+            self.assertEqual(r, expected, 'split at %d' % i)
+            self.assertEqual(p.pending(), 0)
+
+
+    def test_csq(self):
+        self.check(b'AT+CSQ\r\r\n+CSQ:5\r\n\r\nOK\r\n', [
+            ATToken(ECHO, b'AT+CSQ'),
+            ATToken(INTERMEDIATE, b'+CSQ:5'),
+            ATToken(RESULT, b'OK'),
+        ])
+
+
+    def test_sbdwb(self):
+        self.check(b'AT+SBDWB=2\r\r\nREADY\r\n\r\n0\r\n\r\nOK\r\n', [
+            ATToken(ECHO, b'AT+SBDWB=2'),
+            ATToken(RESULT, b'READY'),
+            ATToken(INTERMEDIATE, b'0'),
+            ATToken(RESULT, b'OK'),
+        ])
+
+
+    def test_sbdring(self):
+        self.check(b'\r\nSBDRING\r\nAT\r\r\nOK\r\n', [
+            ATToken(UNSOLICITED, b'SBDRING'),
+            ATToken(ECHO, b'AT'),
+            ATToken(RESULT, b'OK'),
+        ])
+
+
+    def test_sbdrb(self):
+        # Includes \r, \n and "OK" inside the payload, which must not be
+        # mistaken for line endings.
+        payload = b'+1415:a\r\nOK\n'
+        self.check(b'AT+SBDRB\r' + _frame(payload) + b'\r\nOK\r\n', [
+            ATToken(ECHO, b'AT+SBDRB'),
+            ATToken(FRAME, payload),
+            ATToken(RESULT, b'OK'),
+        ])
+
+
+    def test_sbdrb_empty(self):
+        self.check(b'AT+SBDRB\r' + _frame(b'') + b'\r\nOK\r\n', [
+            ATToken(ECHO, b'AT+SBDRB'),
+            ATToken(FRAME, b''),
+            ATToken(RESULT, b'OK'),
+        ])
+
+
+    def test_sbdrb_bad_checksum(self):
+        self.check(b'AT+SBDRB\r' + _frame(b'Hi', 1) + b'\r\nOK\r\n', [
+            ATToken(ECHO, b'AT+SBDRB'),
+            ATToken(BAD_FRAME, b'Hi'),
+            ATToken(RESULT, b'OK'),
+        ])
+
+
+    def test_reset(self):
+        p = ATResponseParser()
+        self.assertEqual(p.feed(b'AT+SBDRB\r\x00\x10abc'),
+                         [ATToken(ECHO, b'AT+SBDRB')])
+        self.assertEqual(p.pending(), 5)
+        p.reset()
+        self.assertEqual(p.feed(b'OK\r\n'), [ATToken(RESULT, b'OK')])
+
+
+class TestATTokenReader(TestCase):
+    def setUp(self):
+        self.unsolicited = []
+
+    def make_reader(self, chunks, **kwargs):
+        """Returns: an ATTokenReader that replays the given recorded
+           chunks, and then times out."""
+        chunks = list(chunks)
+
+        def read(timeout):
+            return chunks.pop(0) if chunks else b''
+        return ATTokenReader(read, self.unsolicited.append, **kwargs)
+
+    def deadline(self):
+        return time.monotonic() + 0.05
+
+
+    def test_lines(self):
+        r = self.make_reader([b'AT+CSQ\r', b'\r\n+CS', b'Q:5\r\n\r\nO',
+                              b'K\r\n'])
+        self.assertEqual(r.read_token(self.deadline()),
+                         ATToken(ECHO, b'AT+CSQ'))
+        self.assertEqual(r.read_token(self.deadline()),
+                         ATToken(INTERMEDIATE, b'+CSQ:5'))
+        self.assertEqual(r.read_token(self.deadline()),
+                         ATToken(RESULT, b'OK'))
+        self.assertIsNone(r.read_token(self.deadline()))
+
+
+    def test_unsolicited(self):
+        # Lots of chatter: it mustn't matter how much.
+        chatter = [b'\r\n', b'SBDRING\r\n'] * 1000
+        r = self.make_reader(chatter + [b'AT\r\r\nOK\r\n'])
+        self.assertEqual(r.read_token(self.deadline()), ATToken(ECHO, b'AT'))
+        self.assertEqual(len(self.unsolicited), 1000)
+        self.assertEqual(self.unsolicited[0],
+                         ATToken(UNSOLICITED, b'SBDRING'))
+
+
+    def test_timeout(self):
+        r = self.make_reader([b'AT+CS'])
+        start = time.monotonic()
+        self.assertIsNone(r.read_token(start + 0.05))
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertEqual(r.discard(), b'AT+CS')
+
+
+    def test_overflow(self):
+        r = self.make_reader([b'\x00' * 30, b'\x00' * 30, b'AT\r'],
+                             max_pending=50)
+        self.assertEqual(r.read_token(self.deadline()),
+                         ATToken(NOISE, b'\x00' * 60))
+        self.assertEqual(r.read_token(self.deadline()), ATToken(ECHO, b'AT'))
+
+
+    def test_discard(self):
+        r = self.make_reader([b'+CSQ:1\r\nOK\r\nAT'])
+        self.assertEqual(r.read_token(self.deadline()),
+                         ATToken(INTERMEDIATE, b'+CSQ:1'))
+        self.assertEqual(r.discard(), b'OK\r\nAT')
+        self.assertIsNone(r.read_token(self.deadline()))
+
+
+    def test_drain(self):
+        r = self.make_reader([b'+CSQ:1\r\nSBDRING\r\n', b'OK\r\nAT'])
+        self.assertEqual(r.read_token(self.deadline()),
+                         ATToken(INTERMEDIATE, b'+CSQ:1'))
+        self.assertEqual(r.drain(), b'OK\r\nAT')
+        self.assertEqual(self.unsolicited,
+                         [ATToken(UNSOLICITED, b'SBDRING')])
+        self.assertIsNone(r.read_token(self.deadline()))
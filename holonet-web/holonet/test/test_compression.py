@@ -0,0 +1,115 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import shutil
+import tempfile
+from unittest import TestCase
+
+from holonet import compression, mailboxes
+from holonet.compression import CODEC_BINARY, CODEC_NONE, CODEC_SMALLEST, \
+    CODEC_ZLIB, CompressionException, decode, encode
+
+
+CODECS = compression.CODECS + (CODEC_SMALLEST,)
+
+
+class TestCompression(TestCase):
+    def check(self, data):
+        for codec in CODECS:
+            self.assertEqual(decode(encode(data, codec)), data, codec)
+
+
+    def test_round_trip(self):
+        for line in compression.SAMPLE_CORPUS:
+            self.check(line.encode('utf-8'))
+        self.check(b'')
+        self.check('+14158008000:Café ☃ \U0001f600'.encode('utf-8'))
+        # Longer than one verbatim run.
+        self.check(bytes(range(128, 256)) * 3)
+
+
+    def test_legacy(self):
+        self.assertEqual(decode(b'+14158008000:Hi'), b'+14158008000:Hi')
+        self.assertEqual(encode(b'+1:Hi', CODEC_NONE), b'+1:Hi')
+        # Records that the binary format can't represent go as they are.
+        self.assertEqual(encode(b'Hi', CODEC_BINARY), b'Hi')
+        self.assertEqual(encode(b'12345:Hi', CODEC_BINARY), b'12345:Hi')
+
+
+    def test_smallest(self):
+        for line in compression.SAMPLE_CORPUS:
+            data = line.encode('utf-8')
+            smallest = len(encode(data, CODEC_SMALLEST))
+            for codec in CODECS:
+                self.assertLessEqual(smallest, len(encode(data, codec)))
+        # Incompressible data goes as it is.
+        self.assertEqual(encode(b'\x01', CODEC_SMALLEST), b'\x01')
+
+
+    def test_benchmark(self):
+        records = [line.encode('utf-8')
+                   for line in compression.SAMPLE_CORPUS]
+        result = compression.benchmark(records)
+        self.assertEqual(result[CODEC_NONE]['ratio'], 1.0)
+        self.assertLess(result[CODEC_SMALLEST]['ratio'], 0.7)
+        self.assertLess(result[CODEC_SMALLEST]['credits'],
+                        result[CODEC_NONE]['credits'])
+
+
+    def test_corrupt(self):
+        self.assertRaises(CompressionException, decode, b'\xf8\xff\xff')
+        self.assertRaises(CompressionException, decode,
+                          encode(b'Hello there, how are you?', CODEC_ZLIB)[:5])
+        self.assertRaises(CompressionException, decode, b'\xf9\xfe')
+        self.assertRaises(CompressionException, decode, b'\xf9\xff\x05ab')
+        self.assertRaises(CompressionException, decode, b'\xfa\x10\x0b')
+        self.assertRaises(ValueError, encode, b'x', 'lzma')
+
+
+class TestInboxDecoding(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.old_root = mailboxes.mailboxes_root
+        mailboxes.mailboxes_root = self.tmpdir
+
+    def tearDown(self):
+        mailboxes.mailboxes_root = self.old_root
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_accept(self):
+        body = 'We are all safe and well, at camp now.'
+        data = ('+14158008000:' + body).encode('utf-8')
+        mailboxes.save_message_to_inbox(encode(data, CODEC_ZLIB))
+        msgs = mailboxes.accept_all_inbox_messages()
+        self.assertEqual([(m.sender, m.body) for m in msgs],
+                         [('+14158008000', body)])
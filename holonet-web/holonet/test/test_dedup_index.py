@@ -0,0 +1,94 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import os
+import os.path
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from holonet import mailboxes
+from holonet.dedup_index import DedupIndex, message_key
+from holonet.test.queue_manager_tests import QueueManagerTests
+
+
+class TestDedupIndex(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'dedup.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_key(self):
+        self.assertNotEqual(message_key(1, b'Hi'), message_key(2, b'Hi'))
+        self.assertNotEqual(message_key(1, b'Hi'), message_key(1, b'Ho'))
+        self.assertEqual(message_key(1, b'Hi'), message_key(1, b'Hi'))
+
+
+    def test_persist_and_evict(self):
+        start = time.time()
+        index = DedupIndex(self.path, max_age=100, max_entries=3)
+        for i in range(4):
+            index.add('k%d' % i, now=start + i)
+        self.assertNotIn('k0', index)
+        self.assertEqual(len(index), 3)
+
+        index = DedupIndex(self.path, max_age=100, max_entries=3)
+        self.assertEqual(len(index), 3)
+        index.add('k4', now=start + 101.5)
+        self.assertEqual(sorted(index._seen), ['k2', 'k3', 'k4'])
+        index.add('k5', now=start + 150)
+        self.assertEqual(sorted(index._seen), ['k4', 'k5'])
+
+
+    def test_bad_file(self):
+        with open(self.path, 'w') as f:
+            f.write('{')
+        index = DedupIndex(self.path)
+        self.assertEqual(len(index), 0)
+        index.add('k')
+        self.assertIn('k', DedupIndex(self.path))
+
+
+class TestDuplicateDelivery(QueueManagerTests, TestCase):
+    def test_duplicate(self):
+        self.qm.rockBlockRxReceived(7, b'+14158008000:Hello')
+        self.qm.rockBlockRxReceived(7, b'+14158008000:Hello')
+        # A reused MTMSN with different content is a new message.
+        self.qm.rockBlockRxReceived(7, b'+14158008000:Again')
+        self.qm.rockBlockRxReceived(8, b'+14158008000:Hello')
+        msgs = mailboxes.accept_all_inbox_messages()
+        self.assertEqual([m.body for m in msgs],
+                         ['Hello', 'Again', 'Hello'])
@@ -0,0 +1,144 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from holonet import fragmentation, mailboxes, queue_manager
+from holonet.fragmentation import FragmentationException, fragment_all, \
+    parse, reassemble
+from holonet.test.queue_manager_tests import QueueManagerTests
+
+
+LONG = b'+14158008000:' + bytes(range(256)) * 3
+
+
+class TestFragmentation(TestCase):
+    def test_round_trip(self):
+        frags = fragment_all(LONG, 1234)
+        self.assertEqual(len(frags), 3)
+        for f in frags:
+            self.assertLessEqual(len(f), fragmentation.MAX_PAYLOAD)
+            self.assertTrue(fragmentation.is_fragment(f))
+        parsed = [parse(f) for f in reversed(frags)]
+        self.assertEqual(parsed[0].msg_id, 1234)
+        self.assertEqual(reassemble(parsed), LONG)
+
+
+    def test_errors(self):
+        frags = [parse(f) for f in fragment_all(LONG, 1)]
+        self.assertRaises(FragmentationException, reassemble, frags[1:])
+        self.assertRaises(FragmentationException, reassemble, [])
+        self.assertRaises(FragmentationException, parse, b'+1:Hi')
+        self.assertRaises(FragmentationException, parse,
+                          b'\xfd\x01\x00\x01\x03\x03data')
+        self.assertRaises(FragmentationException, fragmentation.fragment,
+                          b'x' * 100000, 1, 0)
+
+
+class TestReassembly(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.old_root = mailboxes.mailboxes_root
+        mailboxes.mailboxes_root = self.tmpdir
+
+    def tearDown(self):
+        mailboxes.mailboxes_root = self.old_root
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_out_of_order(self):
+        (a, b, c) = fragment_all(LONG, 7)
+        (x, y, z) = fragment_all(LONG[::-1], 8)
+        self.assertIsNone(mailboxes.save_fragment(c))
+        self.assertIsNone(mailboxes.save_fragment(y))
+        self.assertIsNone(mailboxes.save_fragment(a))
+        self.assertIsNone(mailboxes.save_fragment(a))
+        self.assertEqual(mailboxes.save_fragment(b), LONG)
+        self.assertIsNone(mailboxes.save_fragment(z))
+        self.assertEqual(mailboxes.save_fragment(x), LONG[::-1])
+
+
+    def test_expiry(self):
+        (a, b, c) = fragment_all(LONG, 7)
+        mailboxes.save_fragment(a)
+        mailboxes.save_fragment(b)
+        mailboxes.expire_fragments(60)
+        past = time.time() - 120
+        os.utime(mailboxes._path_of_fragments(7), (past, past))
+        mailboxes.expire_fragments(60)
+        self.assertIsNone(mailboxes.save_fragment(c))
+
+
+class TestFragmentedSend(QueueManagerTests, TestCase):
+    overrides = ((queue_manager, 'fragment_outbox', True),)
+
+    def test_interleave(self):
+        mailboxes.queue_message_send('local', '+14158008000', 'x' * 1000)
+        mailboxes.queue_message_send('local', '+14158008000', 'Short')
+        self.qm.check_outbox()
+
+        sent = self.emulator.mo_sent
+        self.assertEqual(len(sent), 5)
+        # The short message goes straight after the first fragment.
+        self.assertEqual(sent[1], b'+14158008000:Short')
+        frags = [parse(f) for f in sent if fragmentation.is_fragment(f)]
+        self.assertEqual(reassemble(frags),
+                         b'+14158008000:' + b'x' * 1000)
+        self.assertEqual(mailboxes.read_outbox(), [])
+
+
+    @patch.object(queue_manager, 'fragment_outbox', False)
+    def test_disabled(self):
+        mailboxes.queue_message_send('local', '+14158008000', 'x' * 1000)
+        mailboxes.queue_message_send('local', '+14158008000', 'Short')
+        self.qm.check_outbox()
+        self.assertEqual(self.emulator.mo_sent, [b'+14158008000:Short'])
+        self.assertEqual(mailboxes.read_outbox(), [])
+        self.assertEqual(len(mailboxes.read_dead_letter()), 1)
+
+
+    def test_receive(self):
+        frags = fragment_all(b'+14158008000:' + b'y' * 700, 99)
+        self.emulator.queue_mt_message(frags[2], ring=False)
+        self.emulator.queue_mt_message(frags[0], ring=False)
+        self.qm.get_messages(ack_ring=False)
+        self.assertEqual(mailboxes.list_recipients('local'), [])
+
+        self.emulator.queue_mt_message(frags[1], ring=False)
+        self.qm.get_messages(ack_ring=False)
+        thread = mailboxes.get_thread('local', '+14158008000')
+        self.assertEqual([m.body for m in thread], ['y' * 700])
@@ -0,0 +1,143 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import json
+import os
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from holonet import mailbox_cache
+from holonet.mailbox_cache import MailboxCache
+from holonet.message import Message
+
+
+class TestMailboxCache(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.loads = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    def _write(self, dirname, filename, body):
+        path = os.path.join(self.tmpdir, dirname)
+        os.makedirs(path, exist_ok=True)
+        msg = Message()
+        msg.body = body
+        with open(os.path.join(path, filename), 'w') as f:
+            f.write(msg.to_json_str())
+        # Make sure that the change shows, even with a coarse clock.
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000))
+        return (path, msg)
+
+
+    def _read(self, cache, path, filenames=None):
+        real_load = json.load
+
+        def load(f):
+            self.loads += 1
+            return real_load(f)
+
+        with patch.object(mailbox_cache.json, 'load', load):
+            return [m.body for m in cache.read(path, filenames)]
+
+
+    def test_read(self):
+        cache = MailboxCache()
+        (path, _) = self._write('a', '1.json', 'One')
+        self._write('a', '2.json', 'Two')
+
+        self.assertEqual(self._read(cache, path, ['2.json']), ['Two'])
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self._read(cache, path), ['One', 'Two'])
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(self._read(cache, path), ['One', 'Two'])
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(cache.filenames(path), ['1.json', '2.json'])
+
+        # Callers get their own copies.
+        cache.read(path)[0].body = 'Changed'
+        self.assertEqual(self._read(cache, path), ['One', 'Two'])
+
+
+    def test_external_change(self):
+        cache = MailboxCache()
+        (path, _) = self._write('a', '1.json', 'One')
+        self.assertEqual(self._read(cache, path), ['One'])
+        self._write('a', '2.json', 'Two')
+        self.assertEqual(self._read(cache, path), ['One', 'Two'])
+        self.assertEqual(self.loads, 3)
+
+        shutil.rmtree(path)
+        self.assertEqual(self._read(cache, path), [])
+        self.assertEqual(len(cache), 0)
+
+
+    def test_put(self):
+        cache = MailboxCache()
+        (path, _) = self._write('a', '1.json', 'One')
+        self.assertEqual(self._read(cache, path), ['One'])
+        (_, msg) = self._write('a', '0.json', 'Zero')
+        cache.put(path, '0.json', msg)
+        msg.body = 'Changed'
+        self.assertEqual(self._read(cache, path), ['Zero', 'One'])
+        self.assertEqual(self.loads, 1)
+
+        cache.invalidate(path)
+        self.assertEqual(self._read(cache, path), ['Zero', 'One'])
+        self.assertEqual(self.loads, 3)
+
+
+    def test_evict(self):
+        cache = MailboxCache(max_messages=3)
+        (a, _) = self._write('a', '1.json', 'A1')
+        self._write('a', '2.json', 'A2')
+        (b, _) = self._write('b', '1.json', 'B1')
+        self._read(cache, a)
+        self._read(cache, b)
+        self.assertEqual(len(cache), 3)
+        self._read(cache, a)
+        (c, _) = self._write('c', '1.json', 'C1')
+        self._read(cache, c)
+        # b was the least recently used.
+        self.assertEqual(len(cache), 3)
+        self.loads = 0
+        self._read(cache, a)
+        self._read(cache, c)
+        self.assertEqual(self.loads, 0)
+        self._read(cache, b)
+        self.assertEqual(self.loads, 1)
@@ -0,0 +1,316 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from holonet import mailbox_store, mailboxes
+from holonet.mailbox_store import BACKEND_DIRECTORY, BACKEND_SQLITE, \
+    DirectoryStore
+from holonet.message import Message
+
+
+class MailboxesTests(object):
+    # pylint: disable=no-member
+    backend = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(mailboxes, 'mailboxes_root', self.tmpdir),
+            patch.object(mailboxes, 'storage_backend', self.backend),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        mailboxes.close_store()
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_threads(self):
+        mailboxes.queue_message_send('local', '+14158008000', 'Out')
+        mailboxes.save_message_to_inbox(b'+14158008001:In')
+        self.assertEqual(len(mailboxes.read_inbox()), 1)
+        mailboxes.accept_all_inbox_messages()
+        self.assertEqual(mailboxes.read_inbox(), [])
+
+        self.assertEqual(mailboxes.list_recipients('local'),
+                         ['+14158008000', '+14158008001'])
+        (out,) = mailboxes.get_thread('local', '+14158008000')
+        self.assertEqual(out.body, 'Out')
+        self.assertTrue(out.not_yet_sent)
+        (in_,) = mailboxes.get_thread('local', '+14158008001')
+        self.assertEqual((in_.sender, in_.body), ('+14158008001', 'In'))
+        self.assertIsNone(in_.not_yet_sent)
+
+        mailboxes.delete_thread('local', '+14158008001')
+        self.assertEqual(mailboxes.list_recipients('local'),
+                         ['+14158008000'])
+        self.assertEqual(mailboxes.get_thread('local', '+14158008001'), [])
+
+
+    def test_outbox(self):
+        mailboxes.queue_message_send('local', '+14158008000', 'One')
+        mailboxes.queue_message_send('local', '+14158008000', 'Two')
+        (one, two) = mailboxes.read_outbox()
+        self.assertEqual(mailboxes.outbox_size(), 2)
+
+        one.attempts = 1
+        mailboxes.update_outbox_message(one)
+        self.assertEqual(mailboxes.read_outbox()[0].attempts, 1)
+
+        mailboxes.remove_from_outbox(one.filename)
+        mailboxes.move_to_dead_letter(two, 'Broken')
+        self.assertEqual(mailboxes.read_outbox(), [])
+        self.assertEqual([m.body for m in mailboxes.read_dead_letter()],
+                         ['Two'])
+        thread = mailboxes.get_thread('local', '+14158008000')
+        self.assertEqual([(m.body, m.failed, m.not_yet_sent)
+                          for m in thread],
+                         [('One', None, None), ('Two', 'Broken', None)])
+
+
+    def test_thread_pages(self):
+        for i in range(5):
+            mailboxes.save_message_to_inbox(
+                ('+14158008001:%d' % i).encode('utf-8'))
+            time.sleep(0.002)
+        mailboxes.accept_all_inbox_messages()
+        mailboxes.queue_message_send('local', '+14158008001', '5')
+
+        (page, older) = mailboxes.get_thread_page('local', '+14158008001', 2)
+        self.assertEqual([m.body for m in page], ['4', '5'])
+        self.assertTrue(page[1].not_yet_sent)
+        (page, older) = mailboxes.get_thread_page('local', '+14158008001', 2,
+                                                  before=older)
+        self.assertEqual([m.body for m in page], ['2', '3'])
+        (page, older) = mailboxes.get_thread_page('local', '+14158008001', 2,
+                                                  before=older)
+        self.assertEqual([m.body for m in page], ['0', '1'])
+        self.assertIsNone(older)
+
+        (page, older) = mailboxes.get_thread_page('local', '+14158008001', 6)
+        self.assertEqual([m.body for m in page], [str(i) for i in range(6)])
+        self.assertIsNone(older)
+        self.assertEqual(mailboxes.get_thread_page('local', '+1415800800'),
+                         ([], None))
+
+
+    def test_thread_page_reads_only_the_page(self):
+        for i in range(5):
+            mailboxes.save_message_to_inbox(
+                ('+14158008001:%d' % i).encode('utf-8'))
+            time.sleep(0.002)
+        mailboxes.accept_all_inbox_messages()
+        # Start with nothing cached.
+        mailboxes.close_store()
+
+        read = []
+        real_loads = json.loads
+
+        def loads(s, *args, **kwargs):
+            read.append(s)
+            return real_loads(s, *args, **kwargs)
+
+        with patch('json.loads', loads), \
+                patch('json.load', lambda f: loads(f.read())):
+            (page, _) = mailboxes.get_thread_page('local', '+14158008001', 2)
+        self.assertEqual(len(read), 2)
+
+
+    def test_bad_cursor(self):
+        for cursor in ('!!!', 'Li4vZm9v', ''):
+            self.assertRaises(ValueError, mailboxes.get_thread_page,
+                              'local', '+14158008001', before=cursor)
+
+
+    def test_transaction(self):
+        store = mailboxes._store()
+        msg = Message()
+        msg.recipient = '+14158008000'
+        msg.body = 'Out'
+
+        with self.assertRaises(KeyError):
+            with store.transaction():
+                store.put_outbox('1.json', msg)
+                store.put_thread_message('local', '+14158008000', '1.json',
+                                         msg)
+                raise KeyError()
+        self.assertEqual(store.read_outbox(), [])
+        self.assertEqual(store.read_thread('local', '+14158008000'), [])
+
+        with store.transaction():
+            store.put_outbox('1.json', msg)
+            with store.transaction():
+                store.put_thread_message('local', '+14158008000', '1.json',
+                                         msg)
+        self.assertEqual([m.body for m in store.read_outbox()], ['Out'])
+        self.assertEqual(
+            [m.body for m in store.read_thread('local', '+14158008000')],
+            ['Out'])
+
+
+    def test_accept_burst(self):
+        for i in range(50):
+            mailboxes.save_message_to_inbox(
+                ('+14158008001:%d' % i).encode('utf-8'))
+        self.assertEqual(len(mailboxes.accept_all_inbox_messages()), 50)
+        self.assertEqual(mailboxes.read_inbox(), [])
+        self.assertEqual(
+            [m.body for m in mailboxes.get_thread('local', '+14158008001')],
+            [str(i) for i in range(50)])
+        (summary,) = mailboxes.list_threads('local')
+        self.assertEqual(summary.unread, 50)
+
+
+    def test_accept_malformed(self):
+        mailboxes.save_message_to_inbox(b'No sender here')
+        time.sleep(0.002)
+        mailboxes.save_message_to_inbox(b'../../etc:Sneaky')
+        time.sleep(0.002)
+        mailboxes.save_message_to_inbox(b'+14158008001:Fine')
+        with self.assertLogs('holonet.mailboxes', 'WARNING'):
+            accepted = mailboxes.accept_all_inbox_messages()
+        self.assertEqual([m.body for m in accepted], ['Fine'])
+        # The bad ones don't get in the way next time either.
+        with self.assertLogs('holonet.mailboxes', 'WARNING'):
+            self.assertEqual(mailboxes.accept_all_inbox_messages(), [])
+        self.assertEqual(mailboxes.list_recipients('local'),
+                         ['+14158008001'])
+        self.assertEqual([m['data'] for m in mailboxes.read_inbox()],
+                         ['No sender here', '../../etc:Sneaky'])
+
+
+class TestDirectoryStore(MailboxesTests, TestCase):
+    backend = BACKEND_DIRECTORY
+
+
+    def test_accept_burst_fsyncs(self):
+        for i in range(20):
+            mailboxes.save_message_to_inbox(
+                ('+14158008001:%d' % i).encode('utf-8'))
+        mailboxes.list_threads('local')
+
+        real_fsync = os.fsync
+        fsyncs = []
+
+        def fsync(fd):
+            fsyncs.append(fd)
+            real_fsync(fd)
+
+        with patch('os.fsync', fsync):
+            mailboxes.accept_all_inbox_messages()
+        # Just the transaction journal.
+        self.assertEqual(len(fsyncs), 1)
+
+
+    def test_recover(self):
+        msg = Message()
+        msg.recipient = '+14158008000'
+        msg.body = 'Out'
+        store = DirectoryStore(self.tmpdir)
+        # Lose power after the commit, before any of it is applied.
+        with patch.object(DirectoryStore, '_apply'):
+            with store.transaction():
+                store.put_outbox('1.json', msg)
+                store.put_thread_message('local', '+14158008000', '1.json',
+                                         msg)
+        store._journal.close()
+        journal = os.path.join(self.tmpdir, mailbox_store.TRANSACTION_JOURNAL)
+        with open(journal, 'ab') as f:
+            f.write(b'[{"op":"outbox_del","filen')
+
+        store = DirectoryStore(self.tmpdir)
+        self.assertEqual([m.body for m in store.read_outbox()], ['Out'])
+        self.assertEqual(
+            [m.body for m in store.read_thread('local', '+14158008000')],
+            ['Out'])
+        self.assertEqual(os.path.getsize(journal), 0)
+        store.close()
+
+
+    @patch.object(mailbox_store, 'CHECKPOINT_TRANSACTIONS', 3)
+    def test_checkpoint(self):
+        journal = os.path.join(self.tmpdir, mailbox_store.TRANSACTION_JOURNAL)
+        # That's one transaction to save the (empty) thread summaries.
+        mailboxes.list_threads('local')
+        for i in range(4):
+            mailboxes.queue_message_send('local', '+14158008000', str(i))
+            time.sleep(0.002)
+        with open(journal, 'rb') as f:
+            self.assertEqual(len(f.readlines()), 2)
+        mailboxes.close_store()
+        self.assertEqual(os.path.getsize(journal), 0)
+        self.assertEqual(len(mailboxes.read_outbox()), 4)
+
+
+class TestSQLiteStore(MailboxesTests, TestCase):
+    backend = BACKEND_SQLITE
+
+
+    def test_migrate(self):
+        with patch.object(mailboxes, 'storage_backend', BACKEND_DIRECTORY):
+            mailboxes.queue_message_send('local', '+14158008000', 'Out')
+            mailboxes.save_message_to_inbox(b'+14158008001:In')
+            mailboxes.accept_all_inbox_messages()
+            mailboxes.save_message_to_inbox(b'+14158008001:Unread')
+            mailboxes.close_store()
+
+        self.assertEqual(mailboxes.list_recipients('local'),
+                         ['+14158008000', '+14158008001'])
+        self.assertEqual([m.body for m in mailboxes.read_outbox()], ['Out'])
+        self.assertTrue(
+            mailboxes.get_thread('local', '+14158008000')[0].not_yet_sent)
+        self.assertEqual([m['data'] for m in mailboxes.read_inbox()],
+                         ['+14158008001:Unread'])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmpdir, mailbox_store.SQLITE_DB)))
+
+        # It's one-shot: the old files are ignored from now on.
+        mailboxes.delete_thread('local', '+14158008001')
+        mailboxes.close_store()
+        self.assertEqual(mailboxes.list_recipients('local'),
+                         ['+14158008000'])
+
+
+    def test_bad_backend(self):
+        self.assertRaises(ValueError, mailbox_store.open_store, 'nfs',
+                          self.tmpdir)
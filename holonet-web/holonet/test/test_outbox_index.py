@@ -0,0 +1,141 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import os
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from holonet import mailbox_store, mailboxes, outbox_index
+from holonet.message import Message
+from holonet.outbox_index import OutboxIndex
+
+
+def _msg(body):
+    msg = Message()
+    msg.recipient = '+14158008000'
+    msg.body = body
+    return msg
+
+
+class TestOutboxIndex(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'outbox', 'journal')
+        self.index = OutboxIndex(self.path).load()
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmpdir)
+
+
+    def _reload(self):
+        self.index.close()
+        self.index = OutboxIndex(self.path).load()
+
+
+    def test_replay(self):
+        self.index.put('b.json', _msg('B'))
+        self.index.put('a.json', _msg('A'))
+        self.index.put('c.json', _msg('C'))
+        self.assertTrue(self.index.remove('b.json'))
+        self.assertFalse(self.index.remove('b.json'))
+        msg = self.index.get('a.json')
+        msg.attempts = 1
+        self.index.put(msg.filename, msg)
+
+        # The index hands out copies.
+        self.index.get('c.json').body = 'Changed'
+
+        self._reload()
+        self.assertEqual(len(self.index), 2)
+        self.assertIn('a.json', self.index)
+        self.assertNotIn('b.json', self.index)
+        self.assertEqual([(m.filename, m.body, m.attempts)
+                          for m in self.index.messages()],
+                         [('a.json', 'A', 1), ('c.json', 'C', None)])
+
+
+    def test_torn_append(self):
+        self.index.put('a.json', _msg('A'))
+        self.index.close()
+        with open(self.path, 'ab') as f:
+            f.write(b'{"op":"put","filename":"b.js')
+
+        self.index = OutboxIndex(self.path).load()
+        self.assertEqual([m.filename for m in self.index.messages()],
+                         ['a.json'])
+        self.index.put('c.json', _msg('C'))
+        self._reload()
+        self.assertEqual([m.filename for m in self.index.messages()],
+                         ['a.json', 'c.json'])
+
+
+    @patch.object(outbox_index, 'COMPACT_MIN_RECORDS', 10)
+    def test_compact(self):
+        for i in range(20):
+            self.index.put('%02d.json' % i, _msg(str(i)))
+            if i != 7:
+                self.index.remove('%02d.json' % i)
+        with open(self.path, 'rb') as f:
+            self.assertLess(len(f.read().splitlines()), 10)
+
+        self._reload()
+        self.assertEqual([m.body for m in self.index.messages()], ['7'])
+
+
+class TestOutboxMigration(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.old_root = mailboxes.mailboxes_root
+        mailboxes.mailboxes_root = self.tmpdir
+
+    def tearDown(self):
+        mailboxes.mailboxes_root = self.old_root
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_legacy_files(self):
+        outbox_path = os.path.join(self.tmpdir, 'outbox')
+        os.makedirs(outbox_path)
+        for (fname, body) in (('2.json', 'Two'), ('1.json', 'One')):
+            with open(os.path.join(outbox_path, fname), 'w') as f:
+                f.write(_msg(body).to_json_str())
+
+        self.assertEqual([m.body for m in mailboxes.read_outbox()],
+                         ['One', 'Two'])
+        self.assertEqual(os.listdir(outbox_path),
+                         [mailbox_store.OUTBOX_JOURNAL])
+        mailboxes.remove_from_outbox('1.json')
+        self.assertEqual(mailboxes.outbox_size(), 1)
@@ -0,0 +1,102 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from holonet import mailboxes, queue_manager
+from holonet.message import Message, PRIORITY_EMERGENCY, PRIORITY_HIGH, \
+    PRIORITY_LOW
+from holonet.test.queue_manager_tests import QueueManagerTests
+from holonet.utils import utc_str
+
+
+def _msg(priority=None, fragments_sent=None, expires_at=None):
+    msg = Message()
+    msg.priority = priority
+    msg.fragments_sent = fragments_sent
+    msg.expires_at = expires_at
+    return msg
+
+
+class TestSendOrder(TestCase):
+    def test_order(self):
+        soon = utc_str(datetime.utcnow() + timedelta(minutes=5))
+        later = utc_str(datetime.utcnow() + timedelta(hours=5))
+        oldest = _msg()
+        msgs = [
+            oldest,
+            _msg(expires_at=later),
+            _msg(fragments_sent=1, expires_at=soon),
+            _msg(priority=PRIORITY_LOW),
+            _msg(expires_at=soon),
+            _msg(priority=PRIORITY_HIGH, fragments_sent=2),
+            _msg(priority=PRIORITY_EMERGENCY),
+        ]
+        result = sorted(msgs, key=queue_manager._send_order)
+        self.assertEqual(result, [msgs[6], msgs[5], msgs[4], msgs[1],
+                                  oldest, msgs[2], msgs[3]])
+
+
+class TestOutboxPriority(QueueManagerTests, TestCase):
+    def test_expire(self):
+        mailboxes.queue_message_send('local', '+14158008000', 'Stale',
+                                     priority=PRIORITY_HIGH, ttl=60)
+        mailboxes.queue_message_send('local', '+14158008000', 'Forever')
+        (stale, forever) = mailboxes.read_outbox()
+        self.assertEqual(stale.priority, PRIORITY_HIGH)
+        self.assertEqual(stale.priority_label, 'High')
+        self.assertIsNone(forever.priority)
+        self.assertIsNone(forever.expires_at)
+
+        self.assertEqual(mailboxes.expire_outbox(), [])
+        now = datetime.utcnow() + timedelta(seconds=61)
+        expired = mailboxes.expire_outbox(now)
+        self.assertEqual([m.body for m in expired], ['Stale'])
+        self.assertEqual([m.body for m in mailboxes.read_outbox()],
+                         ['Forever'])
+        thread = mailboxes.get_thread('local', '+14158008000')
+        self.assertEqual([(m.body, m.expired) for m in thread],
+                         [('Stale', True), ('Forever', None)])
+
+
+    def test_emergency_first(self):
+        for i in range(3):
+            mailboxes.queue_message_send('local', '+14158008000',
+                                         'Chat %d' % i, priority=PRIORITY_LOW)
+        mailboxes.queue_message_send('local', '+14158008000', 'SOS',
+                                     priority=PRIORITY_EMERGENCY)
+        self.qm.check_outbox()
+
+        self.assertEqual(self.emulator.mo_sent[0], b'+14158008000:SOS')
+        self.assertEqual(len(self.emulator.mo_sent), 4)
+        self.assertEqual(mailboxes.read_outbox(), [])
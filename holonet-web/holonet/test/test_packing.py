@@ -0,0 +1,88 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+from unittest import TestCase
+
+from holonet import packing
+from holonet.packing import PackingException, pack, pack_greedy, unpack
+from holonet.rockblock_emulator import run_benchmark
+
+
+class TestPacking(TestCase):
+    def test_round_trip(self):
+        records = [b'+14158008000:Hi', b'+14158008000:', b'+1:' + b'x' * 252]
+        payload = pack(records)
+        self.assertTrue(packing.is_packed(payload))
+        self.assertEqual(unpack(payload), records)
+        self.assertEqual(unpack(pack([])), [])
+
+
+    def test_legacy(self):
+        self.assertFalse(packing.is_packed(b'+14158008000:Hi'))
+        self.assertEqual(unpack(b'+14158008000:Hi'), [b'+14158008000:Hi'])
+        self.assertEqual(unpack(b''), [b''])
+
+
+    def test_greedy(self):
+        records = [b'+14158008000:%02d' % i for i in range(30)]
+        # 2 bytes of header, then 1 + 15 bytes per record.
+        (payload, count) = pack_greedy(records)
+        self.assertEqual(count, (packing.MAX_PAYLOAD - 2) // 16)
+        self.assertLessEqual(len(payload), packing.MAX_PAYLOAD)
+        self.assertEqual(unpack(payload), records[:count])
+
+        # It stops at the first record that doesn't fit, to keep the order.
+        (payload, count) = pack_greedy([b'a', b'b' * 300, b'c'])
+        self.assertEqual((payload, count), (b'a', 1))
+
+
+    def test_greedy_single(self):
+        self.assertEqual(pack_greedy([]), (None, 0))
+        self.assertEqual(pack_greedy([b'+1:Hi']), (b'+1:Hi', 1))
+        big = b'+1:' + b'x' * 300
+        self.assertEqual(pack_greedy([big, b'+1:Hi']), (big, 1))
+
+
+    def test_malformed(self):
+        self.assertRaises(PackingException, pack, [b'x' * 256])
+        self.assertRaises(PackingException, unpack, b'\xfe')
+        self.assertRaises(PackingException, unpack, b'\xfe\x09\x01a')
+        self.assertRaises(PackingException, unpack, b'\xfe\x01\x05abc')
+
+
+    def test_benchmark(self):
+        unpacked = run_benchmark(20, 0, seed=1)
+        packed = run_benchmark(20, 0, pack=True, seed=1)
+        self.assertEqual(unpacked['outbox_left'], 0)
+        self.assertEqual(packed['outbox_left'], 0)
+        self.assertEqual(unpacked['mo_sent'], 20)
+        self.assertEqual(packed['mo_sent'], 3)
@@ -0,0 +1,166 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import json
+import os
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from holonet import port_discovery
+from holonet.rockblock_emulator import RockBlockEmulator
+
+
+class TestPortDiscovery(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmpdir, 'rockblock_port.json')
+        patcher = patch.object(port_discovery, 'cache_file', self.cache_file)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.emulator = RockBlockEmulator(imei='300234010000001').start()
+        self.other = RockBlockEmulator(imei='300234010000002').start()
+        (self.dead_master, dead_slave) = os.openpty()
+        self.dead = os.ttyname(dead_slave)
+        self.addCleanup(os.close, dead_slave)
+
+    def tearDown(self):
+        self.emulator.stop()
+        self.other.stop()
+        os.close(self.dead_master)
+        shutil.rmtree(self.tmpdir)
+
+    def read_cache(self):
+        with open(self.cache_file, 'r') as f:
+            return json.load(f)
+
+
+    def test_probe(self):
+        self.assertEqual(port_discovery.probe(self.emulator.device),
+                         '300234010000001')
+        self.assertIsNone(port_discovery.probe(self.dead, timeout=0.1))
+        self.assertIsNone(port_discovery.probe('/dev/does-not-exist'))
+
+
+    def test_probe_cold(self):
+        self.emulator.ignore_commands = 1
+        self.assertEqual(port_discovery.probe(self.emulator.device),
+                         '300234010000001')
+
+
+    def test_cached_port_slow_to_wake(self):
+        with open(self.cache_file, 'w') as f:
+            json.dump({'port': self.emulator.device,
+                       'imei': '300234010000001'}, f)
+        # Enough to fail the first probe, but not the rescan.
+        self.emulator.ignore_commands = port_discovery.PROBE_AT_ATTEMPTS
+        with patch.object(port_discovery, 'candidate_ports',
+                          return_value=[self.dead]):
+            self.assertEqual(port_discovery.find_rockblock(),
+                             self.emulator.device)
+
+
+    def test_find_and_cache(self):
+        ports = [self.dead, self.emulator.device]
+        with patch.object(port_discovery, 'candidate_ports',
+                          return_value=ports):
+            self.assertEqual(port_discovery.find_rockblock(),
+                             self.emulator.device)
+        self.assertEqual(self.read_cache(), {
+            'port': self.emulator.device,
+            'imei': '300234010000001',
+        })
+
+        # Next time, the cached port is used without scanning.
+        with patch.object(port_discovery, 'candidate_ports') as candidates:
+            self.assertEqual(port_discovery.find_rockblock(),
+                             self.emulator.device)
+            candidates.assert_not_called()
+
+
+    def test_stale_cache(self):
+        with open(self.cache_file, 'w') as f:
+            json.dump({'port': self.dead, 'imei': '300234010000002'}, f)
+
+        # The cached port is dead, so scan, and prefer the modem that we
+        # saw before.
+        ports = [self.emulator.device, self.other.device]
+        with patch.object(port_discovery, 'candidate_ports',
+                          return_value=ports):
+            self.assertEqual(port_discovery.find_rockblock(),
+                             self.other.device)
+
+
+    def test_bad_cache(self):
+        with open(self.cache_file, 'w') as f:
+            json.dump([self.emulator.device], f)
+        with patch.object(port_discovery, 'candidate_ports',
+                          return_value=[self.emulator.device]):
+            self.assertEqual(port_discovery.find_rockblock(),
+                             self.emulator.device)
+
+
+    def test_not_found(self):
+        with patch.object(port_discovery, 'candidate_ports',
+                          return_value=[self.dead]):
+            self.assertIsNone(port_discovery.find_rockblock())
+        self.assertFalse(os.path.exists(self.cache_file))
+
+
+    def test_is_possible_modem(self):
+        sysfs = os.path.join(self.tmpdir, 'sys')
+
+        def mk(name, device, port_type=None):
+            path = os.path.join(sysfs, name)
+            os.makedirs(path)
+            if device:
+                os.makedirs(os.path.join(path, 'device'))
+            if port_type is not None:
+                with open(os.path.join(path, 'type'), 'w') as f:
+                    f.write('%s\n' % port_type)
+
+        mk('tty1', False)
+        mk('ttyS0', True, 4)
+        mk('ttyS1', True, 0)
+        mk('ttyUSB0', True)
+
+        def t(name, e):
+            self.assertEqual(port_discovery.is_possible_modem(name, sysfs), e)
+
+        t('tty1', False)
+        t('ttyS0', True)
+        t('ttyS1', False)
+        t('ttyUSB0', True)
+        t('ttyACM0', False)
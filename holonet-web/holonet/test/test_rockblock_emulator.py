@@ -0,0 +1,353 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+import serial
+
+from holonet import rockblock
+from holonet.rockblock_emulator import DEFAULT_IMEI, RockBlockEmulator
+
+
+class Recorder(rockblock.RockBlockProtocol):
+    def __init__(self):
+        self.signals = []
+        self.received = []
+        self.tx_success = []
+        self.tx_failed = []
+        self.mt_queued = []
+        self.rings = 0
+        self.outbox = []
+        self.loaded = None
+
+    def rockBlockNextMoMessage(self):
+        self.loaded = self.outbox[0] if self.outbox else None
+        return self.loaded
+
+    def rockBlockRingAlert(self):
+        self.rings += 1
+
+    def rockBlockSignalUpdate(self, signal):
+        self.signals.append(signal)
+
+    def rockBlockRxReceived(self, mtmsn, data):
+        self.received.append((mtmsn, data))
+
+    def rockBlockRxMessageQueue(self, count):
+        self.mt_queued.append(count)
+
+    def rockBlockTxSuccess(self, momsn):
+        self.tx_success.append(momsn)
+        if self.loaded is not None:
+            self.outbox.remove(self.loaded)
+            self.loaded = None
+
+    def rockBlockTxFailed(self, moStatus):
+        self.tx_failed.append(moStatus)
+
+
+class TestRockBlockEmulator(TestCase):
+    def setUp(self):
+        self.emulator = RockBlockEmulator(seed=1).start()
+        self.recorder = Recorder()
+        self.rb = rockblock.RockBlock(self.emulator.device, self.recorder)
+
+    def tearDown(self):
+        self.rb.close()
+        self.emulator.stop()
+
+
+    def test_connect(self):
+        self.assertTrue(self.emulator.ring_alerts)
+        self.assertEqual(self.rb.getSerialIdentifier(), DEFAULT_IMEI)
+
+
+    def test_signal(self):
+        self.emulator.signal = 3
+        self.assertEqual(self.rb.requestSignalStrength(), 3)
+        self.emulator.signal = lambda: 1
+        self.assertEqual(self.rb.requestSignalStrength(), 1)
+        self.assertEqual(self.recorder.signals, [3, 1])
+
+
+    def test_send(self):
+        self.assertTrue(self.rb.sendMessage(b'+14158008000:Hi'))
+        self.assertEqual(self.emulator.mo_sent, [b'+14158008000:Hi'])
+        self.assertEqual(self.recorder.tx_success, [1])
+        self.assertIsNone(self.emulator.mo_buffer)
+
+
+    def test_receive(self):
+        self.emulator.queue_mt_message(b'+14158008000:One')
+        self.emulator.queue_mt_message(b'+14158008000:Two')
+        self.assertTrue(self.rb.messageCheck(ack_ring=True))
+        self.assertEqual([data for (_, data) in self.recorder.received],
+                         [b'+14158008000:One', b'+14158008000:Two'])
+        self.assertEqual(self.emulator.mt_queue_length(), 0)
+        self.assertEqual(self.emulator.stats['SBDRING'], 2)
+        self.assertEqual(self.recorder.rings, 2)
+
+
+    def test_piggyback(self):
+        # Three messages each way should take three sessions, not six.
+        self.recorder.outbox = [b'+14158008000:Out %d' % i for i in range(3)]
+        for i in range(3):
+            self.emulator.queue_mt_message(b'+14158008000:In %d' % i,
+                                           ring=False)
+        self.assertTrue(self.rb.messageCheck(ack_ring=False))
+        self.assertEqual(self.emulator.mo_sent,
+                         [b'+14158008000:Out %d' % i for i in range(3)])
+        self.assertEqual(len(self.recorder.received), 3)
+        self.assertEqual(self.recorder.outbox, [])
+        self.assertEqual(self.recorder.tx_success, [1, 2, 3])
+        self.assertEqual(self.emulator.stats['sessions'], 3)
+
+
+    def test_piggyback_after_send(self):
+        # The rest of the outbox follows an explicit send.
+        self.recorder.outbox = [b'+14158008000:Two']
+        self.assertTrue(self.rb.sendMessage(b'+14158008000:One'))
+        self.assertEqual(self.emulator.mo_sent,
+                         [b'+14158008000:One', b'+14158008000:Two'])
+        self.assertEqual(self.emulator.stats['sessions'], 2)
+
+
+    def test_receive_drain(self):
+        for i in range(5):
+            self.emulator.queue_mt_message(b'+14158008000:%d' % i)
+        self.assertTrue(self.rb.messageCheck(ack_ring=True))
+        self.assertEqual(len(self.recorder.received), 5)
+        self.assertEqual(self.recorder.mt_queued, [4, 3, 2, 1, 0])
+        self.assertEqual(self.emulator.stats['sessions'], 5)
+        # One signal check before the first session, and none while
+        # draining.
+        self.assertEqual(self.emulator.stats['AT+CSQ'], 1)
+        self.assertEqual(self.emulator.stats['AT+SBDIXA'], 1)
+
+
+    @patch.object(rockblock, 'SESSION_RETRY_DELAY', 0)
+    def test_receive_drain_failure(self):
+        for i in range(3):
+            self.emulator.queue_mt_message(b'+14158008000:%d' % i)
+        results = iter([5, 5, 0])
+        self.emulator.signal = lambda: next(results, 5)
+        self.assertTrue(self.rb.messageCheck(ack_ring=True))
+        # The session after the first drops, which makes the driver check
+        # the signal again before carrying on.
+        self.assertEqual(len(self.recorder.received), 3)
+        self.assertEqual(self.emulator.stats['failed_sessions'], 1)
+        self.assertEqual(self.emulator.stats['AT+CSQ'], 2)
+
+
+    def test_ring_before_read(self):
+        # A ring that's waiting when we read the MT buffer isn't lost.
+        self.emulator.inject(b'SBDRING\r\n')
+        time.sleep(0.1)
+        self.assertEqual(self.rb._readMtBuffer(), b'')
+        self.assertEqual(self.recorder.rings, 1)
+
+
+    def test_receive_binary(self):
+        # Newlines, trailing whitespace and a checksum over 16 bits must all
+        # survive the trip.
+        payload = b'\x00\r\n\xff' * 80 + b'OK\r\n \t'
+        self.emulator.queue_mt_message(payload)
+        self.assertTrue(self.rb.messageCheck(ack_ring=True))
+        self.assertEqual(self.recorder.received, [(1, payload)])
+
+
+    def test_receive_bad_checksum(self):
+        self.emulator.queue_mt_message(b'+14158008000:One')
+        self.emulator.sbdrb_corruptions = 1
+        self.assertTrue(self.rb.messageCheck(ack_ring=True))
+        self.assertEqual(self.recorder.received, [(1, b'+14158008000:One')])
+        self.assertEqual(self.emulator.stats['AT+SBDRB'], 2)
+
+        self.emulator.queue_mt_message(b'+14158008000:Two')
+        self.emulator.sbdrb_corruptions = rockblock.MT_READ_ATTEMPTS
+        self.rb.messageCheck(ack_ring=True)
+        self.assertEqual(len(self.recorder.received), 1)
+
+
+    def test_send_large(self):
+        msg = b'\xff' * 340
+        self.assertTrue(self.rb.sendMessage(msg))
+        self.assertEqual(self.emulator.mo_sent, [msg])
+
+
+    @patch.object(rockblock, 'RESCAN_DELAY', 0)
+    def test_send_no_signal(self):
+        self.emulator.signal = 0
+        self.assertFalse(self.rb.sendMessage(b'+14158008000:Hi'))
+        self.assertEqual(self.emulator.mo_sent, [])
+        self.assertEqual(self.emulator.stats['AT+CSQ'],
+                         rockblock.SIGNAL_ATTEMPTS)
+
+
+    @patch.object(rockblock, 'SESSION_RETRY_DELAY', 0)
+    def test_session_failure(self):
+        self.emulator.session_failure_rate = 1.0
+        self.assertFalse(self.rb.sendMessage(b'+14158008000:Hi'))
+        # One set of retries, and one failure reported.
+        self.assertEqual(self.emulator.stats['sessions'],
+                         rockblock.SESSION_ATTEMPTS)
+        self.assertEqual(self.recorder.tx_failed, [18])
+        self.assertEqual(self.emulator.mo_sent, [])
+
+
+    @patch.object(rockblock, 'SESSION_RETRY_DELAY', 0.1)
+    @patch.object(rockblock, 'RESCAN_DELAY', 0)
+    def test_session_retry(self):
+        # The first session fails; the retry waits, and checks the signal
+        # again first.
+        results = iter([5, 0])
+        self.emulator.signal = lambda: next(results, 5)
+        start = time.monotonic()
+        self.assertTrue(self.rb.sendMessage(b'+14158008000:Hi'))
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(self.emulator.stats['failed_sessions'], 1)
+        self.assertEqual(self.emulator.stats['sessions'], 2)
+        self.assertEqual(self.emulator.stats['AT+CSQ'], 2)
+        self.assertEqual(self.emulator.mo_sent, [b'+14158008000:Hi'])
+
+        # No retry once the signal has gone.
+        results = iter([5])
+        self.emulator.signal = lambda: next(results, 0)
+        self.assertFalse(self.rb.messageCheck(ack_ring=False))
+        self.assertEqual(self.emulator.stats['sessions'], 3)
+        self.assertEqual(self.emulator.stats['AT+CSQ'],
+                         3 + rockblock.SIGNAL_ATTEMPTS)
+
+
+    @patch.object(rockblock, 'SESSION_RETRY_DELAY', 0)
+    def test_session_bad_echo(self):
+        # The session runs, but we lose its echo.  It mustn't be resent,
+        # either as part of the resync or by _attemptSession, because the
+        # MOMSN shows that the message went.
+        self.emulator.echo_corruptions['AT+SBDIX'] = 1
+        with patch.object(self.rb, '_send_command',
+                          wraps=self.rb._send_command) as send:
+            self.assertTrue(self.rb.sendMessage(b'+14158008000:Hi'))
+        retries = [c for c in send.call_args_list
+                   if c[0][0] == b'AT+SBDIX' and c[1].get('retry')]
+        self.assertEqual(retries, [])
+        self.assertEqual(self.emulator.stats['sessions'], 1)
+        self.assertEqual(self.emulator.mo_sent, [b'+14158008000:Hi'])
+        self.assertEqual(self.recorder.tx_failed, [])
+        self.assertEqual(self.recorder.tx_success, [1])
+        self.assertIsNone(self.emulator.mo_buffer)
+
+
+    @patch.object(rockblock, 'SESSION_RETRY_DELAY', 0)
+    @patch.object(rockblock, 'RESYNC_SCHEDULE', (0,))
+    def test_session_lost(self):
+        # The session command never reaches the modem, so it's retried.
+        self.emulator.lost_commands['AT+SBDIX'] = 1
+        self.rb.command_timeout = 0.5
+        self.assertTrue(self.rb.sendMessage(b'+14158008000:Hi'))
+        self.assertEqual(self.emulator.stats['sessions'], 1)
+        self.assertEqual(self.emulator.stats['AT+SBDSX'], 2)
+        self.assertEqual(self.emulator.mo_sent, [b'+14158008000:Hi'])
+        self.assertEqual(self.recorder.tx_success, [1])
+
+
+    def test_session_mo_buffer_lost(self):
+        # The modem resets (and empties its MO buffer) under the session.
+        def reset():
+            self.emulator.mo_buffer = None
+        self.assertTrue(self.rb._queueMessage(b'+14158008000:Hi'))
+        with patch.object(self.rb, '_session',
+                          side_effect=lambda ack_ring: reset()):
+            self.assertFalse(self.rb._attemptSession(mo_loaded=True))
+        self.assertEqual(self.recorder.tx_failed, [-1])
+        self.assertEqual(self.emulator.stats['sessions'], 0)
+
+
+    def test_interrupt(self):
+        self.emulator.signal = 0
+        timer = threading.Timer(0.2, self.rb.interrupt.set)
+        timer.start()
+        start = time.monotonic()
+        self.assertFalse(self.rb.wait_for_good_signal())
+        self.assertLess(time.monotonic() - start, rockblock.RESCAN_DELAY)
+        timer.join()
+
+        # While it's set, a failed session isn't retried.
+        self.emulator.signal = 5
+        self.emulator.session_failure_rate = 1.0
+        self.assertFalse(self.rb.sendMessage(b'+14158008000:Hi'))
+        self.assertEqual(self.emulator.stats['sessions'], 1)
+        self.assertEqual(self.recorder.tx_failed, [18])
+
+        self.rb.interrupt.clear()
+        self.emulator.session_failure_rate = 0.0
+        self.assertTrue(self.rb.sendMessage(b'+14158008000:Hi'))
+
+
+    def test_resync_stale(self):
+        # Leftovers from an earlier command.
+        self.emulator.inject(b'AT+CSQ\r\r\n+CSQ:1\r\n\r\nOK\r\n')
+        self.assertTrue(self.rb.ping())
+        self.assertEqual(self.rb.requestSignalStrength(), 5)
+
+
+    def test_resync_noise(self):
+        self.emulator.inject(b'\x00\xfe\x81garbage\xff\r\n\x80')
+        self.assertEqual(self.rb.getSerialIdentifier(), DEFAULT_IMEI)
+
+
+    def test_resync_brownout(self):
+        # The port fails mid-read, and the modem comes back with its
+        # volatile settings reset.
+        def brownout(size=1):
+            self.emulator.ring_alerts = False
+            raise serial.SerialException('device disconnected')
+        old_serial = self.rb.s
+        with patch.object(old_serial, 'read', side_effect=brownout):
+            self.assertEqual(self.rb.requestSignalStrength(), 5)
+        self.assertIsNot(self.rb.s, old_serial)
+        self.assertTrue(self.emulator.ring_alerts)
+
+
+    @patch.object(rockblock, 'RESYNC_SCHEDULE', (0, 0.01, 0.01))
+    @patch.object(rockblock, 'RESYNC_PING_TIMEOUT', 0.1)
+    def test_resync_failure(self):
+        self.emulator.unresponsive = True
+        self.rb.command_timeout = 0.1
+        self.assertFalse(self.rb.ping())
+        self.assertEqual(self.emulator.stats['ignored'], 4)
+
+        self.emulator.unresponsive = False
+        self.assertTrue(self.rb.ping())
@@ -0,0 +1,121 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from holonet import rockblock
+from holonet.rockblock_emulator import RockBlockEmulator
+from holonet.rockblock_stats import LatencyHistogram, RockBlockStats
+from holonet.test.test_rockblock_emulator import Recorder
+
+
+class TestLatencyHistogram(TestCase):
+    def test_percentile(self):
+        h = LatencyHistogram(buckets=(1, 2, 5))
+        self.assertIsNone(h.percentile(50))
+        for v in (0.5, 0.5, 1.5, 3, 10):
+            h.add(v)
+        self.assertEqual(h.counts, [2, 1, 1, 1])
+        self.assertEqual(h.percentile(40), 1)
+        self.assertEqual(h.percentile(50), 2)
+        self.assertEqual(h.percentile(80), 5)
+        self.assertEqual(h.percentile(99), 10)
+        j = h.to_json()
+        self.assertEqual(j['min'], 0.5)
+        self.assertEqual(j['max'], 10)
+        self.assertEqual(j['buckets'], [[1, 2], [2, 1], [5, 1], [None, 1]])
+
+
+class TestRockBlockStats(TestCase):
+    def setUp(self):
+        self.emulator = RockBlockEmulator(seed=1).start()
+        self.rb = rockblock.RockBlock(self.emulator.device, Recorder())
+        self.rb.stats = RockBlockStats()
+
+    def tearDown(self):
+        self.rb.close()
+        self.emulator.stop()
+
+
+    def test_commands(self):
+        self.rb.requestSignalStrength()
+        self.rb.requestSignalStrength()
+        self.rb.sendMessage(b'+14158008000:Hi')
+
+        snap = self.rb.stats.snapshot()
+        csq = snap['commands']['AT+CSQ']
+        self.assertEqual(csq['count'], 3)
+        self.assertEqual(csq['results'], {'OK': 3})
+        self.assertEqual(csq['bytes_out'], 3 * len(b'AT+CSQ\r'))
+        self.assertEqual(
+            csq['bytes_in'],
+            3 * len(b'AT+CSQ\r\r\n+CSQ:5\r\n\r\nOK\r\n'))
+
+        sbdwb = snap['commands']['AT+SBDWB']
+        self.assertEqual(sbdwb['count'], 1)
+        self.assertEqual(sbdwb['bytes_out'],
+                         len(b'AT+SBDWB=15\r+14158008000:Hi') + 2)
+        self.assertEqual(snap['sbdix_mo_status'], {'0': 1})
+        self.assertEqual(snap['sbdix_mt_status'], {'0': 1})
+
+
+    def test_results(self):
+        # Lines other than OK and ERROR don't each get their own count.
+        for line in (b'ERROR', b'+CSQ:1', b'\xffjunk', b''):
+            self.rb._send_command(b'AT')
+            with patch.object(self.rb, '_read_next_line', return_value=line):
+                self.assertFalse(self.rb._read_ok(b'AT'))
+        at = self.rb.stats.snapshot()['commands']['AT']
+        self.assertEqual(at['results'],
+                         {'ERROR': 1, 'unexpected': 2, 'timeout': 1})
+
+
+    def test_resync(self):
+        self.emulator.inject(b'\x00\xfe\r\n')
+        self.rb.requestSignalStrength()
+
+        snap = self.rb.stats.snapshot()
+        csq = snap['commands']['AT+CSQ']
+        self.assertEqual(csq['retries'], 1)
+        self.assertEqual(csq['resyncs'], 1)
+        self.assertEqual(csq['results'], {'OK': 1})
+        self.assertEqual(snap['resyncs'], {'noise_ok': 1})
+
+
+    @patch.object(rockblock, 'SESSION_RETRY_DELAY', 0)
+    def test_session_failures(self):
+        self.emulator.session_failure_rate = 1.0
+        self.rb.messageCheck(ack_ring=False)
+        snap = self.rb.stats.snapshot()
+        self.assertEqual(snap['sbdix_mo_status'], {'18': 3})
+        self.assertEqual(snap['sbdix_mt_status'], {'2': 3})
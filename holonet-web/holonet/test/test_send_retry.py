@@ -0,0 +1,114 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+from unittest import TestCase
+
+from holonet import mailboxes, queue_manager, rockblock
+from holonet.queue_manager import RETRY_BASE_SECS, RETRY_MAX_SECS, \
+    retry_delay
+from holonet.test.queue_manager_tests import QueueManagerTests
+
+
+class TestRetryDelay(TestCase):
+    def test_backoff(self):
+        self.assertEqual(retry_delay(1, rand=lambda: 0.0),
+                         RETRY_BASE_SECS / 2)
+        self.assertEqual(retry_delay(3, rand=lambda: 1.0),
+                         RETRY_BASE_SECS * 4)
+        self.assertEqual(retry_delay(30, rand=lambda: 1.0), RETRY_MAX_SECS)
+        for attempts in range(1, 20):
+            delay = retry_delay(attempts)
+            self.assertGreaterEqual(delay, RETRY_BASE_SECS / 2)
+            self.assertLessEqual(delay, RETRY_MAX_SECS)
+
+
+class TestSendRetry(QueueManagerTests, TestCase):
+    overrides = ((queue_manager, 'max_send_attempts', 3),
+                 (rockblock, 'SESSION_RETRY_DELAY', 0))
+
+    def _retry_now(self):
+        for msg in mailboxes.read_outbox():
+            msg.next_attempt_at = None
+            mailboxes.update_outbox_message(msg)
+
+
+    def test_backoff_then_dead_letter(self):
+        self.emulator.session_failure_rate = 1.0
+        mailboxes.queue_message_send('local', '+14158008000', 'Hello')
+        self.qm.check_outbox()
+        (msg,) = mailboxes.read_outbox()
+        self.assertEqual(msg.attempts, 1)
+        self.assertEqual(msg.last_error, 'The connection was lost')
+        self.assertIsNotNone(msg.next_attempt_at)
+
+        # Not due yet, so we don't even start a session.
+        sessions = self.emulator.stats['sessions']
+        self.qm.check_outbox()
+        self.assertEqual(self.emulator.stats['sessions'], sessions)
+
+        for _ in range(2):
+            self._retry_now()
+            self.qm.check_outbox()
+        self.assertEqual(mailboxes.read_outbox()[0].attempts, 3)
+        self.qm.check_outbox()
+        self.assertEqual(mailboxes.read_outbox(), [])
+        (dead,) = mailboxes.read_dead_letter()
+        self.assertEqual(dead.body, 'Hello')
+        self.assertEqual(dead.failed,
+                         'The connection was lost (after 3 attempts)')
+        (thread_msg,) = mailboxes.get_thread('local', '+14158008000')
+        self.assertEqual(thread_msg.failed, dead.failed)
+        self.assertEqual(self.emulator.mo_sent, [])
+
+
+    def test_permanent_failure(self):
+        mailboxes.queue_message_send('local', '+14158008000', 'Hello')
+        (msg,) = mailboxes.read_outbox()
+        self.qm._mo_loaded = [(msg, None, 1)]
+        self.qm.rockBlockTxFailed(14)
+        self.assertEqual(mailboxes.read_outbox()[0].attempts, 1)
+        self.qm.check_outbox()
+        self.assertEqual(mailboxes.read_outbox(), [])
+        self.assertEqual(mailboxes.read_dead_letter()[0].failed,
+                         'The message is an invalid size')
+
+
+    def test_backoff_does_not_block(self):
+        mailboxes.queue_message_send('local', '+14158008000', 'Stuck')
+        mailboxes.queue_message_send('local', '+14158008000', 'Hello')
+        stuck = mailboxes.read_outbox()[0]
+        self.qm._mo_loaded = [(stuck, None, 1)]
+        self.qm.rockBlockTxFailed(18)
+        self.qm.check_outbox()
+        self.assertEqual(self.emulator.mo_sent, [b'+14158008000:Hello'])
+        self.assertEqual([m.body for m in mailboxes.read_outbox()],
+                         ['Stuck'])
@@ -0,0 +1,144 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+from datetime import datetime, timedelta
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+
+from holonet import signal_scheduler
+from holonet.signal_scheduler import SignalScheduler
+
+
+T0 = datetime(2018, 3, 1, 12, 5)
+
+
+class TestSignalScheduler(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_bad(self, sched, when, n=10):
+        for _ in range(n):
+            sched.record_signal(0, when)
+            sched.record_session(False, when)
+
+
+    def test_no_history(self):
+        s = SignalScheduler()
+        self.assertEqual(s.visibility(T0), signal_scheduler.PRIOR)
+        self.assertFalse(s.is_known_bad(T0))
+        self.assertEqual(s.next_check_delay(False, T0),
+                         signal_scheduler.IDLE_POLL_SECS)
+        self.assertEqual(s.next_check_delay(True, T0),
+                         signal_scheduler.PENDING_POLL_SECS)
+        self.assertEqual(s.signal_attempts(10, T0), 10)
+        self.assertEqual(s.rescan_delay(5, 10, T0), 10)
+
+
+    def test_learning(self):
+        s = SignalScheduler()
+        s.record_signal(0, T0)
+        s.record_signal(-1, T0)
+        # Too few samples to trust yet.
+        self.assertEqual(s.visibility(T0), signal_scheduler.PRIOR)
+
+        self.make_bad(s, T0)
+        self.assertTrue(s.is_known_bad(T0))
+        # Other slots are unaffected.
+        self.assertFalse(s.is_known_bad(T0 + timedelta(minutes=15)))
+
+        for _ in range(20):
+            s.record_signal(5, T0)
+        self.assertFalse(s.is_known_bad(T0))
+
+
+    def test_known_bad(self):
+        s = SignalScheduler()
+        # Bad from 12:00 to 12:45; 12:45 onwards is unknown (PRIOR, which
+        # counts as good).
+        for m in (0, 15, 30):
+            self.make_bad(s, T0.replace(minute=m))
+
+        self.assertEqual(s.next_window(T0), T0.replace(minute=45))
+        self.assertEqual(s.next_check_delay(False, T0),
+                         signal_scheduler.MAX_POLL_SECS)
+        self.assertEqual(s.next_check_delay(False, T0.replace(minute=35)),
+                         10 * 60)
+        self.assertEqual(s.next_check_delay(True, T0.replace(minute=44)),
+                         signal_scheduler.PENDING_POLL_SECS)
+        self.assertEqual(s.signal_attempts(10, T0),
+                         signal_scheduler.BAD_SIGNAL_ATTEMPTS)
+        self.assertEqual([s.rescan_delay(r, 10, T0) for r in range(1, 6)],
+                         [10, 20, 40, 60, 60])
+
+        # Never more than MAX_POLL_SECS.
+        for m in range(45, 60, 15):
+            self.make_bad(s, T0.replace(minute=m))
+        for h in range(13, 24):
+            self.make_bad(s, T0.replace(hour=h, minute=0))
+        self.assertEqual(s.next_check_delay(True, T0),
+                         signal_scheduler.MAX_POLL_SECS)
+
+
+    def test_save_load(self):
+        path = os.path.join(self.tmpdir, 'sub', 'history.json')
+        s = SignalScheduler(path)
+        self.make_bad(s, T0)
+        s.save()
+
+        s2 = SignalScheduler(path)
+        self.assertTrue(s2.is_known_bad(T0))
+
+        with open(path, 'w') as f:
+            f.write('junk')
+        s3 = SignalScheduler(path)
+        self.assertFalse(s3.is_known_bad(T0))
+
+
+    def test_decay(self):
+        s = SignalScheduler()
+        self.make_bad(s, T0)
+        self.assertTrue(s.is_known_bad(T0 + timedelta(days=1)))
+        # With no new observations, the slot is eventually tried again.
+        later = T0 + 3 * signal_scheduler.DECAY_HALF_LIFE
+        self.assertFalse(s.is_known_bad(later))
+        self.assertAlmostEqual(s.visibility(later + timedelta(days=365)),
+                               signal_scheduler.PRIOR)
+
+        # New observations start from the decayed rate.
+        s.record_signal(0, later)
+        self.assertLess(s.visibility(later), 0.5)
+        self.assertGreater(s.visibility(later), 0.2)
@@ -0,0 +1,102 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from holonet import holonetGPIO, mailboxes, queue_manager
+from holonet.status import StatusBoard
+
+
+class TestStatusBoard(TestCase):
+    def test_update(self):
+        board = StatusBoard()
+        first = board.get()
+        second = board.update(signal_strength=3, signal_ok=True)
+        self.assertEqual(second.version, first.version + 1)
+        self.assertEqual(first.signal_strength, 0)
+        self.assertIs(board.get(), second)
+        # No change, no new version.
+        self.assertIs(board.update(signal_strength=3), second)
+
+
+    def test_subscribe(self):
+        board = StatusBoard()
+        changes = []
+
+        def callback(old, new):
+            changes.append((old.mt_queued, new.mt_queued))
+
+        board.subscribe(callback)
+        board.update(mt_queued=2)
+        board.modify(lambda s: {'mt_queued': s.mt_queued - 1})
+        self.assertEqual(changes, [(0, 2), (2, 1)])
+
+
+    def test_subscriber_order(self):
+        board = StatusBoard()
+        versions = []
+
+        def callback(old, new):
+            versions.append((old.version, new.version))
+
+        def count():
+            for _ in range(100):
+                board.modify(lambda s: {'mt_queued': s.mt_queued + 1})
+
+        board.subscribe(callback)
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(versions, [(v, v + 1) for v in range(400)])
+
+
+class TestPendingSenders(TestCase):
+    @patch.object(queue_manager, 'status_board', StatusBoard())
+    @patch.object(holonetGPIO.HolonetGPIO, 'set_led_message_pending')
+    @patch.object(mailboxes, 'mark_thread_read')
+    def test_led(self, mark_thread_read, set_led):
+        queue_manager.status_board.subscribe(
+            queue_manager._update_message_pending_led)
+        queue_manager.status_board.update(
+            pending_senders=frozenset(['+14158008000', '+14158008001']))
+        queue_manager.clear_message_pending('+14158008000')
+        queue_manager.clear_message_pending('+14158008001')
+        queue_manager.clear_message_pending('+14158008001')
+        self.assertEqual(queue_manager.get_status().pending_senders,
+                         frozenset())
+        self.assertEqual([c[0] for c in set_led.call_args_list],
+                         [(True,), (False,)])
+        mark_thread_read.assert_called_with('local', '+14158008001')
@@ -0,0 +1,167 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+import os
+import os.path
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from holonet import mailbox_store, mailboxes
+from holonet.mailbox_store import DirectoryStore
+from holonet.message import Message
+from holonet.summary_index import SummaryIndex, snippet
+
+
+def _message(body, sender=None, recipient=None, timestamp='T'):
+    msg = Message()
+    msg.sender = sender
+    msg.recipient = recipient
+    msg.body = body
+    msg.timestamp = timestamp
+    return msg
+
+
+class TestSummaryIndex(TestCase):
+    def test_summaries(self):
+        index = SummaryIndex()
+        index.add_message('local', '+14158008000', '1.json',
+                          _message('Hello', sender='+14158008000'),
+                          unread=True)
+        index.add_message('local', '+14158008001', '2.json',
+                          _message('Hi', recipient='+14158008001'))
+        index.add_message('local', '+14158008000', '3.json',
+                          _message('Again', sender='+14158008000'),
+                          unread=True)
+        # Older than what we have, so only the unread count changes.
+        index.add_message('local', '+14158008001', '0.json',
+                          _message('Old', sender='+14158008001'),
+                          unread=True)
+
+        (first, second) = index.summaries('local')
+        self.assertEqual(
+            (first.recipient, first.recipient_printable, first.snippet,
+             first.direction, first.unread),
+            ('+14158008000', '(415) 800-8000', 'Again', 'in', 2))
+        self.assertEqual((second.recipient, second.snippet, second.unread),
+                         ('+14158008001', 'Hi', 1))
+        self.assertEqual(index.summaries('nobody'), [])
+
+        self.assertTrue(index.mark_read('local', '+14158008000'))
+        self.assertFalse(index.mark_read('local', '+14158008000'))
+        self.assertTrue(index.remove('local', '+14158008001'))
+        self.assertFalse(index.remove('local', '+14158008001'))
+        reloaded = SummaryIndex(index.to_json_str())
+        (only,) = reloaded.summaries('local')
+        self.assertEqual((only.recipient, only.unread), ('+14158008000', 0))
+
+
+    def test_bad_data(self):
+        self.assertRaises(ValueError, SummaryIndex, '{"thr')
+        self.assertRaises(ValueError, SummaryIndex, '{}')
+
+
+    def test_snippet(self):
+        self.assertEqual(snippet(' Two\n lines '), 'Two lines')
+        self.assertEqual(snippet('x' * 100, 10), 'x' * 9 + '…')
+        self.assertEqual(snippet(None), '')
+
+
+class TestMailboxSummaries(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patch = patch.object(mailboxes, 'mailboxes_root', self.tmpdir)
+        self.patch.start()
+
+    def tearDown(self):
+        mailboxes.close_store()
+        self.patch.stop()
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_updates(self):
+        mailboxes.save_message_to_inbox(b'+14158008001:One')
+        mailboxes.save_message_to_inbox(b'+14158008001:Two')
+        mailboxes.accept_all_inbox_messages()
+        time.sleep(0.002)
+        mailboxes.queue_message_send('local', '+14158008000', 'Out')
+
+        self.assertEqual(
+            [(t.recipient, t.snippet, t.unread)
+             for t in mailboxes.list_threads('local')],
+            [('+14158008000', 'Out', 0), ('+14158008001', 'Two', 2)])
+
+        mailboxes.mark_thread_read('local', '+14158008001')
+        mailboxes.delete_thread('local', '+14158008000')
+        self.assertEqual(
+            [(t.recipient, t.unread) for t in mailboxes.list_threads('local')],
+            [('+14158008001', 0)])
+
+
+    def test_rebuild(self):
+        mailboxes.save_message_to_inbox(b'+14158008001:One')
+        mailboxes.accept_all_inbox_messages()
+        mailboxes.queue_message_send('local', '+14158008000', 'Out')
+        mailboxes.close_store()
+        os.remove(os.path.join(self.tmpdir, mailbox_store.THREAD_SUMMARIES))
+
+        self.assertEqual(
+            sorted((t.recipient, t.snippet, t.direction)
+                   for t in mailboxes.list_threads('local')),
+            [('+14158008000', 'Out', 'out'), ('+14158008001', 'One', 'in')])
+
+
+    def test_lose_power(self):
+        mailboxes.list_threads('local')
+        # Lose power after the commit, before any of it is applied.
+        with patch.object(DirectoryStore, '_apply'):
+            mailboxes.save_message_to_inbox(b'+14158008001:One')
+            mailboxes.accept_all_inbox_messages()
+        mailboxes._store()._journal.close()
+        mailboxes._store_instance = None
+        mailboxes._summary_index = None
+
+        (summary,) = mailboxes.list_threads('local')
+        self.assertEqual((summary.recipient, summary.snippet, summary.unread),
+                         ('+14158008001', 'One', 1))
+
+
+    def test_rollback(self):
+        with self.assertRaises(KeyError):
+            with mailboxes._summary_transaction() as (_, summaries):
+                summaries.add_message(
+                    'local', '+14158008000', '1.json',
+                    _message('Never', recipient='+14158008000'))
+                raise KeyError()
+        self.assertEqual(mailboxes.list_threads('local'), [])
@@ -0,0 +1,97 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+from unittest import TestCase
+
+from holonet import wire_format
+from holonet.packing import MAX_PAYLOAD
+from holonet.wire_format import WireFormatException, decode, encode
+
+
+NUMBER = '+14158008000'
+
+
+class TestWireFormat(TestCase):
+    def check(self, number, body):
+        data = encode(number, body)
+        self.assertTrue(wire_format.is_binary(data))
+        self.assertEqual(decode(data), (number, body))
+        return data
+
+
+    def test_gsm7(self):
+        # Every length, to cover every septet alignment.
+        for n in range(20):
+            self.check(NUMBER, 'abcdefghijklmnopqrst'[:n])
+            self.check(NUMBER, '\r' * n)
+            self.check(NUMBER, '@' * n)
+        self.check(NUMBER, wire_format.GSM7_BASIC.replace('\x1b', ''))
+        self.check(NUMBER, 'Ext: {[~|^]} \\ €10\f')
+
+
+    def test_utf8(self):
+        data = self.check(NUMBER, 'Snow ☃ today \U0001f600')
+        self.assertTrue(data[1] & wire_format.FLAG_UTF8)
+
+
+    def test_numbers(self):
+        for number in ('+1', '+44', '+441518008000', '+123456789012345'):
+            self.check(number, 'Hi')
+        for number in ('', '+', '4158008000', '+1415800800x',
+                       '+1234567890123456'):
+            self.assertRaises(WireFormatException, encode, number, 'Hi')
+
+
+    def test_size(self):
+        # Number: 3 bytes of header and 6 of BCD, instead of 13 bytes.
+        self.assertEqual(len(encode(NUMBER, '')), 9)
+        # Text: 8 GSM-7 characters in 7 bytes.
+        body = 'x' * ((MAX_PAYLOAD - 9) * 8 // 7)
+        self.assertEqual(len(encode(NUMBER, body)), MAX_PAYLOAD)
+        self.assertGreater(len(body), MAX_PAYLOAD - len(NUMBER) - 1)
+
+
+    def test_legacy(self):
+        self.assertEqual(decode(b'+14158008000:Hi: there'),
+                         (NUMBER, 'Hi: there'))
+        self.assertEqual(wire_format.decode_record(encode(NUMBER, 'Hi')),
+                         b'+14158008000:Hi')
+        self.assertEqual(
+            decode(wire_format.encode_record(b'+14158008000:Hi')),
+            (NUMBER, 'Hi'))
+
+
+    def test_malformed(self):
+        for data in (b'no colon', b'\xfa\x10', b'\xfa\x20\x00',
+                     b'\xfa\x10\x10', b'\xfa\x10\x0b\x14\x15',
+                     b'\xfa\x10\x02\xab', b'\xfa\x11\x01\x10\xff'):
+            self.assertRaises(WireFormatException, decode, data)
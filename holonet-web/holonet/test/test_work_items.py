@@ -0,0 +1,165 @@
+'''
+
+Copyright 2017 Hadi Esiely
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+'''
+
+from datetime import datetime, timedelta
+from threading import Event
+from unittest import TestCase
+from unittest.mock import patch
+
+from holonet import queue_manager
+from holonet.status import StatusBoard
+
+
+class FakeExecutor(object):
+    def __init__(self):
+        self.callbacks = []
+
+    def submit(self, f, *args):
+        self.callbacks.append((f, args))
+
+    def run(self):
+        while self.callbacks:
+            (f, args) = self.callbacks.pop(0)
+            f(*args)
+
+
+class Recorder(object):
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name,) + args)
+
+
+class TestWorkItems(TestCase):
+    def setUp(self):
+        self.loop = FakeExecutor()
+        self.qm = Recorder()
+        self.patches = [
+            patch.object(queue_manager, '_executor', self.loop),
+            patch.object(queue_manager, '_work_running', None),
+            patch.object(queue_manager, '_work_interrupt', Event()),
+            patch.object(queue_manager, '_queue_manager', self.qm),
+            patch.object(queue_manager, '_work_heap', []),
+            patch.object(queue_manager, '_work_pending', {}),
+            patch.object(queue_manager, 'status_board', StatusBoard()),
+            patch.object(queue_manager, '_last_signal_request',
+                         datetime.min),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+
+    def test_coalesce(self):
+        for _ in range(5):
+            queue_manager.request_signal_strength()
+            queue_manager.get_messages(ack_ring=False)
+            queue_manager.check_outbox()
+        self.loop.run()
+        self.assertEqual(self.qm.calls, [('request_signal_strength',),
+                                         ('get_messages', False)])
+
+        # Once it has run, it can be asked for again.
+        queue_manager.check_outbox()
+        self.loop.run()
+        self.assertEqual(self.qm.calls[-1], ('check_outbox',))
+
+
+    def test_ring_first(self):
+        queue_manager.check_outbox()
+        queue_manager.request_signal_strength()
+        queue_manager.get_messages(ack_ring=False)
+        queue_manager.get_messages(ack_ring=True)
+        queue_manager.get_messages(ack_ring=False)
+        self.loop.run()
+        self.assertEqual(self.qm.calls, [('get_messages', True),
+                                         ('check_outbox',),
+                                         ('request_signal_strength',)])
+        self.assertEqual(queue_manager._work_heap, [])
+
+
+    def test_fresh_signal(self):
+        queue_manager.status_board.update(
+            signal_time=datetime.utcnow() - timedelta(seconds=5))
+        queue_manager.request_signal_strength()
+        self.assertEqual(self.loop.callbacks, [])
+        queue_manager.request_signal_strength(max_age=1)
+        self.loop.run()
+        self.assertEqual(self.qm.calls, [('request_signal_strength',)])
+
+
+    def test_recent_request(self):
+        # No reading has come back yet, but one was asked for just now.
+        queue_manager.request_signal_strength()
+        self.loop.run()
+        queue_manager.request_signal_strength()
+        self.assertEqual(self.loop.callbacks, [])
+        self.assertEqual(self.qm.calls, [('request_signal_strength',)])
+
+        queue_manager._last_signal_request -= timedelta(seconds=60)
+        queue_manager.request_signal_strength()
+        self.loop.run()
+        self.assertEqual(len(self.qm.calls), 2)
+
+
+    def test_interrupt(self):
+        interrupted = []
+
+        def check_outbox():
+            # Work that's no more urgent waits its turn.
+            queue_manager.request_signal_strength()
+            interrupted.append(queue_manager._work_interrupt.is_set())
+            queue_manager.get_messages(ack_ring=True)
+            interrupted.append(queue_manager._work_interrupt.is_set())
+
+        def get_messages(ack_ring):
+            interrupted.append(queue_manager._work_interrupt.is_set())
+            self.qm.calls.append(('get_messages', ack_ring))
+
+        self.qm.check_outbox = check_outbox
+        self.qm.get_messages = get_messages
+        queue_manager.check_outbox()
+        self.loop.run()
+        self.assertEqual(interrupted, [False, True, False])
+        self.assertEqual(self.qm.calls, [('get_messages', True),
+                                         ('request_signal_strength',)])
+        self.assertIsNone(queue_manager._work_running)
+
+
+    def test_ring_alert(self):
+        queue_manager.QueueManager.rockBlockRingAlert(self.qm)
+        self.loop.run()
+        self.assertEqual(self.qm.calls, [('get_messages', True)])
@@ -98,8 +98,48 @@ def rm_f(filename):
 
 
 def utcnow_str():
-    return datetime.utcnow().isoformat('T')
+    return utc_str(datetime.utcnow())
+
+
+def utc_str(dt):
+    return dt.isoformat('T')
+
+
+def parse_utc_str(s):
+    """The inverse of utc_str.  Note that isoformat leaves out the
+       microseconds when they are zero."""
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in s else '%Y-%m-%dT%H:%M:%S'
+    return datetime.strptime(s, fmt)
 
 
 def timestamp_filename(ts, ext):
     return '%s.%s' % (ts.replace(':', '.'), ext)
+
+
+def write_file(path, data, sync=True):
+    """Write data (str or bytes) to path, creating the directory if
+       necessary.  The file is written to a temporary name and then renamed,
+       so path always has either the old or the new contents.  If sync is
+       set, the file and then the rename are fsync'd, so that they survive
+       losing power; otherwise that's up to the caller."""
+    mkdir_p(os.path.dirname(path))
+
+    mode = 'w' if isinstance(data, str) else 'wb'
+    tmpfile = '%s.tmp' % path
+    with open(tmpfile, mode) as f:
+        f.write(data)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.rename(tmpfile, path)
+    if sync:
+        fsync_dir(os.path.dirname(path))
+
+
+def fsync_dir(path):
+    """Make a rename in (or an unlink from) the given directory durable."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,250 @@
+'''
+
+Copyright 2017 Ewan Mellor
+
+Changes authored by Hadi Esiely:
+Copyright 2018 The Johns Hopkins University Applied Physics Laboratory LLC.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+
+1. Redistributions of source code must retain the above copyright notice,
+this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright notice,
+this list of conditions and the following disclaimer in the documentation
+and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from this
+software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+A compact binary encoding of a message record.
+
+The legacy wire format is "number:body" in UTF-8.  The binary format is:
+
+    TAG_BINARY (1 byte)
+    flags (1 byte): the format version in the top four bits, then
+        FLAG_UTF8 if the body is UTF-8 rather than GSM-7, and FLAG_PADDED
+        if the last septet of the body is padding
+    number of digits in the phone number (1 byte)
+    the digits of the phone number, in BCD, two to a byte, high nibble first
+    the body, either in GSM-7 (packed seven bits per character, as in SMS)
+        or in UTF-8 if it has characters that GSM-7 can't represent
+
+The phone number must be in E.164 format, and its leading + is implied.
+decode() understands the legacy format too.
+'''
+
+
+TAG_BINARY = 0xfa
+VERSION = 1
+
+FLAG_UTF8 = 0x01
+FLAG_PADDED = 0x02
+
+MAX_DIGITS = 15
+
+# 3GPP TS 23.038 default alphabet.  Index 0x1b is the escape to the
+# extension table.
+GSM7_BASIC = (
+    '@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !"#¤%&\'()*+,-./0123456789:;<=>?'
+    '¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà'
+)
+GSM7_ESCAPE = 0x1b
+GSM7_EXTENSION = {
+    '\f': 0x0a, '^': 0x14, '{': 0x28, '}': 0x29, '\\': 0x2f, '[': 0x3c,
+    '~': 0x3d, ']': 0x3e, '|': 0x40, '€': 0x65,
+}
+
+_GSM7_BASIC_INDEX = {c: i for (i, c) in enumerate(GSM7_BASIC)
+                     if i != GSM7_ESCAPE}
+_GSM7_EXTENSION_CHARS = {v: k for (k, v) in GSM7_EXTENSION.items()}
+
+
+class WireFormatException(Exception):
+    pass
+
+
+def is_binary(data):
+    return len(data) > 0 and data[0] == TAG_BINARY
+
+
+def encode(number, body):
+    """
+    Args:
+        number (str): The phone number, in E.164 format.
+        body (str): The message text.
+
+    Returns: the binary record.
+
+    Raises: WireFormatException if the number isn't in E.164 format.
+    """
+    digits = number[1:] if number.startswith('+') else None
+    if not digits or not digits.isdigit() or len(digits) > MAX_DIGITS:
+        raise WireFormatException('Cannot encode number %s.' % number)
+
+    flags = VERSION << 4
+    septets = gsm7_encode(body)
+    if septets is None:
+        flags |= FLAG_UTF8
+        text = body.encode('utf-8')
+    else:
+        # If the septets would leave 7 spare bits in the last byte, the
+        # decoder would read an extra character out of them.
+        if len(septets) * 7 % 8 == 1:
+            flags |= FLAG_PADDED
+            septets.append(0)
+        text = pack_septets(septets)
+
+    return bytes([TAG_BINARY, flags, len(digits)]) + bcd_encode(digits) + \
+        text
+
+
+def decode(data):
+    """
+    Args:
+        data (bytes): A binary record, or a legacy one.
+
+    Returns: a tuple (number, body), both str.
+
+    Raises: WireFormatException if the record is malformed.
+    """
+    if not is_binary(data):
+        try:
+            (number, body) = data.decode('utf-8').split(':', 1)
+        except ValueError:
+            raise WireFormatException('Malformed legacy record.')
+        return (number, body)
+
+    if len(data) < 3:
+        raise WireFormatException('Truncated header.')
+    flags = data[1]
+    if flags >> 4 != VERSION:
+        raise WireFormatException('Unsupported version %d.' % (flags >> 4))
+    ndigits = data[2]
+    if ndigits > MAX_DIGITS:
+        raise WireFormatException('Bad number length %d.' % ndigits)
+    text_start = 3 + (ndigits + 1) // 2
+    if len(data) < text_start:
+        raise WireFormatException('Truncated number.')
+
+    number = '+' + bcd_decode(data[3:text_start], ndigits)
+    text = data[text_start:]
+    if flags & FLAG_UTF8:
+        try:
+            body = text.decode('utf-8')
+        except UnicodeDecodeError as err:
+            raise WireFormatException(str(err))
+    else:
+        septets = unpack_septets(text)
+        if flags & FLAG_PADDED:
+            septets = septets[:-1]
+        body = gsm7_decode(septets)
+    return (number, body)
+
+
+def encode_record(record):
+    """Returns: the given legacy record in the binary format.
+
+       Raises: WireFormatException if it can't be encoded."""
+    return encode(*decode(record))
+
+
+def decode_record(data):
+    """Returns: the given binary record in the legacy format."""
+    (number, body) = decode(data)
+    return ('%s:%s' % (number, body)).encode('utf-8')
+
+
+def bcd_encode(digits):
+    if len(digits) % 2:
+        digits += '0'
+    return bytes(int(digits[i]) << 4 | int(digits[i + 1])
+                 for i in range(0, len(digits), 2))
+
+
+def bcd_decode(data, ndigits):
+    digits = []
+    for b in data:
+        for nibble in (b >> 4, b & 0x0f):
+            if nibble > 9:
+                raise WireFormatException('Bad BCD digit %x.' % nibble)
+            digits.append(str(nibble))
+    return ''.join(digits[:ndigits])
+
+
+def gsm7_encode(text):
+    """Returns: list of septets, or None if text has characters that GSM-7
+       can't represent."""
+    result = []
+    for c in text:
+        i = _GSM7_BASIC_INDEX.get(c)
+        if i is not None:
+            result.append(i)
+            continue
+        i = GSM7_EXTENSION.get(c)
+        if i is None:
+            return None
+        result += [GSM7_ESCAPE, i]
+    return result
+
+
+def gsm7_decode(septets):
+    result = []
+    escaped = False
+    for s in septets:
+        if escaped:
+            result.append(_GSM7_EXTENSION_CHARS.get(s, ' '))
+            escaped = False
+        elif s == GSM7_ESCAPE:
+            escaped = True
+        else:
+            result.append(GSM7_BASIC[s])
+    return ''.join(result)
+
+
+def pack_septets(septets):
+    """Pack 7-bit values into bytes, least significant bits first."""
+    result = bytearray()
+    acc = 0
+    nbits = 0
+    for s in septets:
+        acc |= s << nbits
+        nbits += 7
+        while nbits >= 8:
+            result.append(acc & 0xff)
+            acc >>= 8
+            nbits -= 8
+    if nbits:
+        result.append(acc)
+    return bytes(result)
+
+
+def unpack_septets(data):
+    """The inverse of pack_septets, except that if there are 7 spare bits
+       at the end, they come out as an extra septet."""
+    result = []
+    acc = 0
+    nbits = 0
+    for b in data:
+        acc |= b << nbits
+        nbits += 8
+        while nbits >= 7:
+            result.append(acc & 0x7f)
+            acc >>= 7
+            nbits -= 7
+    return result